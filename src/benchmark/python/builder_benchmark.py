@@ -0,0 +1,74 @@
+"""
+Compare native_builder.build() with native_parser.parse() followed by modl_creator.process_modl_parsed(), on one
+large document built by repeating the base_tests.json corpus: time, peak memory and the number of tree objects
+created along the way. A lazy build only creates the top-level structures until anything else is used.
+
+Run from this directory with:
+
+    PYTHONPATH=../../main/python python builder_benchmark.py [size_in_kib]
+"""
+import gc
+import sys
+import timeit
+import tracemalloc
+
+import modl_creator
+import native_builder
+import native_parser
+from parser_benchmark import load_corpus
+
+
+def parse_and_process(text: str):
+    return modl_creator.process_modl_parsed(native_parser.parse(text))
+
+
+def count_nodes(root) -> int:
+    """Count the parser and modl_creator objects reachable from root, i.e. the nodes of the trees."""
+    seen = set()
+    pending = [root]
+    count = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if type(obj).__module__ in ('parser', 'modl_creator'):
+            count += 1
+            pending.extend(gc.get_referents(obj))
+        elif isinstance(obj, (list, tuple, dict)):
+            pending.extend(gc.get_referents(obj))
+    return count
+
+
+def measure(name: str, build, text: str, nodes: int):
+    seconds = min(timeit.repeat(lambda: build(text), number=1, repeat=5))
+
+    tracemalloc.start()
+    build(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>15}: {seconds * 1000:8.1f} ms  peak {peak / 1024 / 1024:6.1f} MiB  {nodes} nodes created')
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 256 * 1024
+    inputs = []
+    for text in load_corpus():
+        try:
+            native_builder.build(text)
+        except Exception:
+            continue
+        inputs.append(text)
+    corpus = '\n'.join(inputs) + '\n'
+    text = corpus * max(1, size // len(corpus))
+    print(f'{len(text)} characters')
+    parsed_nodes = count_nodes(native_parser.parse(text))
+    raw_nodes = count_nodes(native_builder.build(text))
+    measure('parse + process', parse_and_process, text, parsed_nodes + raw_nodes)
+    measure('build', native_builder.build, text, raw_nodes)
+    lazy_nodes = count_nodes(native_builder.build(text, lazy=True))
+    measure('lazy build', lambda t: native_builder.build(t, lazy=True), text, lazy_nodes)
+
+
+if __name__ == '__main__':
+    main()
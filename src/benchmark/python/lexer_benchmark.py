@@ -0,0 +1,59 @@
+"""
+Compare the throughput of the generated MODLLexer and the regex lexer on one large document built by
+repeating the base_tests.json corpus.
+
+Run from this directory with:
+
+    PYTHONPATH=../../main/python python lexer_benchmark.py [size_in_kib] [repeats]
+"""
+import json
+import sys
+import timeit
+
+from antlr4 import CommonTokenStream, InputStream
+
+import lexer
+from generated.MODLLexer import MODLLexer
+
+CORPUS = '../../test/json/base_tests.json'
+
+
+def load_document(size: int) -> str:
+    with open(CORPUS) as f:
+        inputs = [t['input'] for t in json.load(f)]
+    # Only keep inputs that lex cleanly, so both lexers do the same work
+    usable = []
+    for text in inputs:
+        try:
+            lexer.tokenize(text)
+        except ValueError:
+            continue
+        usable.append(text)
+    corpus = '\n'.join(usable) + '\n'
+    return corpus * max(1, size // len(corpus))
+
+
+def run(make_lexer, text: str, repeats: int) -> float:
+    def lex():
+        CommonTokenStream(make_lexer(InputStream(text))).fill()
+    return min(timeit.repeat(lex, number=1, repeat=repeats))
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 256 * 1024
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    text = load_document(size)
+    print(f'{len(text)} characters, {len(lexer.tokenize(text)[0])} tokens, best of {repeats}')
+
+    timings = {
+        'MODLLexer': run(MODLLexer, text, repeats),
+        'ModlLexer': run(lexer.ModlLexer, text, repeats),
+        'tokenize': min(timeit.repeat(lambda: lexer.tokenize(text), number=1, repeat=repeats)),
+    }
+    for name, timing in timings.items():
+        print(f'{name:>10}: {timing * 1000:8.1f} ms  {len(text) / timing / 1024:8.1f} KiB/s')
+    print(f'ModlLexer speedup: {timings["MODLLexer"] / timings["ModlLexer"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
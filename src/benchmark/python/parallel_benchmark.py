@@ -0,0 +1,45 @@
+"""
+Compare parser.parse() with parallel_parser.parse() on one large document built by repeating the
+base_tests.json corpus.
+
+Run from this directory with:
+
+    PYTHONPATH=../../main/python python parallel_benchmark.py [size_in_kib] [workers] [backend]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import parallel_parser
+import parser
+from parser_benchmark import load_corpus
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 64 * 1024
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    backend = sys.argv[3] if len(sys.argv) > 3 else parser.ANTLR_BACKEND
+    corpus = '\n'.join(load_corpus()) + '\n'
+    text = corpus * max(1, size // len(corpus))
+
+    with ProcessPoolExecutor(workers) as executor:
+        # Start the worker processes before timing anything
+        list(executor.map(parallel_parser.split_points, ['a=1'] * workers))
+        print(f'{len(text)} characters, {backend} backend, {workers} workers')
+
+        start = time.perf_counter()
+        expected = parser.parse(text, backend)
+        serial = time.perf_counter() - start
+        print(f'  serial: {serial * 1000:8.1f} ms')
+
+        start = time.perf_counter()
+        actual = parallel_parser.parse(text, backend, executor=executor,
+                                       chunk_size=len(text) // (4 * workers) + 1)
+        parallel = time.perf_counter() - start
+        print(f'parallel: {parallel * 1000:8.1f} ms  ({serial / parallel:.1f}x)')
+        assert len(expected.structures) == len(actual.structures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Compare the throughput of the ANTLR and native parser backends over the base_tests.json corpus.
+
+Run from this directory with:
+
+    PYTHONPATH=../../main/python python parser_benchmark.py [repeats]
+"""
+import json
+import sys
+import timeit
+
+import parser
+
+CORPUS = '../../test/json/base_tests.json'
+
+
+def load_corpus():
+    with open(CORPUS) as f:
+        inputs = [t['input'] for t in json.load(f)]
+    # Only keep inputs that both backends can parse
+    usable = []
+    for text in inputs:
+        try:
+            parser.parse(text, parser.ANTLR_BACKEND)
+            parser.parse(text, parser.NATIVE_BACKEND)
+        except Exception:
+            continue
+        usable.append(text)
+    return usable
+
+
+def run(backend: str, inputs, repeats: int) -> float:
+    def parse_all():
+        for text in inputs:
+            parser.parse(text, backend)
+    return min(timeit.repeat(parse_all, number=1, repeat=repeats))
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    inputs = load_corpus()
+    size = sum(len(text) for text in inputs)
+    print(f'{len(inputs)} documents, {size} characters, best of {repeats}')
+
+    timings = {}
+    for backend in (parser.ANTLR_BACKEND, parser.NATIVE_BACKEND):
+        timings[backend] = run(backend, inputs, repeats)
+        print(f'{backend:>8}: {timings[backend] * 1000:8.1f} ms  {size / timings[backend] / 1024:8.1f} KiB/s')
+    print(f'Native speedup: {timings[parser.ANTLR_BACKEND] / timings[parser.NATIVE_BACKEND]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Time modl_creator.process_modl_parsed() on its own, per parsed node, for an array-heavy and a map-heavy document.
+The documents are parsed once up front with the native parser, so only the processing is timed.
+
+Run from this directory with:
+
+    PYTHONPATH=../../main/python python process_benchmark.py [records]
+"""
+import sys
+import timeit
+
+import modl_creator
+import native_parser
+from builder_benchmark import count_nodes
+
+
+def array_heavy(records: int) -> str:
+    return '\n'.join(f'r{i}=[{i};x{i};"q";true;false;null;[1;2;3];a:b:c]' for i in range(records))
+
+
+def map_heavy(records: int) -> str:
+    return '\n'.join(f'r{i}=(a={i};b=x{i};c="q";d=true;e=null;f=(g=1;h=2;i=(j=k)))' for i in range(records))
+
+
+def measure(name: str, text: str):
+    parsed = native_parser.parse(text)
+    nodes = count_nodes(parsed)
+    seconds = min(timeit.repeat(lambda: modl_creator.process_modl_parsed(parsed), number=1, repeat=5))
+    print(f'{name:>11}: {seconds * 1000:8.1f} ms  {nodes} parsed nodes  {seconds * 1e9 / nodes:6.0f} ns per node')
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    measure('array heavy', array_heavy(records))
+    measure('map heavy', map_heavy(records))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+A process-wide cache of imported MODL files, so that a shared class or config file imported by every record is
+only read and parsed once, rather than once per record.
+
+Entries are keyed by the resolved path of the file (and the parser backend), and hold the RawModlObject that
+modlc.load_file() returns. The interpreter never modifies a RawModlObject, so a cached one can be interpreted any
+number of times. An entry is revalidated against the file's size, modification time and inode at most once every
+revalidate_seconds, and reloaded if any of them have changed.
+
+Loading is single-flight: when several threads import the same file at once, one of them loads it and the others
+wait for its result.
+
+    cache = ImportCache(max_entries=64, revalidate_seconds=5)
+    ModlInterpreter(import_cache=cache)
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import modlc
+import parser
+from modl_creator import RawModlObject
+from parse_cache import _deep_sizeof
+
+
+def _signature(location: str):
+    stat = os.stat(location)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class _Entry:
+    __slots__ = ('raw_modl', 'signature', 'size', 'checked')
+
+    def __init__(self, raw_modl: RawModlObject, signature, size: int, checked: float):
+        self.raw_modl = raw_modl
+        self.signature = signature
+        self.size = size
+        self.checked = checked  # When the signature was last compared with the file's
+
+
+class _Flight:
+    """A load in progress, which other threads can wait for."""
+    __slots__ = ('done', 'raw_modl', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.raw_modl = None
+        self.error = None
+
+
+class ImportCache:
+    """A thread-safe, size-bounded LRU cache of imported RawModlObjects, keyed by resolved path."""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = None, revalidate_seconds: float = 1.0):
+        """
+        :param max_entries: the most entries to keep
+        :param max_bytes: an approximate memory budget for the cached trees, or None for no limit
+        :param revalidate_seconds: how long a cached file is used for before checking whether it has changed
+        """
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> _Entry
+        self._flights = {}  # key -> _Flight, for the loads in progress
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, location: str, backend: str = parser.ANTLR_BACKEND) -> RawModlObject:
+        """Return the RawModlObject for a MODL file, loading it if it isn't cached or has changed.
+        The result is shared with other callers, so it must be treated as read-only."""
+        key = os.path.realpath(location), backend
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.checked < self.revalidate_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.raw_modl
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            # Another thread is already loading (or revalidating) this file
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            with self._lock:
+                self.hits += 1
+            return flight.raw_modl
+
+        try:
+            # The file is stat'ed before it's read, so a change made while reading it is picked up next time
+            signature = _signature(key[0])
+            if entry is not None and entry.signature == signature:
+                with self._lock:
+                    entry.checked = now
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                flight.raw_modl = entry.raw_modl
+                return entry.raw_modl
+
+            with self._lock:
+                self.misses += 1
+            raw_modl = self._load(key[0], backend)
+            flight.raw_modl = raw_modl
+            size = _deep_sizeof(raw_modl) if self.max_bytes is not None else 0
+            self._store(key, _Entry(raw_modl, signature, size, now))
+            return raw_modl
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _load(self, location: str, backend: str) -> RawModlObject:
+        # Uses the compiled form of the file if there's an up to date one
+        return modlc.load_file(location, backend)
+
+    def _store(self, key, entry: _Entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.size
+            if self.max_bytes is not None and entry.size > self.max_bytes:
+                # Too big to cache at all
+                return
+            self._entries[key] = entry
+            self.current_bytes += entry.size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.current_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+# Shared by every interpreter that isn't given a cache of its own
+default_cache = ImportCache()
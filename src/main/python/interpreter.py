@@ -1,23 +1,45 @@
-import logging
-from typing import List, Union, Dict, Any
+import os
+from collections import ChainMap
+from types import MappingProxyType
+from typing import Iterable, Iterator, List, Union
 
 import modl
+import modlc
 import parser
+import tracing
 from modl_creator import RawModlObject, ModlObject, Pair, Structure, Map, ModlValue, Array, String, Number, \
-    process_modl_parsed, ValueConditional, TrueVal, FalseVal, NullVal, MapConditional, ArrayConditional
+    ValueConditional, TrueVal, FalseVal, NullVal, MapConditional, ArrayConditional
+from import_cache import ImportCache, default_cache
 from parser import TopLevelConditional
-from string_transformer import StringTransformer
+from string_transformer import StringTransformer, SymbolTable
 
 
-def interpret(raw_modl: RawModlObject) -> ModlObject:
+def interpret(raw_modl: RawModlObject, backend: str = parser.ANTLR_BACKEND,
+              context: 'InterpreterContext' = None) -> ModlObject:
     """Creates a new interpreter and invokes it against the supplied RawModlObject."""
-    interpreter = ModlInterpreter()
+    interpreter = ModlInterpreter(backend, context=context)
     return interpreter.execute(raw_modl)
 
 
-class RequiresRestart(BaseException):
-    def __init__(self):
-        super().__init__()
+def iter_interpret(raw_structures: Iterable[Structure], backend: str = parser.ANTLR_BACKEND,
+                   context: 'InterpreterContext' = None) -> Iterator[Structure]:
+    """Creates a new interpreter and lazily invokes it against the supplied raw structures."""
+    interpreter = ModlInterpreter(backend, context=context)
+    return interpreter.iter_execute(raw_structures)
+
+
+def build_context(raw_modl: RawModlObject, backend: str = parser.ANTLR_BACKEND) -> 'InterpreterContext':
+    """Interprets a config document, such as a set of *class definitions and variables, once, so that any number
+    of records can then be interpreted against what it defines. Any other structures in it are ignored."""
+    interpreter = ModlInterpreter(backend)
+    interpreter.execute(raw_modl)
+    return InterpreterContext(interpreter)
+
+
+_END = object()
+
+# The built-in o class. Classes are never modified once they're defined, so it can be shared.
+_CLASS_O = MappingProxyType({'*superclass': String('map'), '*name': String('o'), '*output': String('map')})
 
 
 class UnrecognisedInstruction(BaseException):
@@ -25,48 +47,200 @@ class UnrecognisedInstruction(BaseException):
         super().__init__()
 
 
+class ClassRegistry:
+    """
+    The classes an interpreter knows about, by id, with an index of their names. find() looks a class up by name
+    first, where the first class defined with the name wins, and then by id. The name index is rebuilt the next
+    time it's needed after a class is defined or redefined.
+
+    A registry can be an overlay on a parent registry, such as the one in an InterpreterContext. Classes defined in
+    the overlay hide the parent's, which is never modified. A redefined class keeps its place in the order.
+    """
+    __slots__ = ('_classes', '_parent', '_by_name', '_plans', '_read_only')
+
+    def __init__(self, parent: 'ClassRegistry' = None):
+        self._classes = {}  # id -> class details, for the classes defined here rather than in the parent
+        self._parent = parent
+        self._by_name = None
+        self._plans = {}  # The ClassPlans of the classes that have been used, by the name or id they were used by
+        self._read_only = False
+
+    def read_only_copy(self) -> 'ClassRegistry':
+        """A copy of every class, in order, that can't be modified"""
+        registry = ClassRegistry()
+        registry._classes = {key: MappingProxyType(dict(details)) for key, details in self.items()}
+        registry._read_only = True
+        return registry
+
+    def __setitem__(self, key, details: dict):
+        if self._read_only:
+            raise TypeError('ClassRegistry is read-only')
+        self._classes[key] = details
+        self._by_name = None
+        self._plans = {}
+
+    def get(self, key, default=None):
+        """The class with the id"""
+        details = self._classes.get(key)
+        if details is None and self._parent is not None:
+            details = self._parent.get(key)
+        return default if details is None else details
+
+    def find(self, key):
+        """The first class with the name, otherwise the class with the id, or None"""
+        by_name = self._by_name
+        if by_name is None:
+            by_name = self._index()
+        details = by_name.get(key)
+        if details is None:
+            details = self.get(key)
+        return details
+
+    def plan(self, key) -> Union['ClassPlan', None]:
+        """The ClassPlan of the class that find() finds, or None if there isn't one"""
+        if not self._classes and self._parent is not None:
+            # Nothing is defined here, so the parent's plans are the same, and can be shared
+            return self._parent.plan(key)
+        plan = self._plans.get(key)
+        if plan is None:
+            details = self.find(key)
+            if details is None:
+                return None
+            plan = self._plans[key] = ClassPlan(details)
+        return plan
+
+    def _index(self):
+        if not self._classes and self._parent is not None:
+            # Nothing is defined here, so the parent's index is the same
+            by_name = self._parent._by_name
+            if by_name is None:
+                by_name = self._parent._index()
+        else:
+            by_name = {}
+            for details in self.values():
+                for name_key in ('*name', '*n', '*id', '*i'):
+                    name = details.get(name_key)
+                    if isinstance(name, (str, String)):
+                        by_name.setdefault(str(name), details)
+        self._by_name = by_name
+        return by_name
+
+    def __iter__(self):
+        if self._parent is None:
+            return iter(self._classes)
+        return iter(list(self._parent) + [key for key in self._classes if key not in self._parent])
+
+    def __contains__(self, key):
+        return key in self._classes or (self._parent is not None and key in self._parent)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def items(self):
+        return [(key, self.get(key)) for key in self]
+
+    def values(self):
+        return [self.get(key) for key in self]
+
+
+class ClassPlan:
+    """
+    What a class does to the pairs that use it, worked out once from its definition rather than every time it's
+    used. Class definitions are never modified once they're made, so a plan stays valid until the class is
+    redefined.
+    """
+    __slots__ = ('details', 'name', 'superclass', 'loads_numbered_vars', 'contains_pairs', 'params', 'default_pairs')
+
+    def __init__(self, details):
+        self.details = details
+        # The key that pairs using the class are given, or None to keep their own
+        if '*name' in details:
+            self.name = str(details['*name'])
+        elif '*n' in details:
+            self.name = str(details['*n'])
+        else:
+            self.name = None
+        self.superclass = details.get('*superclass', None)
+        self.loads_numbered_vars = any(details.get(key, None) == name
+                                       for key in ('*name', '*n') for name in ('_v', 'var'))
+        # A pair is defined in a class if it has a pair whose key does not start in "_"
+        self.contains_pairs = any(not (key.startswith('_') or key.startswith('*') or key == '?') for key in details)
+        self.params = {key: value for key, value in details.items() if key.startswith('*params')}  # By arity
+        self.default_pairs = [(key, value) for key, value in details.items() if key and key[0] not in ['_', '*', '?']]
+
+
+class InterpreterContext:
+    """
+    The classes and variables defined by a config document, captured from the interpreter that interpreted it.
+    A context is read-only, so it can be shared by any number of interpreters, in any number of threads. Each
+    interpreter puts an empty overlay on top of it, and anything a record defines goes in the overlay.
+    """
+    __slots__ = ('classes', 'symbols', 'pair_names')
+
+    def __init__(self, interpreter: 'ModlInterpreter'):
+        self.classes = interpreter.classes.read_only_copy()
+        self.symbols = interpreter.symbols.read_only_copy()
+        self.pair_names = MappingProxyType(dict(interpreter.pair_names))
+
+
 class ModlInterpreter:
     """Process the RawModlObject and produce a ModlObject.
     The ModlObject is the finished article."""
 
-    def __init__(self):
+    def __init__(self, backend: str = parser.ANTLR_BACKEND, import_cache: Union[ImportCache, None] = default_cache,
+                 context: InterpreterContext = None):
+        """
+        :param backend: the parser backend used for imported files
+        :param import_cache: where imported files are cached, or None to load them afresh every time
+        :param context: the classes and variables of a config document, from build_context(), to start from
+        """
+        self.backend = backend
+        self.import_cache = import_cache
+        self.context = context
         self.indexed_strings = None
-        self.pair_names = set()
-        self.value_pairs = {}
+        self.pair_names = {}  # Used as a set
 
-        self.classes: Dict[str, Any] = {}
-        self.variables = {}
-        self.numbered_variables = {}
+        if context is None:
+            self.classes = ClassRegistry()
+            self.symbols = SymbolTable()
+        else:
+            # The context is shared, so anything defined here goes in front of it rather than into it
+            self.classes = ClassRegistry(context.classes)
+            self.symbols = SymbolTable(context.symbols)
+        # Strings are transformed with the one transformer, which looks object references up in the symbols
+        self.transformer = StringTransformer(symbols=self.symbols)
 
     def execute(self, raw_modl: RawModlObject) -> ModlObject:
-        modl_obj: ModlObject = None
-
-        while modl_obj is None:
-            try:
-                modl_obj = self._attempt_interpret(raw_modl)
-            except RequiresRestart:
-                modl_obj = None  # Try again with updated raw_modl
-
+        modl_obj = ModlObject()
+        modl_obj.add_structures(self._interpret_structures(modl_obj, raw_modl.structures))
         return modl_obj
 
-    def _attempt_interpret(self, raw_modl: RawModlObject) -> ModlObject:
+    def iter_execute(self, raw_structures: Iterable[Structure]) -> Iterator[Structure]:
         """
-        Throws a RequiresRestart exception if the return value should be ignored
-        and the method run again with the same raw_modl input (which may have been
-        updated by the previous attempt to interpret it).
+        Interpret the raw structures one at a time, yielding each interpreted structure as soon as it's ready
+        rather than collecting them into a ModlObject. Classes, value pairs and numbered variables defined by
+        earlier structures are carried forward to later ones.
         """
-        modl_obj = ModlObject()
-        self._load_class_o()  # move to __init__ ?
-        self.pair_names = set()
-        self.value_pairs = {}
-
-        # Interpret raw_modl based on specified config files
-        started_interpreting = False
-        need_restart = False
-        loaded_raw_modl: RawModlObject = None
-        import_file_value: str = None
+        return self._interpret_structures(ModlObject(), raw_structures)
 
-        for raw_struct in raw_modl.structures:
+    def _interpret_structures(self, modl_obj: ModlObject, raw_structures: Iterable[Structure]) -> Iterator[Structure]:
+        self._load_class_o()  # move to __init__ ?
+        if self.context is None:
+            self.pair_names = {}
+        else:
+            self.pair_names = ChainMap({}, self.context.pair_names)
+        self.symbols.clear_value_pairs()
+
+        # The structures of imported files are interpreted in place of the import statement, so anything they
+        # define applies to the structures that follow. Each entry is (structures, location of the file).
+        pending = [(iter(raw_structures), None)]
+        while pending:
+            raw_struct = next(pending[-1][0], _END)
+            if raw_struct is _END:
+                pending.pop()
+                continue
+            if tracing.subscribers:
+                tracing.emit('interpret.structure', {'structure': raw_struct})
             if isinstance(raw_struct, Pair) and (raw_struct.key == '*V' or raw_struct.key == '*VERSION'):
                 # Version number, check it, then ignore it.
                 version = raw_struct.get_value().get_value()
@@ -74,16 +248,14 @@ class ModlInterpreter:
                     raise ValueError(f"Can't handle MODL version '{version}', requires '{modl.MODL_VERSION}'")
                 continue
             if isinstance(raw_struct, Pair) and (raw_struct.key == '*I' or raw_struct.key == '*IMPORT'):
-                if isinstance(raw_struct.get_value(), String):
-                    import_file_value = str(raw_struct.get_value())
-                    loaded_raw_modl = self._load_config_file(import_file_value)
-                    need_restart = True
-                    break
-                elif isinstance(raw_struct.get_value(), Number):
-                    import_file_value = str(raw_struct.get_value())
-                    loaded_raw_modl = self._load_config_file(import_file_value)
-                    need_restart = True
-                    break
+                files = []
+                for value in self._import_values(raw_struct.get_value()):
+                    location = self._config_file_location(str(value))
+                    if any(os.path.abspath(location) == importing for _, importing in pending):
+                        raise ValueError(f"Circular import of '{location}'")
+                    files.append((iter(self._load_file(location).structures), os.path.abspath(location)))
+                # The first file's structures come first
+                pending.extend(reversed(files))
                 continue
             if isinstance(raw_struct, Pair) and (str(raw_struct.key) in ['*class', '*c', '*method', '*m', '?']):
                 key = str(raw_struct.get_key())
@@ -100,23 +272,14 @@ class ModlInterpreter:
                 raise UnrecognisedInstruction()
 
             structures: List[Structure] = self._interpret_raw_struct(modl_obj, raw_struct)
-            modl_obj.add_structures(structures)
-
-        return modl_obj
+            if structures is not None:
+                yield from structures
 
     def _load_class_o(self):
         # TODO Get this to work for including more files during the load. Anything to do?
-        o = {}
-        superclass = String('map')
-        o['*superclass'] = superclass
-
-        name = String('o')
-        o['*name'] = name
-
-        output = String('map')
-        o['*output'] = output
-
-        self.classes['o'] = o
+        # Only (re)defined when needed, since defining a class means rebuilding the registry's name index
+        if self.classes.get('o') is not _CLASS_O:
+            self.classes['o'] = _CLASS_O
 
 
     def _interpret_raw_struct(self, modl_obj, raw_struct):
@@ -208,29 +371,21 @@ class ModlInterpreter:
         return array
 
     def _interpret_number(self, modl_obj: ModlObject, orig_num: Number):
-        """Why?"""
-        if orig_num is None:
-            return None
-        return Number(orig_num.get_value())
+        # Terminals are immutable, so the raw one can be used as it is
+        return orig_num
 
     def _interpret_true(self, true_val: TrueVal):
-        if true_val:
-            return TrueVal()
-        return None
+        return true_val
 
     def _interpret_false(self, false_val: FalseVal):
-        if false_val:
-            return FalseVal()
-        return None
+        return false_val
 
     def _interpret_null(self, null_val: NullVal):
-        if null_val:
-            return NullVal()
-        return None
+        return null_val
 
     def _interpret_string(self, string_val: String):
         if string_val:
-            return self._transform_string(str(string_val))
+            return self.transformer.transform_string(string_val)
         return None
 
     def _interpret_pair(self, modl_obj: ModlObject, raw_pair: Pair,
@@ -251,9 +406,11 @@ class ModlInterpreter:
         orig_key: str = str(raw_pair.get_key())
         new_key: str = orig_key
 
-        if self._have_modl_class(orig_key):
-            new_key = self._transform_key(orig_key)
-            raw_pair = self._transform_value(modl_obj, raw_pair)
+        plan = self.classes.plan(orig_key)
+        if plan is not None:
+            if plan.name is not None:
+                new_key = plan.name
+            raw_pair = self._transform_value(modl_obj, raw_pair, plan)
 
         # IF WE ALREADY HAVE A PAIR WITH THIS NAME, AND THE NAME IS UPPER-CASE, THEN RAISE AN ERROR
         if new_key:
@@ -262,7 +419,7 @@ class ModlInterpreter:
 
         if new_key and ('_'+new_key) not in self.pair_names:
             if parent_pair is None and (not new_key.startswith('%')) and add_to_value_pairs:
-                self.pair_names.add(new_key)
+                self.pair_names[new_key] = None
             self._transform_pair_key(modl_obj, raw_pair, new_key, parent_pair)
 
         # TODO: factor out is_directive(...) or whatever
@@ -271,13 +428,13 @@ class ModlInterpreter:
 
         # A pair with a key that matches a class ID or class name is transformed according to the class definition:
         # TODO Should be able to look up by transformed name too?
-        if self._have_modl_class(orig_key):
+        if plan is not None:
             # The key of the pair is set to the class name.
             # The value of the original standard pair is given the key value in the new map pair
-            if self._generate_modl_class_object(modl_obj, raw_pair, pair, orig_key, new_key, parent_pair):
+            if self._generate_modl_class_object(modl_obj, raw_pair, pair, plan, new_key, parent_pair):
                 return pair  # TODO in all cases?
 
-        pair.key = String(new_key)
+        pair.key = String.unescaped(new_key)
 
         if isinstance(raw_pair.get_value(), Array):
             for value in raw_pair.get_value().get_modl_values():
@@ -297,45 +454,23 @@ class ModlInterpreter:
         else:
             self.add_config_numbered_var(modl_value)
 
-    def _have_modl_class(self, key: str):
-        return self._get_modl_class(key) is not None
-
     def _get_modl_class(self, key: str) -> dict:
-        for class_key, class_details in self.classes.items():
-            for ck, cv in class_details.items():
-                if ck in ['*name', '*n', '*id', '*i']:
-                    if isinstance(cv, str) and cv == key:
-                        return class_details
-                    elif isinstance(cv, String) and cv.get_value() == key:
-                        return class_details
-        return self.classes.get(key, None)
-
-    def _transform_key(self, orig_key):
-        modl_class = self._get_modl_class(orig_key)
-        if modl_class:
-            if '*name' in modl_class:
-                return str(modl_class['*name'])
-            if '*n' in modl_class:
-                return str(modl_class['*n'])
-        return orig_key
-
-    def _transform_value(self, modl_obj, orig_pair: Pair):
-        if self._have_modl_class(orig_pair.get_key()):
-            modl_class = self._get_modl_class(str(orig_pair.get_key()))
-
-            if modl_class.get('*name', None) == '_v' or modl_class.get('*name', None) == 'var' or modl_class.get('*n', None) == '_v' or modl_class.get('*n', None) == 'var':
-                self._load_config_numbered_vars(orig_pair.get_value())
-            else:
-                if modl_class.get('*superclass', None) == 'str':
-                    pair = Pair(key=orig_pair.get_key())
-                    if orig_pair.get_value() is None:
-                        return orig_pair
-                    if isinstance(orig_pair.get_value(), String):
-                        return orig_pair
-                    value = self._make_value_string(modl_obj, orig_pair.get_value())
-                    v = String(str(value))
-                    pair.add_modl_value(v)
-                    return pair
+        return self.classes.find(key)
+
+    def _transform_value(self, modl_obj, orig_pair: Pair, plan: 'ClassPlan'):
+        if plan.loads_numbered_vars:
+            self._load_config_numbered_vars(orig_pair.get_value())
+        else:
+            if plan.superclass == 'str':
+                pair = Pair(key=orig_pair.get_key())
+                if orig_pair.get_value() is None:
+                    return orig_pair
+                if isinstance(orig_pair.get_value(), String):
+                    return orig_pair
+                value = self._make_value_string(modl_obj, orig_pair.get_value())
+                v = String.unescaped(str(value))
+                pair.add_modl_value(v)
+                return pair
         return orig_pair
 
     def _transform_pair_key(self, raw_modl_obj, orig_pair, new_key, parent_pair):
@@ -343,19 +478,19 @@ class ModlInterpreter:
         if transformed_key.startswith('_'):
             transformed_key = transformed_key[1:]
         if not parent_pair:
+            # orig_pair belongs to the raw tree, which may be shared (e.g. by a parse_cache.ParseCache),
+            # so it must not be modified here
             if new_key.startswith('_'):
                 if orig_pair.get_value().is_map():
-                    orig_pair.key = String(transformed_key)
                     new_map = {}
                     self._interpret_map(raw_modl_obj, orig_pair.get_value(), new_map)
                 if orig_pair.get_value().is_array():
-                    orig_pair.key = String(transformed_key)
                     new_list = []
                     self._interpret_array(raw_modl_obj, orig_pair.get_value(), new_list)
             if isinstance(orig_pair.get_value(), String):
-                self.value_pairs[transformed_key] = self._transform_string(str(orig_pair.get_value()))
+                self.symbols.set_value_pair(transformed_key, self.transformer.transform_string(orig_pair.get_value()))
             else:
-                self.value_pairs[transformed_key] = orig_pair.get_value()
+                self.symbols.set_value_pair(transformed_key, orig_pair.get_value())
         else:
             # We have a new definition which must live under an existing mapPair or arrayPair
             if type(parent_pair) == dict:
@@ -382,11 +517,11 @@ class ModlInterpreter:
                                     modl_obj: ModlObject,
                                     raw_pair,
                                     pair: Pair,
-                                    orig_key: str,
+                                    plan: 'ClassPlan',
                                     new_key: str,
                                     parent_pair
                                     ) -> bool:
-        pair.key = String(new_key)
+        pair.key = String.unescaped(new_key)
         num_params = 0
         # if raw_pair.get_value():
         #     if isinstance(raw_pair.get_value(), Map):
@@ -395,14 +530,15 @@ class ModlInterpreter:
         #         num_params = len(raw_pair.get_value().get_modl_values())
         #     else:
         #         num_params = 1
-        num_params = self._get_num_params(raw_pair, num_params)
-        params_key_str: str = '*params' + str(num_params)
-        obj = self._get_modl_class(str(raw_pair.get_key())).get(params_key_str, None)
+        obj = None
+        if plan.params:
+            num_params = self._get_num_params(raw_pair, num_params)
+            obj = plan.params.get('*params' + str(num_params))
         has_params = obj is not None
 
         # If it's not already a map pair, and one of the parent classes in the class hierarchy includes pairs, then it is transformed to a map pair.
-        if self._any_class_contains_pairs(orig_key) or self._map_pair_already(raw_pair) or has_params:
-            pair.key = String(new_key)  # TODO: Do we need to do this again here?!
+        if plan.contains_pairs or self._map_pair_already(raw_pair) or has_params:
+            pair.key = String.unescaped(new_key)  # TODO: Do we need to do this again here?!
             pairs = None
             was_array = False
 
@@ -470,7 +606,7 @@ class ModlInterpreter:
                             except:
                                 pass
 
-                            value_pair.key = String(full_class_name)
+                            value_pair.key = String.unescaped(full_class_name)
                             for vi in value_item.get_modl_values():
                                 value_item_size = 1
                                 if value_item.is_array():
@@ -500,9 +636,9 @@ class ModlInterpreter:
 
                         param_num += 1
 
-                self.add_all_parent_pairs(modl_obj, pair, orig_key)
+                self.add_all_parent_pairs(modl_obj, pair, plan)
                 return True
-            self.add_all_parent_pairs(modl_obj, pair, orig_key)
+            self.add_all_parent_pairs(modl_obj, pair, plan)
             return True
         return False
 
@@ -513,7 +649,7 @@ class ModlInterpreter:
             # If so, then look up the reference!!
             new_value: ModlValue = None
             if key.replace('%', '_', 1) in self.pair_names:
-                stored_value: ModlValue = self.value_pairs.get(key.replace('%', '', 1))
+                stored_value: ModlValue = self.symbols.value_pair(key.replace('%', '', 1))
                 if stored_value.is_map():
                     new_value = Pair(String('obsolete'), stored_value)
                 elif stored_value.is_array():
@@ -532,17 +668,24 @@ class ModlInterpreter:
         else:
             pair.add_modl_value(self._interpret_modl_value(modl_obj, value, parent_pair))
 
-    def _load_config_file(self, location):
-        # We no longer keep configs around - they can be built up dynamically for each new record that comes in
-        # Load the config file!
+    def _import_values(self, value: ModlValue) -> List[ModlValue]:
+        """The values of an import statement that name files, in order"""
+        if isinstance(value, (String, Number)):
+            return [value]
+        if isinstance(value, Array):
+            return [item for item in value.get_modl_values() if isinstance(item, (String, Number))]
+        return []
+
+    def _config_file_location(self, location: str) -> str:
         value = self._transform_string(location)
         if isinstance(value, String):
             location = str(value.get_value())
         else:
             raise ValueError('Expected String for location, but got ' + str(type(value)))
 
-        raw_modl_object = self._load_file(location)
-        return raw_modl_object
+        if not (location.endswith('.modl') or location.endswith('.txt')):
+            location = location + '.modl'
+        return location
 
     def _load_file(self, location):
         """
@@ -552,25 +695,20 @@ class ModlInterpreter:
         if not (location.endswith('.modl') or location.endswith('.txt')):
             location = location + '.modl'
 
-        with open(location, 'r') as config:
-            config_text = config.readlines()
-
-        logging.debug('Loading:', location)
-        logging.debug('Config:', config_text)
-
-        modl_parsed = parser.parse(config_text)
-        raw_modl_object = process_modl_parsed(modl_parsed)
+        if tracing.subscribers:
+            tracing.emit('interpret.load_file', {'location': location})
 
-        return raw_modl_object
+        if self.import_cache is not None:
+            return self.import_cache.load(location, self.backend)
+        # Uses the compiled form of the file if there's an up to date one
+        return modlc.load_file(location, self.backend)
 
     def _transform_string(self, input: str):
-        transformer = StringTransformer(self.value_pairs, self.variables, self.numbered_variables)
-        return transformer.transform(input)
+        # The raw String was unescaped when it was made
+        return self.transformer.transform(input, unescaped=True)
 
     def add_config_numbered_var(self, modl_value):
-        var_num = len(self.numbered_variables)
-        self.numbered_variables[var_num] = modl_value
-        return var_num
+        return self.symbols.add_numbered_variable(modl_value)
 
     def _load_class(self, structure):
         if isinstance(structure, Pair):
@@ -670,16 +808,6 @@ class ModlInterpreter:
 
         return num_params
 
-    def _any_class_contains_pairs(self, orig_key: str) -> bool:
-        # If this class, or any of its parent classes, define any pairs, then return true
-        # A pair is defined in a class if it has a pair whose key does not start in "_"
-        cls = self._get_modl_class(orig_key)
-        for key in cls.keys():
-            if not (key.startswith('_') or key.startswith('*') or key == '?'):
-                return True
-        return False
-
-
     def _map_pair_already(self, orig_pair):
         return isinstance(orig_pair.get_value(), Map)
 
@@ -734,7 +862,7 @@ class ModlInterpreter:
         if value.is_null():
             new_str = 'null'
 
-        value = String(new_str)
+        value = String.unescaped(new_str)
         return value
 
     def _make_new_map_pair(self, modl_obj, pair, raw_pairs, was_array, parent_pair):
@@ -756,7 +884,7 @@ class ModlInterpreter:
                         if map is None:
                             map = Map()
                             pair.add_modl_value(map)
-                        if new_map_pair.get_key() in map.get_keys():
+                        if map.has_key(new_map_pair.get_key()):
                             known_item = True
                         if not known_item:
                             map.add(new_map_pair)
@@ -770,23 +898,22 @@ class ModlInterpreter:
         except:
             pass
 
-        value_pair.key = String(full_class_name)
+        value_pair.key = String.unescaped(full_class_name)
         value_pair.add_modl_value(new_value)
         pair.add_modl_value(value_pair)
 
-    def add_all_parent_pairs(self, modl_obj: ModlObject, pair: Pair, orig_key: str):
-        cls = self._get_modl_class(orig_key)
-        for key in cls.keys():
-            if key and key[0] not in ['_', '*', '?']:
-                if self.pair_has_key(pair, key):
-                    # Only add the new key if it does not already exist in the pair!
-                    continue
-                new_pair = Pair(key=String(key))
-                new_pair.add_modl_value(self._interpret_modl_value(modl_obj, cls[key], parent_pair=None))
-                if pair.get_value() and pair.get_value().is_map():
-                    pair.get_value().add(new_pair)
-                else:
-                    pair.add_modl_value(new_pair)
+    def add_all_parent_pairs(self, modl_obj: ModlObject, pair: Pair, plan: 'ClassPlan'):
+        for key, value in plan.default_pairs:
+            if self.pair_has_key(pair, key):
+                # Only add the new key if it does not already exist in the pair!
+                continue
+            new_pair = Pair(key=String.unescaped(key))
+            # The value can refer to variables, so it's interpreted each time
+            new_pair.add_modl_value(self._interpret_modl_value(modl_obj, value, parent_pair=None))
+            if pair.get_value() and pair.get_value().is_map():
+                pair.get_value().add(new_pair)
+            else:
+                pair.add_modl_value(new_pair)
 
     def pair_has_key(self, pair: Pair, key: str) -> bool:
         if not pair.get_value():
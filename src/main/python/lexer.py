@@ -0,0 +1,405 @@
+"""
+A table-driven lexer for MODL, replacing the ATN simulator in generated/MODLLexer.py.
+
+The rules in grammar/MODLLexer.g4 are regular, so each of its two modes (DEFAULT and CONDITIONAL) is compiled
+into one master regular expression with a named group per token. The name of the group that matched is looked
+up in a table to get the token type, and '{' / '}' push and pop CONDITIONAL mode.
+
+ModlLexer wraps this as an ANTLR TokenSource, so it can be given to a CommonTokenStream for MODLParser in place
+of MODLLexer. tokenize() is the cheaper interface used by native_parser.
+"""
+import re
+from typing import Iterator, List, Tuple, Union
+
+from antlr4 import InputStream, Token
+from antlr4.CommonTokenFactory import CommonTokenFactory
+from antlr4.Lexer import TokenSource
+from antlr4.Recognizer import Recognizer
+
+from generated.MODLLexer import MODLLexer
+
+# Characters which can only appear in a STRING when escaped with ~ or \
+_RESERVED = '#`{}()\\[\\]; =:"\x08\x0c\n\r\t'
+_C_RESERVED = '#{`}(); =:"?/><!|&\x08\x0c\n\r\t\\[\\]'
+
+# '~' and '\' are only taken as an escape when they come before a reserved character, so that there's only one way
+# to match each unit and the regular expressions never backtrack through all the ways of splitting up a STRING.
+# The AMBIGUOUS_RE cases below fall back to matchers that try the other way too.
+_UNIT = f'(?:[\\\\~][{_RESERVED}]|`[^`]*`|[\\\\~](?![{_RESERVED}])|[^{_RESERVED}\\\\~])'
+_BLOCK = f'{_UNIT}+(?:#? +#?{_UNIT}+)*'
+# STRING : '# '? ( ESCAPED | UNRESERVED | GRAVED | HASH_PREFIX )+
+#          ( ('#'? ' '+ '#'?) ( ESCAPED | UNRESERVED | GRAVED )+ )*
+# HASH_PREFIX makes this recursive, but once a '#' has been used as a prefix, spaced out words can be followed
+# by more prefixed words, so the rule is the same as the two regular alternatives below.
+_STRING = f'(?:# )?(?:{_UNIT}*(?:(?:#(?:# )?)+{_BLOCK})+|{_BLOCK})'
+_C_UNIT = f'(?:[\\\\~][{_C_RESERVED}]|`[^`]*`|[\\\\~](?![{_C_RESERVED}])|[^{_C_RESERVED}\\\\~])'
+_C_STRING = f'{_C_UNIT}+(?: +{_C_UNIT}+)*'
+
+NUMBER_RE = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[Ee][+\-]?(?:0|[1-9][0-9]*))?')
+
+_COMMON_RULES = [
+    ('WS', '[ \t]+'),
+    ('NEWLINE', '\r\n|\r|\n'),
+    ('COMMENT', '##[^\n\r]*'),
+    # '"' STRING '"' can only be longer than the plain version, when the STRING has escaped quotes
+    ('QUOTED', f'"{_STRING}"|"[^"]*"'),
+]
+
+_PUNCTUATION_RULES = [
+    ('COLON', ':'), ('EQUALS', '='), ('SC', ';'), ('LBRAC', r'\('), ('RBRAC', r'\)'), ('LSBRAC', r'\['),
+    ('RSBRAC', r'\]'), ('LCBRAC', r'\{'),
+]
+
+_CONDITIONAL_RULES = [
+    ('QMARK', r'\?'), ('FSLASH', '/'), ('GTHAN', '>'), ('LTHAN', '<'), ('AMP', '&'), ('PIPE', r'\|'),
+    ('EXCLAM', '!'), ('RCBRAC', r'\}'),
+]
+
+
+def _master_regex(rules) -> re.Pattern:
+    return re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in rules))
+
+
+DEFAULT_MODE_RE = _master_regex(_COMMON_RULES + [('STRING', _STRING)] + _PUNCTUATION_RULES)
+CONDITIONAL_MODE_RE = _master_regex(
+    _COMMON_RULES + [('STRING', _C_STRING)] + _PUNCTUATION_RULES + _CONDITIONAL_RULES)
+
+# Token type for each group in the master regular expressions, or None for the ones which are skipped
+TOKEN_TYPES = {name: getattr(MODLLexer, name) for name, _ in _PUNCTUATION_RULES + _CONDITIONAL_RULES}
+TOKEN_TYPES.update(WS=None, COMMENT=None, NEWLINE=MODLLexer.NEWLINE, QUOTED=MODLLexer.QUOTED,
+                   STRING=MODLLexer.STRING)
+
+# NULL, TRUE, FALSE and NUMBER take priority over STRING when they match the same text
+KEYWORDS = {
+    '000': MODLLexer.NULL, 'null': MODLLexer.NULL, 'NULL': MODLLexer.NULL,
+    '01': MODLLexer.TRUE, 'true': MODLLexer.TRUE, 'TRUE': MODLLexer.TRUE,
+    '00': MODLLexer.FALSE, 'false': MODLLexer.FALSE, 'FALSE': MODLLexer.FALSE,
+}
+
+# Regular expressions find the first way of matching a STRING rather than the longest one. That only matters
+# when an escaped space, hash or grave could instead be a '~' or '\' followed by a separator, prefix or graved
+# section, or in conditionals where a graved section can itself hold a STRING, so those cases fall back to the
+# NFAs below, which follow every way of matching at once to find the longest match, as the ANTLR lexer does.
+AMBIGUOUS_RE = re.compile('[\\\\~][ #`]')
+# In a QUOTED, the '~' or '\' before a '"' could also be the last character of the STRING inside the quotes
+QUOTED_AMBIGUOUS_RE = re.compile('[\\\\~][ #`"]')
+C_AMBIGUOUS_RE = re.compile('`|[\\\\~] ')
+
+
+class _Nfa:
+    """
+    A Thompson NFA for one lexer rule, built from the fragments below. Each state has a list of
+    (test, next state) edges, where test is a function of the next character, or None for an edge that doesn't
+    use one up. Simulating every live state a character at a time finds the longest match in one pass over the
+    text, however ambiguous the rule is.
+    """
+
+    def __init__(self, fragment):
+        self.edges: List[List[tuple]] = []
+        self.start = self.state()
+        self.accept = fragment(self, self.start)
+        self.closures = [self._closure(state) for state in range(len(self.edges))]
+        # Only the edges that use up a character are followed once the closures are known
+        self.steps = [[(test, self.closures[target]) for test, target in edges if test is not None]
+                      for edges in self.edges]
+
+    def state(self) -> int:
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def _closure(self, state: int) -> frozenset:
+        found = {state}
+        pending = [state]
+        while pending:
+            for test, target in self.edges[pending.pop()]:
+                if test is None and target not in found:
+                    found.add(target)
+                    pending.append(target)
+        return frozenset(found)
+
+    def scan(self, text: str, pos: int) -> Tuple[Union[int, None], int]:
+        """
+        Match the rule at pos.
+        :return: where the longest non-empty match ends, or None if there isn't one, and where the longest
+        prefix of the text that could still be the start of a match ends
+        """
+        steps = self.steps
+        current = self.closures[self.start]
+        longest = None
+        live = pos
+        end = len(text)
+        while pos < end:
+            char = text[pos]
+            following = set()
+            for state in current:
+                for test, closure in steps[state]:
+                    if test(char):
+                        following |= closure
+            if not following:
+                break
+            pos += 1
+            live = pos
+            if self.accept in following:
+                longest = pos
+            current = following
+        return longest, live
+
+
+def _chars(test):
+    def fragment(nfa, start):
+        end = nfa.state()
+        nfa.edges[start].append((test, end))
+        return end
+    return fragment
+
+
+def _any_of(chars: str):
+    return _chars(frozenset(chars).__contains__)
+
+
+def _none_of(chars: str):
+    chars = frozenset(chars)
+    return _chars(lambda char: char not in chars)
+
+
+def _literal(text: str):
+    return _sequence(*(_any_of(char) for char in text))
+
+
+def _sequence(*fragments):
+    def fragment(nfa, start):
+        for part in fragments:
+            start = part(nfa, start)
+        return start
+    return fragment
+
+
+def _choice(*fragments):
+    def fragment(nfa, start):
+        end = nfa.state()
+        for part in fragments:
+            entry = nfa.state()
+            nfa.edges[start].append((None, entry))
+            nfa.edges[part(nfa, entry)].append((None, end))
+        return end
+    return fragment
+
+
+def _optional(part):
+    return _choice(part, _sequence())
+
+
+def _star(part):
+    def fragment(nfa, start):
+        loop = nfa.state()
+        nfa.edges[start].append((None, loop))
+        nfa.edges[part(nfa, loop)].append((None, loop))
+        return loop
+    return fragment
+
+
+def _plus(part):
+    return _sequence(part, _star(part))
+
+
+_RESERVED_CHARS = '#`{}()[]; =:"\x08\x0c\n\r\t'
+_C_RESERVED_CHARS = '#{`}(); =:"?/><!|&\x08\x0c\n\r\t[]'
+_HEX = '0123456789abcdefABCDEF'
+
+_UNICODE = _sequence(_literal('\\u'), *[_any_of(_HEX)] * 4)
+_GRAVED = _sequence(_literal('`'), _star(_none_of('`')), _literal('`'))
+_STRING_UNIT = _choice(
+    _sequence(_literal('\\'), _any_of('\\/bfnrt')), _UNICODE,
+    _sequence(_any_of('\\~'), _any_of(_RESERVED_CHARS)),
+    _none_of(_RESERVED_CHARS),
+    _GRAVED)
+_STRING_BLOCK = _sequence(_plus(_STRING_UNIT),
+                          _star(_sequence(_optional(_literal('#')), _plus(_literal(' ')), _optional(_literal('#')),
+                                          _plus(_STRING_UNIT))))
+# HASH_PREFIX ('#' STRING) makes STRING recursive, but it can be written without the recursion in the same way
+# as _STRING above
+_STRING_RULE = _sequence(
+    _optional(_literal('# ')),
+    _choice(_sequence(_star(_STRING_UNIT), _plus(_sequence(_plus(_sequence(_literal('#'), _optional(_literal('# ')))),
+                                                           _STRING_BLOCK))),
+            _STRING_BLOCK))
+_C_STRING_UNIT = _choice(
+    _sequence(_literal('\\'), _any_of('\\/bfnrt')), _UNICODE,
+    _sequence(_any_of('\\~'), _any_of(_C_RESERVED_CHARS)),
+    _none_of(_C_RESERVED_CHARS),
+    _GRAVED,
+    _sequence(_literal('`'), _STRING_RULE, _literal('`')))
+
+_STRING_NFA = _Nfa(_STRING_RULE)
+_C_STRING_NFA = _Nfa(_sequence(_plus(_C_STRING_UNIT), _star(_sequence(_plus(_literal(' ')), _plus(_C_STRING_UNIT)))))
+_QUOTED_NFA = _Nfa(_choice(_sequence(_literal('"'), _star(_none_of('"')), _literal('"')),
+                           _sequence(_literal('"'), _STRING_RULE, _literal('"'))))
+
+
+def _longest(nfa: _Nfa, text: str, pos: int):
+    return nfa.scan(text, pos)[0]
+
+
+def _recover(text: str, pos: int, conditional: bool) -> int:
+    """
+    Find where the ANTLR lexer carries on after failing to match a token at pos. It skips all the characters
+    that could still have been the start of a token, and then one more.
+    """
+    char = text[pos]
+    if char == '"' or char == '`':
+        # Quotes and graves which are never closed
+        return len(text)
+    if char != '#':
+        return pos + 1
+    if conditional:
+        # A single '#' can only be the start of a comment
+        return min(pos + 2, len(text))
+
+    # Skip the longest prefix of a STRING
+    return min(_STRING_NFA.scan(text, pos)[1] + 1, len(text))
+
+
+def location(text: str, offset: int) -> str:
+    """Describe an offset into text the same way as ANTLR error messages, e.g. 'line 1:4'."""
+    line = text.count('\n', 0, offset) + 1
+    column = offset - (text.rfind('\n', 0, offset) + 1)
+    return f'line {line}:{column}'
+
+
+def scan(text: str, on_error=None) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yield a (token type, start, stop) tuple for each token in text, where stop is exclusive.
+    :param on_error: called with the start and stop offsets of any text that can't be matched, which is then
+    skipped the same way as the ANTLR lexer does. Without it a ValueError is raised instead.
+    """
+    depth = 0  # How many CONDITIONAL modes have been pushed
+    master = DEFAULT_MODE_RE
+    pos = 0
+    end = len(text)
+    while pos < end:
+        match = master.match(text, pos)
+        if match is not None:
+            kind = match.lastgroup
+            stop = match.end()
+            if kind == 'STRING':
+                if depth:
+                    if C_AMBIGUOUS_RE.search(text, pos, stop + 1):
+                        stop = _longest(_C_STRING_NFA, text, pos)
+                elif AMBIGUOUS_RE.search(text, pos, stop + 1):
+                    stop = _longest(_STRING_NFA, text, pos)
+            elif kind == 'QUOTED' and QUOTED_AMBIGUOUS_RE.search(text, pos, stop + 1):
+                stop = _longest(_QUOTED_NFA, text, pos)
+            elif kind == 'COMMENT' and not depth and stop < end and ('`' in text[pos:stop] or text[stop - 1] in '\\~'):
+                # A STRING made of '#' prefixes wins if it carries on past the end of the line
+                string_stop = _longest(_STRING_NFA, text, pos)
+                if string_stop is not None and string_stop > stop:
+                    kind = 'STRING'
+                    stop = string_stop
+        else:
+            # Only the longest match fallbacks could still find a token here
+            if text[pos] == '"':
+                kind = 'QUOTED'
+                stop = _longest(_QUOTED_NFA, text, pos)
+            else:
+                kind = 'STRING'
+                stop = _longest(_C_STRING_NFA if depth else _STRING_NFA, text, pos)
+            if stop is None:
+                stop = _recover(text, pos, depth > 0)
+                if on_error is None:
+                    raise ValueError(f"{location(text, pos)} token recognition error at: '{text[pos:stop]}'")
+                on_error(pos, stop)
+                pos = stop
+                continue
+
+        token_type = TOKEN_TYPES[kind]
+        if token_type is None:
+            pos = stop
+            continue
+        if kind == 'STRING':
+            value = text[pos:stop]
+            keyword = KEYWORDS.get(value)
+            if keyword is not None:
+                token_type = keyword
+            elif NUMBER_RE.fullmatch(value):
+                token_type = MODLLexer.NUMBER
+            elif depth and value == '*':
+                token_type = MODLLexer.ASTERISK
+        elif kind == 'LCBRAC':
+            depth += 1
+            master = CONDITIONAL_MODE_RE
+        elif kind == 'RCBRAC':
+            depth -= 1
+            if not depth:
+                master = DEFAULT_MODE_RE
+        yield token_type, pos, stop
+        pos = stop
+
+
+def tokenize(text: str):
+    """
+    Split text into tokens, raising a ValueError for anything that isn't part of a token.
+    :return: three parallel lists of token types, token texts and token start offsets
+    """
+    types: List[int] = []
+    texts: List[str] = []
+    offsets: List[int] = []
+    for token_type, start, stop in scan(text):
+        types.append(token_type)
+        texts.append(text[start:stop])
+        offsets.append(start)
+    return types, texts, offsets
+
+
+class ModlLexer(Recognizer, TokenSource):
+    """
+    A drop-in replacement for generated.MODLLexer.MODLLexer as the token source of a CommonTokenStream.
+    Unrecognised characters are reported to the error listeners and skipped, as the ANTLR lexer does.
+    """
+
+    symbolicNames = MODLLexer.symbolicNames
+
+    def __init__(self, input_stream: InputStream):
+        super().__init__()
+        self._input = input_stream
+        self._text = str(input_stream)
+        self._factory = CommonTokenFactory.DEFAULT
+        self._tokens = scan(self._text, self._report_error)
+        self._eof = None
+        self._offset = 0
+        self._line_start = 0
+        self.line = 1
+        self.column = 0
+
+    def _move_to(self, offset: int):
+        # Only the text since the last token is searched, so the whole input is only looked at once
+        newline = self._text.rfind('\n', self._offset, offset)
+        if newline >= 0:
+            self.line += self._text.count('\n', self._offset, newline + 1)
+            self._line_start = newline + 1
+        self._offset = offset
+        self.column = offset - self._line_start
+
+    def _report_error(self, start: int, stop: int):
+        self._move_to(start)
+        text = self._text[start:stop].replace('\n', '\\n').replace('\t', '\\t').replace('\r', '\\r')
+        message = f"token recognition error at: '{text}'"
+        self.getErrorListenerDispatch().syntaxError(self, None, self.line, self.column, message, None)
+
+    def nextToken(self) -> Token:
+        if self._eof is not None:
+            return self._eof
+        for token_type, start, stop in self._tokens:
+            self._move_to(start)
+            return self._factory.create((self, self._input), token_type, self._text[start:stop],
+                                        Token.DEFAULT_CHANNEL, start, stop - 1, self.line, self.column)
+        end = len(self._text)
+        self._move_to(end)
+        self._eof = self._factory.create((self, self._input), Token.EOF, '<EOF>', Token.DEFAULT_CHANNEL, end,
+                                         end - 1, self.line, self.column)
+        return self._eof
+
+    def getInputStream(self):
+        return self._input
+
+    def getSourceName(self):
+        return self._input.getSourceName()
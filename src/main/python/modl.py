@@ -1,25 +1,79 @@
+from typing import Iterator
+
 import parser
 import printer
 import interpreter
-from modl_creator import ModlObject, process_modl_parsed
-import logging
+from modl_creator import ModlObject, Structure, build_raw_modl, iter_build_raw_modl
+from parse_cache import ParseCache
+from parser import ModlParsed
 
 
-logging.basicConfig(level=logging.DEBUG)
 MODL_VERSION = 1
 
 
-def to_json(input_stream) -> str:
+def to_json(input_stream, backend: str = parser.ANTLR_BACKEND, cache: ParseCache = None,
+            context: 'interpreter.InterpreterContext' = None, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> str:
     """High level API: parses, process, interprets and outputs MODL as JSON.
     This is generally the only method that a client will need to use."""
-    modl_object = interpret(input_stream)
+    modl_object = interpret(input_stream, backend, cache, context, max_depth)
     return printer.to_json(modl_object)
 
 
-def interpret(input_stream) -> ModlObject:
-    """High level API: parses, processes and interprets the MODL input"""
-    modl_parsed = parser.parse(input_stream)
-    raw_modl_object = process_modl_parsed(modl_parsed)
-    return interpreter.interpret(raw_modl_object)
+def interpret(input_stream, backend: str = parser.ANTLR_BACKEND, cache: ParseCache = None,
+              context: 'interpreter.InterpreterContext' = None,
+              max_depth: int = parser.DEFAULT_MAX_DEPTH) -> ModlObject:
+    """High level API: parses, processes and interprets the MODL input.
+    The backend is one of parser.ANTLR_BACKEND or parser.NATIVE_BACKEND, and is also used for any imported files.
+    If a ParseCache is given, inputs that have been seen before aren't parsed again.
+    If a context from build_context() is given, the input can use the classes and variables it defines.
+    Documents nested more than max_depth levels deep are rejected with a ValueError, see parser.DEFAULT_MAX_DEPTH."""
+    if cache is not None:
+        raw_modl_object = cache.get_raw_modl(input_stream, backend, max_depth)
+    else:
+        raw_modl_object = build_raw_modl(input_stream, backend, max_depth=max_depth)
+    return interpreter.interpret(raw_modl_object, backend, context)
+
+
+def build_context(input_stream, backend: str = parser.ANTLR_BACKEND,
+                  max_depth: int = parser.DEFAULT_MAX_DEPTH) -> 'interpreter.InterpreterContext':
+    """High level API: parses, processes and interprets a config document, such as a set of *class definitions
+    and variables, once, for any number of records to be interpreted against with interpret(..., context=...)."""
+    return interpreter.build_context(build_raw_modl(input_stream, backend, max_depth=max_depth), backend)
+
+
+def iter_interpret(input_stream, backend: str = parser.ANTLR_BACKEND, context: 'interpreter.InterpreterContext' = None,
+                   max_depth: int = parser.DEFAULT_MAX_DEPTH) -> Iterator[Structure]:
+    """Streaming version of interpret(): parses, processes and interprets each top-level structure as soon as
+    it's complete and yields it, so the whole document is never held in memory as a tree.
+    Interpreter state such as classes and variables is carried forward from one structure to the next.
+    Errors, including syntax errors with the native backend, are raised when the generator reaches them.
+    The text itself is still tokenised up front, so with the native backend the token lists take memory in
+    proportion to the whole document, even though the trees are built one structure at a time."""
+    raw_structures = iter_build_raw_modl(input_stream, backend, max_depth=max_depth)
+    return interpreter.iter_interpret(raw_structures, backend, context)
+
+
+def iter_to_json(input_stream, backend: str = parser.ANTLR_BACKEND, context: 'interpreter.InterpreterContext' = None,
+                 max_depth: int = parser.DEFAULT_MAX_DEPTH) -> Iterator[str]:
+    """Streaming version of to_json(), yielding chunks of the JSON output as each structure is interpreted."""
+    return printer.iter_to_json(iter_interpret(input_stream, backend, context, max_depth))
+
+
+def parse_file(location: str, backend: str = parser.ANTLR_BACKEND,
+               max_depth: int = parser.DEFAULT_MAX_DEPTH) -> ModlParsed:
+    """Parses a MODL file without interpreting it. The file is memory-mapped and decoded as UTF-8."""
+    return parser.parse_file(location, backend, max_depth)
+
+
+def interpret_file(location: str, backend: str = parser.ANTLR_BACKEND, cache: ParseCache = None,
+                   context: 'interpreter.InterpreterContext' = None,
+                   max_depth: int = parser.DEFAULT_MAX_DEPTH) -> ModlObject:
+    """High level API: reads, parses, processes and interprets a MODL file.
+    The file is memory-mapped and decoded as UTF-8, ignoring any byte order mark."""
+    return interpret(parser.read_file(location), backend, cache, context, max_depth)
 
 
+def file_to_json(location: str, backend: str = parser.ANTLR_BACKEND, cache: ParseCache = None,
+                 context: 'interpreter.InterpreterContext' = None, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> str:
+    """High level API: reads, parses, processes, interprets and outputs a MODL file as JSON."""
+    return printer.to_json(interpret_file(location, backend, cache, context, max_depth))
@@ -1,11 +1,14 @@
-import logging
-from typing import List, Union
+from types import GeneratorType
+from typing import Callable, Dict, Iterable, Iterator, List, Union
 
 import parser
-from string_utils import EscapeStrings
+import tracing
+from string_utils import unescape
 
 
 class ModlValue:
+    __slots__ = ()
+
     def get_by_name(self, name: str):
         raise ValueError
 
@@ -15,6 +18,9 @@ class ModlValue:
     def get_keys(self):
         raise ValueError
 
+    def has_key(self, key) -> bool:
+        return key in self.get_keys()
+
     def get_value(self):
         """Underlying value of object"""
         raise ValueError
@@ -55,9 +61,29 @@ class ModlValue:
     def is_null(self):
         return False
 
-class Number(ModlValue):
+
+class Terminal(ModlValue):
+    """
+    Base for the immutable terminal values. Nothing can change a terminal once it's been made, so the same one can
+    be shared by any number of trees, and the interpreter uses the raw terminals as they are.
+    """
+    __slots__ = ()
+
+    def is_terminal(self):
+        return True
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+
+class Number(Terminal):
+    __slots__ = ('number',)
+
     def __init__(self, number):
-        self.number = number
+        object.__setattr__(self, 'number', number)
 
     def is_number(self):
         return True
@@ -65,18 +91,37 @@ class Number(ModlValue):
     def get_value(self):
         return self.number
 
-    def is_terminal(self):
-        return True
+    def __reduce__(self):
+        return Number, (self.number,)
+
+    def __repr__(self):
+        return f'Number({self.number!r})'
+
+    def __hash__(self):
+        return hash(self.number)
+
+    def __eq__(self, other):
+        if isinstance(other, Number):
+            return other.number == self.number
+        return NotImplemented
 
 
 def escape(raw_string:str) -> str:
-    replacer = EscapeStrings()
-    return replacer.unescape(raw_string)
+    return unescape(raw_string)
 
 
-class String(ModlValue):
+class String(Terminal):
+    __slots__ = ('string',)
+
     def __init__(self, string_val):
-        self.string = escape(string_val)
+        object.__setattr__(self, 'string', escape(string_val))
+
+    @classmethod
+    def unescaped(cls, string_val: str):
+        """A String for a value that has already been unescaped"""
+        string = cls.__new__(cls)
+        object.__setattr__(string, 'string', string_val)
+        return string
 
     def is_string(self):
         return True
@@ -84,8 +129,8 @@ class String(ModlValue):
     def get_value(self):
         return self.string
 
-    def is_terminal(self):
-        return True
+    def __reduce__(self):
+        return String.unescaped, (self.string,)
 
     def __repr__(self):
         """ Representation of object, useful for unit test failures etc. """
@@ -110,44 +155,79 @@ class String(ModlValue):
             return super().__eq__(other)
 
 
-class TrueVal(ModlValue):
-    def is_true(self):
-        return True
+class TrueVal(Terminal):
+    """There's only one TrueVal, TRUE_VAL, which TrueVal() returns"""
+    __slots__ = ()
 
-    def is_terminal(self):
+    def __new__(cls):
+        return TRUE_VAL
+
+    def __reduce__(self):
+        return TrueVal, ()
+
+    def is_true(self):
         return True
 
     def get_value(self):
         return True
 
+    def __hash__(self):
+        return hash(True)
+
     def __eq__(self, other):
-        return isinstance(other, TrueVal) and other.is_true()
+        return isinstance(other, TrueVal)
 
 
-class FalseVal(ModlValue):
-    def is_false(self):
-        return True
+class FalseVal(Terminal):
+    """There's only one FalseVal, FALSE_VAL, which FalseVal() returns"""
+    __slots__ = ()
 
-    def is_terminal(self):
+    def __new__(cls):
+        return FALSE_VAL
+
+    def __reduce__(self):
+        return FalseVal, ()
+
+    def is_false(self):
         return True
 
     def get_value(self):
         return False
 
+    def __hash__(self):
+        return hash(False)
+
     def __eq__(self, other):
-        return isinstance(other, FalseVal) and other.is_false()
+        return isinstance(other, FalseVal)
 
 
-class NullVal(ModlValue):
-    def is_null(self):
-        return True
+class NullVal(Terminal):
+    """There's only one NullVal, NULL_VAL, which NullVal() returns"""
+    __slots__ = ()
 
-    def is_terminal(self):
+    def __new__(cls):
+        return NULL_VAL
+
+    def __reduce__(self):
+        return NullVal, ()
+
+    def is_null(self):
         return True
 
     def get_value(self):
         return None
 
+    def __hash__(self):
+        return hash(None)
+
+    def __eq__(self, other):
+        return isinstance(other, NullVal)
+
+
+TRUE_VAL = object.__new__(TrueVal)
+FALSE_VAL = object.__new__(FalseVal)
+NULL_VAL = object.__new__(NullVal)
+
 
 class Structure(ModlValue):
     pass
@@ -206,10 +286,88 @@ class Pair(Structure):
             self.value.add(value)
 
 
+class _KeyIndex:
+    """
+    The position of the first item with each key in a list of items, so that get_by_name() doesn't have to search
+    the list. Items appended to the list, whether by add() or directly, are indexed when they're next looked up, and
+    the whole list is indexed again if it's been changed in some other way.
+    """
+    __slots__ = ('_positions', '_indexed')
+
+    def __init__(self):
+        self._positions: Dict[object, int] = {}
+        self._indexed = 0
+
+    def __reduce__(self):
+        # The positions are rebuilt when needed, so aren't part of a pickled tree
+        return _KeyIndex, ()
+
+    def find(self, items: list, key, is_keyed: Callable[[object], bool]):
+        """The first item in items with the given key that is_keyed() accepts, or None"""
+        if self._indexed != len(items):
+            self._update(items, is_keyed)
+        position = self._positions.get(key)
+        if position is None:
+            return None
+        if position < len(items) and is_keyed(items[position]) and items[position].key == key:
+            return items[position]
+        self._indexed = len(items) + 1  # Forces a rebuild
+        self._update(items, is_keyed)
+        position = self._positions.get(key)
+        return None if position is None else items[position]
+
+    def _update(self, items: list, is_keyed: Callable[[object], bool]):
+        if self._indexed > len(items):
+            self._positions.clear()
+            self._indexed = 0
+        positions = self._positions
+        for position in range(self._indexed, len(items)):
+            item = items[position]
+            if is_keyed(item):
+                positions.setdefault(item.key, position)
+        self._indexed = len(items)
+
+
+def _is_any(item) -> bool:
+    return True
+
+
+def _is_pair(item) -> bool:
+    return isinstance(item, Pair)
+
+
+def _is_exactly_pair(item) -> bool:
+    return type(item) == Pair
+
+
 class Map(Structure):
     def __init__(self):
         super().__init__()
         self.map_items: List[Pair] = []
+        self._key_index = _KeyIndex()
+
+    @classmethod
+    def lazy(cls, build_items: Callable[[], List[Pair]]):
+        """A Map whose items are only built, by calling build_items(), when they're first used."""
+        modl_map = cls.__new__(cls)
+        modl_map._build_items = build_items
+        modl_map._key_index = _KeyIndex()
+        return modl_map
+
+    def __getattr__(self, name):
+        # Only called while a lazy Map has no map_items yet
+        if name == 'map_items':
+            attributes = self.__dict__
+            build_items = attributes.get('_build_items')
+            if build_items is not None:
+                # If another thread builds the items at the same time, the first to finish is kept. The builder is
+                # let go once they're built.
+                items = attributes.setdefault('map_items', build_items())
+                attributes.pop('_build_items', None)
+                return items
+            if 'map_items' in attributes:
+                return attributes['map_items']  # Built by another thread since this was called
+        raise AttributeError(name)
 
     def is_map(self) -> bool:
         return True
@@ -218,9 +376,12 @@ class Map(Structure):
         self.map_items.append(pair)
 
     def get_by_name(self, key):
-        for map_item in self.map_items:
-            if map_item.key == key:
-                return map_item.value
+        map_item = self._key_index.find(self.map_items, key, _is_any)
+        if map_item is not None:
+            return map_item.value
+
+    def has_key(self, key) -> bool:
+        return self._key_index.find(self.map_items, key, _is_any) is not None
 
     def get_by_index(self, index):
         return self.map_items[index]
@@ -240,6 +401,30 @@ class Array(Structure):
     def __init__(self):
         super().__init__()
         self.array_items = []
+        self._key_index = _KeyIndex()
+
+    @classmethod
+    def lazy(cls, build_items: Callable[[], List[ModlValue]]):
+        """An Array whose items are only built, by calling build_items(), when they're first used."""
+        array = cls.__new__(cls)
+        array._build_items = build_items
+        array._key_index = _KeyIndex()
+        return array
+
+    def __getattr__(self, name):
+        # Only called while a lazy Array has no array_items yet
+        if name == 'array_items':
+            attributes = self.__dict__
+            build_items = attributes.get('_build_items')
+            if build_items is not None:
+                # If another thread builds the items at the same time, the first to finish is kept. The builder is
+                # let go once they're built.
+                items = attributes.setdefault('array_items', build_items())
+                attributes.pop('_build_items', None)
+                return items
+            if 'array_items' in attributes:
+                return attributes['array_items']  # Built by another thread since this was called
+        raise AttributeError(name)
 
     def is_array(self):
         return True
@@ -251,11 +436,7 @@ class Array(Structure):
         return self.array_items[index]
 
     def get_by_name(self, name: str):
-        for v in self.array_items:
-            if isinstance(v, Pair):
-                if v.get_key() == name:
-                    return v
-        return None
+        return self._key_index.find(self.array_items, name, _is_pair)
 
     def get_modl_values(self):
         return self.array_items
@@ -345,6 +526,7 @@ class ModlObject(ModlValue):
     be transformed into another format such as JSON."""
     def __init__(self):
         self.structures: List[Structure] = []
+        self._key_index = _KeyIndex()
 
     def is_modl_object(self):
         return True
@@ -357,6 +539,13 @@ class ModlObject(ModlValue):
         MODL structures."""
         return [str(s.get_key()) for s in self.structures if type(s) == Pair]
 
+    def get_by_name(self, name: str):
+        """The first top-level Pair with the given key, or None"""
+        return self._key_index.find(self.structures, name, _is_exactly_pair)
+
+    def has_key(self, key) -> bool:
+        return self.get_by_name(key) is not None
+
     def get_by_index(self, index: int):
         return self.structures[index]
 
@@ -371,15 +560,50 @@ class RawModlObject(ModlObject):
         super().__init__()
 
 
+def build_raw_modl(input_stream, backend: str = parser.ANTLR_BACKEND, lazy: bool = False,
+                   max_depth: int = parser.DEFAULT_MAX_DEPTH) -> RawModlObject:
+    """Parse and process MODL text (or an ANTLR InputStream) into a RawModlObject. The native backend builds it
+    straight from the tokens with native_builder, without creating a parser.ModlParsed tree first.
+    :param lazy: only build the items of each map and array when they're first used - see native_builder
+    :param max_depth: the deepest nesting to accept, see parser.DEFAULT_MAX_DEPTH
+    """
+    if backend == parser.NATIVE_BACKEND:
+        import native_builder
+        return native_builder.build(input_stream, lazy, max_depth)
+    if lazy:
+        raise ValueError('Lazy building is only supported by the native backend')
+    return process_modl_parsed(parser.parse(input_stream, backend, max_depth=max_depth))
+
+
+def iter_build_raw_modl(input_stream, backend: str = parser.ANTLR_BACKEND, lazy: bool = False,
+                        max_depth: int = parser.DEFAULT_MAX_DEPTH) -> Iterator[Structure]:
+    """Streaming version of build_raw_modl(), yielding each raw top-level structure in turn."""
+    if backend == parser.NATIVE_BACKEND:
+        import native_builder
+        return native_builder.iter_build(input_stream, lazy, max_depth)
+    if lazy:
+        raise ValueError('Lazy building is only supported by the native backend')
+    return iter_process_modl_parsed(parser.iter_parse(input_stream, backend, max_depth))
+
+
+IMPORT_KEYS = {'*I', '*IMPORT'}
+
+
 def process_modl_parsed(parsed: parser.ModlParsed) -> RawModlObject:
     """Post-process the parsed tree, transforming it into an object ready for interpreting"""
     raw_modl_object = RawModlObject()
+    raw_modl_object.add_structures(iter_process_modl_parsed(parsed.structures))
+    return raw_modl_object
 
-    for parsed_struct in parsed.structures:
-        structures = process_modl_structure(raw_modl_object, parsed_struct)
-        raw_modl_object.add_structures(structures)
 
-    return raw_modl_object
+def iter_process_modl_parsed(parsed_structures: Iterable[parser.Structure]) -> Iterator[Structure]:
+    """Post-process parsed structures one at a time, yielding the raw structures ready for interpreting"""
+    raw_modl_object = RawModlObject()
+
+    for parsed_struct in parsed_structures:
+        structures = process_modl_structure(raw_modl_object, parsed_struct)
+        if structures is not None:
+            yield from structures
 
 
 def process_modl_structure(raw: RawModlObject, parsed_structure: parser.Structure) -> Union[None,List[Structure]]:
@@ -398,7 +622,13 @@ def process_modl_structure(raw: RawModlObject, parsed_structure: parser.Structur
         structures.append(structure)
         return structures
 
-    structure = process_modl_item(raw, parsed_structure.pair)
+    parsed_pair = parsed_structure.pair
+    if parsed_pair is not None and parsed_pair.get_key() in IMPORT_KEYS:
+        if tracing.subscribers:
+            _trace(parsed_pair)
+        return process_import_statement(raw, parsed_pair)
+
+    structure = process_modl_item(raw, parsed_pair)
     if structure is not None:
         structures.append(structure) # This is not in the Java
         return structures
@@ -409,7 +639,11 @@ def process_modl_structure(raw: RawModlObject, parsed_structure: parser.Structur
     return structures
 
 
-def process_import_statement(raw, parsed_pair: parser.Pair):
+def process_import_statement(raw, parsed_pair: parser.Pair) -> List[Structure]:
+    """
+    An import statement becomes an import pair for each file in it, which the interpreter loads in place.
+    Only top-level import statements are kept, the rest are dropped.
+    """
     structures: List[Structure] = []
     array: Array = process_modl_item(raw, parsed_pair.array)
     if not array:
@@ -428,99 +662,38 @@ def process_import_statement(raw, parsed_pair: parser.Pair):
             v = process_modl_item_for_parent(raw, value_parsed, pair)
             pair.add_modl_value(v)
             structures.append(pair)
+    return structures
 
 
 def process_modl_value(raw, parsed_value: parser.Value):
     if not parsed_value:
         return None
-
-    pair = process_modl_item(raw, parsed_value.pair)
-    if pair:
-        return pair
-    value = process_modl_item(raw, parsed_value.map)
-    if value:
-        return value
-
-    value = process_modl_item(raw, parsed_value.array)
-    if value:
-        return value
-
-    value = process_modl_item(raw, parsed_value.nb_array)
-    if value:
-        return value
-
-    value = process_modl_quoted(raw, parsed_value.quoted)
-    if value:
-        return value
-
-    value = process_modl_number(raw, parsed_value.number)
-    if value:
-        return value
-
-    value = process_modl_true(raw, parsed_value.is_true)
-    if value:
-        return value
-
-    value = process_modl_false(raw, parsed_value.is_false)
-    if value:
-        return value
-
-    value = process_modl_null(raw, parsed_value.is_null)
-    if value:
-        return value
-
-    value = process_modl_string(raw, parsed_value.string)
-    if value:
-        return value
-
-    return None
+    return _run(raw, _value_steps(raw, parsed_value))
 
 
 def process_modl_array_value_item(raw, parsed_value: parser.ArrayValueItem):
     if not parsed_value:
         return None
-
-    pairs = process_modl_item(raw, parsed_value.pair)
-    if pairs:
-        return pairs[0]
-    value = process_modl_item(raw, parsed_value.map)
-    if value:
-        return value
-
-    value = process_modl_item(raw, parsed_value.array)
-    if value:
-        return value
-
-    # value = process_modl_item(raw, parsed_value.nb_array)
-    # if value:
-    #     return value
-
-    value = process_modl_quoted(raw, parsed_value.quoted)
-    if value:
-        return value
-
-    value = process_modl_number(raw, parsed_value.number)
-    if value:
-        return value
-
-    value = process_modl_true(raw, parsed_value.is_true)
-    if value:
-        return value
-
-    value = process_modl_false(raw, parsed_value.is_false)
-    if value:
-        return value
-
-    value = process_modl_null(raw, parsed_value.is_null)
-    if value:
-        return value
-
-    value = process_modl_string(raw, parsed_value.string)
-    if value:
-        return value
-
+    return _run(raw, _array_value_item_steps(raw, parsed_value))
+
+
+def _process_terminal(parsed_value: Union[parser.Value, parser.ArrayValueItem]) -> Union[None,Terminal]:
+    """The terminal held by a parsed value, or None for a zero or an empty quoted string"""
+    if parsed_value.quoted:
+        return String(parsed_value.quoted)
+    if parsed_value.number:
+        return Number(parsed_value.number)
+    if parsed_value.is_true:
+        return TRUE_VAL
+    if parsed_value.is_false:
+        return FALSE_VAL
+    if parsed_value.is_null:
+        return NULL_VAL
+    if parsed_value.string:
+        return String(parsed_value.string)
     return None
 
+
 def process_modl_string(raw, parsed_string):
     if not parsed_string:
         return None
@@ -539,136 +712,293 @@ def process_modl_number(raw, parsed_number):
 def process_modl_true(raw, parsed_true):
     if not parsed_true:
         return None
-    return TrueVal()
+    return TRUE_VAL
 
 def process_modl_false(raw, parsed_false):
     if not parsed_false:
         return None
-    return FalseVal()
+    return FALSE_VAL
 
 def process_modl_null(raw, parsed_null):
     if not parsed_null:
         return None
-    return NullVal()
+    return NULL_VAL
 
 
 def process_modl_item(raw: RawModlObject, parsed_item):
-    logging.debug("Found type %s", type(parsed_item))
-
     if parsed_item is None:
         return None
+    return _run(raw, parsed_item)
 
-    if type(parsed_item) == parser.Array:
-        modl_array = Array()
-        parsed_array: parser.Array = parsed_item
-        if parsed_array.array_items:
-            for parsed_array_item in parsed_array.array_items:
-                if isinstance(parsed_array_item, parser.ArrayItem):
-                    modl_value = process_modl_item(raw, parsed_array_item)
-                    if modl_value:
-                        modl_array.add(modl_value)
-                elif isinstance(parsed_array_item, parser.NbArray):
-                    for ai in parsed_array_item.array_items:
-                        modl_value = process_modl_item(raw, ai)
-                        if modl_value:
-                            modl_array.add(modl_value)
-        return modl_array
-
-    if type(parsed_item) == parser.ArrayItem:
-        modl_value = None
-        if parsed_item.array_conditional:
-            modl_value = process_modl_item(raw, parsed_item.array_conditional)
-        if parsed_item.array_value_item:
-            modl_value = process_modl_item(raw, parsed_item.array_value_item)
-        return modl_value
-
-    if type(parsed_item) == parser.NbArray:
-        parsed_nb_array: parser.NbArray = parsed_item
-        if not parsed_nb_array.array_items:
-            return None
-        modl_array = Array()
-        for parsed_nb_array_item in parsed_nb_array.array_items:
-            modl_value = process_modl_item(raw, parsed_nb_array_item)
-            if modl_value:
-                modl_array.add(modl_value)
-        return modl_array
-
-    if type(parsed_item) == parser.Map:
-        modl_map = Map()
-        for map_item_parsed in parsed_item.map_items:
-            pair = process_modl_item(raw, map_item_parsed)
-            if pair:
-                modl_map.add(pair)
-        return modl_map
 
-    if type(parsed_item) == parser.MapItem:
-        pair = process_modl_item(raw, parsed_item.map_conditional)
+def _trace(parsed_item):
+    tracing.emit('process.item', {'type': type(parsed_item)})
+
+
+def _run(raw: RawModlObject, work):
+    """
+    Process a parsed node, or run the steps from a generator, and everything underneath it.
+
+    The processing for a node with children is a generator of steps. It yields each child node that it needs
+    processed, or a generator of steps for a child that isn't processed by type, such as a ValueItem, and is sent
+    back the result. Those are run here on an explicit stack rather than by recursion, so there is no limit on how
+    deeply nested a parse tree can be. Values that hold a terminal are processed straight away.
+    """
+    stack = []
+    while True:
+        if work is None:
+            result = None
+        elif type(work) is GeneratorType:
+            stack.append(work)
+            result = None
+        else:
+            if tracing.subscribers:
+                _trace(work)
+            work_type = type(work)
+            if work_type is parser.Value and _holds_terminal(work) or \
+                    work_type is parser.ArrayValueItem and _item_holds_terminal(work):
+                result = _process_terminal(work)
+            else:
+                steps = _STEPS.get(work_type)
+                if steps is None:
+                    # Conditionals aren't processed yet
+                    result = None
+                else:
+                    stack.append(steps(raw, work))
+                    result = None
+
+        while stack:
+            try:
+                work = stack[-1].send(result)
+                break
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+        else:
+            return result
+
+
+def _holds_terminal(parsed_value: parser.Value) -> bool:
+    return parsed_value.pair is None and parsed_value.map is None and parsed_value.array is None and \
+        parsed_value.nb_array is None
+
+
+def _item_holds_terminal(parsed_item: parser.ArrayValueItem) -> bool:
+    return parsed_item.pair is None and parsed_item.map is None and parsed_item.array is None
+
+
+def _process_terminal_pair(parsed_pair: parser.Pair) -> Union[None,Pair]:
+    """Process a pair whose value is a terminal, which is most of them, or return None for any other pair"""
+    if parsed_pair.map is not None or parsed_pair.array is not None:
+        return None
+    value_item = parsed_pair.value_item
+    if not value_item or value_item.value_conditional:
+        return None
+    parsed_value = value_item.value
+    if parsed_value is None or not _holds_terminal(parsed_value):
+        return None
+    key = parsed_pair.get_key()
+    if key in IMPORT_KEYS:
+        return None
+    if tracing.subscribers:
+        _trace(parsed_pair)
+        _trace(parsed_value)
+    pair = Pair(key=String(key))
+    pair.add_modl_value(_process_terminal(parsed_value))
+    return pair
+
+
+# Where a processor handles a child node itself, rather than yielding it, it traces the child the same way that
+# _run() would have. Terminals and pairs of terminals are handled straight away, since going through _run() costs
+# far more than processing them
+
+
+def _array_steps(raw: RawModlObject, parsed_array: parser.Array):
+    modl_array = Array()
+    if parsed_array.array_items:
+        for parsed_array_item in parsed_array.array_items:
+            if isinstance(parsed_array_item, parser.ArrayItem):
+                items = (parsed_array_item,)
+            elif isinstance(parsed_array_item, parser.NbArray):
+                items = parsed_array_item.array_items
+            else:
+                continue
+            for item in items:
+                if type(item) is not parser.ArrayItem:
+                    modl_value = yield item
+                else:
+                    if tracing.subscribers:
+                        _trace(item)
+                    modl_value = None
+                    if item.array_conditional:
+                        modl_value = yield item.array_conditional
+                    array_value_item = item.array_value_item
+                    if array_value_item:
+                        if _item_holds_terminal(array_value_item):
+                            if tracing.subscribers:
+                                _trace(array_value_item)
+                            modl_value = _process_terminal(array_value_item)
+                        elif array_value_item.pair is None:
+                            if tracing.subscribers:
+                                _trace(array_value_item)
+                            modl_value = yield array_value_item.map if array_value_item.map is not None else \
+                                array_value_item.array
+                        else:
+                            modl_value = yield array_value_item
+                if modl_value:
+                    modl_array.add(modl_value)
+    return modl_array
+
+
+def _array_item_steps(raw: RawModlObject, parsed_item: parser.ArrayItem):
+    modl_value = None
+    if parsed_item.array_conditional:
+        modl_value = yield parsed_item.array_conditional
+    if parsed_item.array_value_item:
+        modl_value = yield parsed_item.array_value_item
+    return modl_value
+
+
+def _nb_array_steps(raw: RawModlObject, parsed_nb_array: parser.NbArray):
+    if not parsed_nb_array.array_items:
+        return None
+    modl_array = Array()
+    for parsed_nb_array_item in parsed_nb_array.array_items:
+        modl_value = yield parsed_nb_array_item
+        if modl_value:
+            modl_array.add(modl_value)
+    return modl_array
+
+
+def _map_steps(raw: RawModlObject, parsed_map: parser.Map):
+    modl_map = Map()
+    for map_item_parsed in parsed_map.map_items or ():
+        if tracing.subscribers:
+            _trace(map_item_parsed)
+        pair = None
+        if map_item_parsed.map_conditional is not None:
+            pair = yield map_item_parsed.map_conditional
+        if not pair and map_item_parsed.pair is not None:
+            pair = _process_terminal_pair(map_item_parsed.pair)
+            if pair is None:
+                pair = yield map_item_parsed.pair
+        if pair:
+            modl_map.add(pair)
+    return modl_map
+
+
+def _map_item_steps(raw: RawModlObject, parsed_item: parser.MapItem):
+    pair = yield parsed_item.map_conditional
+    if pair:
+        return pair
+    pair = yield parsed_item.pair
+    if pair:
+        return pair
+    return None
+
+
+def _value_steps(raw: RawModlObject, parsed_value: parser.Value):
+    # The first of these that gives a value wins
+    if parsed_value.pair is not None:
+        pair = yield parsed_value.pair
         if pair:
             return pair
-        pair = process_modl_item(raw, parsed_item.pair)
+    if parsed_value.map is not None:
+        return (yield parsed_value.map)
+    if parsed_value.array is not None:
+        return (yield parsed_value.array)
+    if parsed_value.nb_array is not None:
+        value = yield parsed_value.nb_array
+        if value:
+            return value
+    return _process_terminal(parsed_value)
+
+
+def _array_value_item_steps(raw: RawModlObject, parsed_value: parser.ArrayValueItem):
+    if parsed_value.pair is not None:
+        pair = yield parsed_value.pair
         if pair:
             return pair
-
-    if type(parsed_item) == parser.Value:
-        # pairs = process_modl_item(raw, parsed_item.pair)
-        # if len(pairs) > 0:
-        #     return pairs[0]  # why? why not just parsed_item.get_value() as below?
-        return process_modl_value(raw, parsed_item)
-
-    if type(parsed_item) == parser.ArrayValueItem:
-        # pairs = process_modl_item(raw, parsed_item.pair)
-        # if len(pairs) > 0:
-        #     return pairs[0]  # why? why not just parsed_item.get_value() as below?
-        return process_modl_array_value_item(raw, parsed_item)
-
-    if type(parsed_item) == parser.ConditionTest:
-        condition_test = ConditionTest()
-        for subcon_info in condition_test.subconditions:
-            subcondition, (operator, should_negate) = subcon_info
-            if isinstance(subcondition, parser.ConditionGroup):
-                condition_group: ConditionGroup = process_modl_item(raw, subcondition)
-                condition_test.add_subcondition(operator, should_negate, condition_group)
-            elif isinstance(subcondition, parser.Condition):
-                # This isn't really helping in python, since the different type params map to the same method
-                condition: Condition = process_modl_item(raw, subcondition)
-                condition_test.add_subcondition(operator, should_negate, condition)
-        return condition_test
-
+    if parsed_value.map is not None:
+        return (yield parsed_value.map)
+    if parsed_value.array is not None:
+        return (yield parsed_value.array)
+    return _process_terminal(parsed_value)
+
+
+def _condition_test_steps(raw: RawModlObject, parsed_item: parser.ConditionTest):
+    condition_test = ConditionTest()
+    for subcon_info in condition_test.subconditions:
+        subcondition, (operator, should_negate) = subcon_info
+        if isinstance(subcondition, parser.ConditionGroup):
+            condition_group: ConditionGroup = yield subcondition
+            condition_test.add_subcondition(operator, should_negate, condition_group)
+        elif isinstance(subcondition, parser.Condition):
+            # This isn't really helping in python, since the different type params map to the same method
+            condition: Condition = yield subcondition
+            condition_test.add_subcondition(operator, should_negate, condition)
     # TODO... various other condition related bits from Java, e.g. ModlObjectCreator:251...
     # RawModlObject.Condition processModlParsed(RawModlObject rawModlObject, ModlParsed.Condition conditionParsed)
+    return condition_test
+
 
-    if type(parsed_item) == parser.Pair:
-        # TODO: are we losing the ValueConditional here... check what happens in the Java.
-        pair = Pair(key=String(parsed_item.get_key()))
+def _pair_steps(raw: RawModlObject, parsed_item: parser.Pair):
+    # TODO: are we losing the ValueConditional here... check what happens in the Java.
+    if parsed_item.get_key() in IMPORT_KEYS:
+        # An import statement that isn't at the top level
+        process_import_statement(raw, parsed_item)
+        return None
 
-        if parsed_item.get_key() == '*I' or parsed_item.get_key() == '*IMPORT':
-            return process_import_statement(raw, parsed_item)
+    pair = Pair(key=String(parsed_item.get_key()))
+    if parsed_item.map is not None:
+        pair.add_modl_value((yield parsed_item.map))
+    if parsed_item.array is not None:
+        pair.add_modl_value((yield parsed_item.array))
+    value_item = parsed_item.value_item
+    if value_item:
+        parsed_value = value_item.value
+        if value_item.value_conditional:
+            pair.add_modl_value((yield _value_item_steps(raw, value_item)))
+        elif parsed_value is not None and parsed_value.pair is None and parsed_value.nb_array is None and \
+                (parsed_value.map is not None or parsed_value.array is not None):
+            # Skip the steps for the Value, which would only pass on the result for its map or array
+            if tracing.subscribers:
+                _trace(parsed_value)
+            pair.add_modl_value((yield parsed_value.map if parsed_value.map is not None else parsed_value.array))
         else:
-            modl_map = process_modl_item(raw, parsed_item.map)
-            if modl_map:
-                pair.add_modl_value(modl_map)
-            modl_array = process_modl_item(raw, parsed_item.array)
-            if modl_array:
-                pair.add_modl_value(modl_array)
-            if parsed_item.value_item:
-                pair.add_modl_value(process_modl_item_for_parent(raw, parsed_item.value_item, pair))
-            return pair
+            pair.add_modl_value((yield parsed_value))
+    return pair
 
 
-    return None
+_STEPS = {
+    parser.Array: _array_steps,
+    parser.ArrayItem: _array_item_steps,
+    parser.NbArray: _nb_array_steps,
+    parser.Map: _map_steps,
+    parser.MapItem: _map_item_steps,
+    parser.Value: _value_steps,
+    parser.ArrayValueItem: _array_value_item_steps,
+    parser.ConditionTest: _condition_test_steps,
+    parser.Pair: _pair_steps,
+}
 
 
 def process_modl_item_for_parent(raw: RawModlObject, value_item_parsed: parser.ValueItem, parent: Pair):
     if not value_item_parsed:
         return
+    return _run(raw, _value_item_steps(raw, value_item_parsed))
 
+
+def _value_item_steps(raw: RawModlObject, value_item_parsed: parser.ValueItem):
     value = None
 
     if value_item_parsed.value_conditional:
-        value = process_conditional_for_parent(raw, value_item_parsed.value_conditional, parent)
+        value = yield _conditional_steps(raw, value_item_parsed.value_conditional)
 
-    if value_item_parsed.get_value():
-        value = process_modl_item(raw, value_item_parsed.get_value())
+    if value_item_parsed.value:
+        value = yield value_item_parsed.value
+    elif value_item_parsed.value_conditional:
+        value = yield value_item_parsed.value_conditional
 
     return value
 
@@ -676,12 +1006,15 @@ def process_modl_item_for_parent(raw: RawModlObject, value_item_parsed: parser.V
 def process_conditional_return_for_parent(raw, conditional_return_parsed: parser.ValueConditionalReturn, parent: Pair):
     if not conditional_return_parsed:
         return None
+    return _run(raw, _conditional_return_steps(raw, conditional_return_parsed))
+
 
+def _conditional_return_steps(raw: RawModlObject, conditional_return_parsed: parser.ValueConditionalReturn):
     conditional_return = ValueConditionalReturn()
 
     if conditional_return_parsed.value_items:
         for value_parsed in conditional_return_parsed.value_items:
-            value = process_modl_item_for_parent(raw, value_parsed, parent)
+            value = (yield _value_item_steps(raw, value_parsed)) if value_parsed else None
             conditional_return.add(value)
 
     return conditional_return
@@ -690,13 +1023,15 @@ def process_conditional_return_for_parent(raw, conditional_return_parsed: parser
 def process_conditional_for_parent(raw: RawModlObject, conditional_parsed: parser.ValueConditional, parent: Pair):
     if not conditional_parsed:
         return None
+    return _run(raw, _conditional_steps(raw, conditional_parsed))
 
+
+def _conditional_steps(raw: RawModlObject, conditional_parsed: parser.ValueConditional):
     conditional = ValueConditional()
 
     for c_test,c_return in conditional_parsed.get_conditional_returns().items():
-        conditional.add_conditional(process_modl_item(raw, c_test),
-                                    process_conditional_return_for_parent(raw, c_return, parent))
-        
-    return conditional
-
+        condition_test = yield c_test
+        conditional_return = (yield _conditional_return_steps(raw, c_return)) if c_return else None
+        conditional.add_conditional(condition_test, conditional_return)
 
+    return conditional
@@ -0,0 +1,242 @@
+"""
+Compiled MODL: a compact binary form of a RawModlObject, so that files which are imported over and over again,
+such as shared class and config files, only need to be parsed once per deployment.
+
+    modlc.compile_file('config.modl')          # Writes config.modlc
+    raw_modl = modlc.load_file('config.modl')  # Reads config.modlc if it's up to date, otherwise parses
+
+The interpreter loads imported files with load_file(), so compiling them is enough for every `*I` to use the
+compiled form. Files can also be compiled from the command line:
+
+    PYTHONPATH=src/main/python python -m modlc config.modl classes.modl
+
+A .modlc file starts with a header holding the format version and the size and modification time of the source
+file it was compiled from. It's only used while they still match, and is ignored (and the source parsed as
+normal) if it's out of date, from another format version or unreadable.
+
+After the header comes a table of all the distinct strings, then the structures. Each value is a one byte tag
+followed by its contents, with lengths, counts and string table indexes written as variable length integers.
+"""
+import os
+import struct
+import sys
+from typing import List
+
+import parser
+from modl_creator import Array, FALSE_VAL, FalseVal, Map, ModlValue, NULL_VAL, NullVal, Number, Pair, \
+    RawModlObject, String, TRUE_VAL, TrueVal, build_raw_modl
+
+MAGIC = b'MODLC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<5sBQq')  # Magic, format version, source size, source modification time (ns)
+FLOAT = struct.Struct('<d')
+
+TAG_NONE = 0
+TAG_STRING = 1
+TAG_INT = 2
+TAG_FLOAT = 3
+TAG_TRUE = 4
+TAG_FALSE = 5
+TAG_NULL = 6
+TAG_PAIR = 7
+TAG_MAP = 8
+TAG_ARRAY = 9
+
+
+def compiled_location(location: str) -> str:
+    """The location of the compiled form of a MODL file: config.modl is compiled to config.modlc."""
+    if location.endswith('.modl'):
+        return location + 'c'
+    return location + '.modlc'
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def dumps(raw_modl: RawModlObject, source_size: int = 0, source_mtime_ns: int = 0) -> bytes:
+    """Serialise a RawModlObject, recording the size and modification time of the source it came from."""
+    strings = {}
+    body = bytearray()
+
+    def write_string(value: str):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        _write_varint(body, index)
+
+    def write(value: ModlValue):
+        value_type = type(value)
+        if value is None:
+            body.append(TAG_NONE)
+        elif value_type is String:
+            body.append(TAG_STRING)
+            write_string(value.string)
+        elif value_type is Number:
+            number = value.get_value()
+            if isinstance(number, int):
+                body.append(TAG_INT)
+                # Zigzag encoded so that small negative numbers stay small
+                _write_varint(body, number * 2 if number >= 0 else -number * 2 - 1)
+            else:
+                body.append(TAG_FLOAT)
+                body.extend(FLOAT.pack(number))
+        elif value_type is TrueVal:
+            body.append(TAG_TRUE)
+        elif value_type is FalseVal:
+            body.append(TAG_FALSE)
+        elif value_type is NullVal:
+            body.append(TAG_NULL)
+        elif value_type is Pair:
+            body.append(TAG_PAIR)
+            write(value.get_key())
+            write(value.get_value())
+        elif value_type is Map or value_type is Array:
+            items = value.get_modl_values()
+            body.append(TAG_MAP if value_type is Map else TAG_ARRAY)
+            _write_varint(body, len(items))
+            for item in items:
+                write(item)
+        else:
+            raise ValueError(f"Can't compile a {value_type.__name__}")
+
+    _write_varint(body, len(raw_modl.structures))
+    for structure in raw_modl.structures:
+        write(structure)
+
+    out = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, source_size, source_mtime_ns))
+    _write_varint(out, len(strings))
+    for value in strings:
+        encoded = value.encode('utf-8', 'surrogatepass')
+        _write_varint(out, len(encoded))
+        out += encoded
+    out += body
+    return bytes(out)
+
+
+def read_header(data: bytes):
+    """Check the header of compiled MODL, returning the (source_size, source_mtime_ns) it records."""
+    if len(data) < HEADER.size:
+        raise ValueError('Not compiled MODL')
+    magic, version, source_size, source_mtime_ns = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not compiled MODL')
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Compiled MODL format version {version}, expected {FORMAT_VERSION}')
+    return source_size, source_mtime_ns
+
+
+def loads(data: bytes) -> RawModlObject:
+    """Deserialise a RawModlObject written by dumps(), raising ValueError if the data is damaged."""
+    read_header(data)
+    pos = HEADER.size
+
+    def read_varint() -> int:
+        nonlocal pos
+        result = 0
+        shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read() -> ModlValue:
+        nonlocal pos
+        tag = data[pos]
+        pos += 1
+        if tag == TAG_STRING:
+            return strings[read_varint()]
+        if tag == TAG_PAIR:
+            key = read()
+            return Pair(key, read())
+        if tag == TAG_MAP or tag == TAG_ARRAY:
+            container = Map() if tag == TAG_MAP else Array()
+            items = container.get_modl_values()
+            for _ in range(read_varint()):
+                items.append(read())
+            return container
+        if tag == TAG_INT:
+            number = read_varint()
+            return Number(number >> 1 if not number & 1 else -(number >> 1) - 1)
+        if tag == TAG_FLOAT:
+            pos += FLOAT.size
+            return Number(FLOAT.unpack_from(data, pos - FLOAT.size)[0])
+        if tag == TAG_NONE:
+            return None
+        if tag == TAG_TRUE:
+            return TRUE_VAL
+        if tag == TAG_FALSE:
+            return FALSE_VAL
+        if tag == TAG_NULL:
+            return NULL_VAL
+        raise ValueError(f'Unknown tag {tag} in compiled MODL')
+
+    try:
+        string_values: List[str] = []
+        for _ in range(read_varint()):
+            length = read_varint()
+            string_values.append(str(data[pos:pos + length], 'utf-8', 'surrogatepass'))
+            pos += length
+        # The same String object is shared by every use of a string, as nothing modifies raw Strings
+        strings = [String.unescaped(value) for value in string_values]
+
+        raw_modl = RawModlObject()
+        raw_modl.add_structures(read() for _ in range(read_varint()))
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise ValueError('Compiled MODL is truncated or damaged')
+    if pos != len(data):
+        raise ValueError('Compiled MODL has unexpected trailing data')
+    return raw_modl
+
+
+def compile_file(location: str, backend: str = parser.ANTLR_BACKEND) -> str:
+    """Compile a MODL file, writing compiled_location(location). Returns the location written."""
+    stat = os.stat(location)
+    raw_modl = build_raw_modl(parser.read_file(location), backend)
+    return _write(location, raw_modl, stat)
+
+
+def _write(location: str, raw_modl: RawModlObject, stat: os.stat_result) -> str:
+    compiled = compiled_location(location)
+    data = dumps(raw_modl, stat.st_size, stat.st_mtime_ns)
+    temporary = f'{compiled}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    # Replaced in one go so that readers never see a half written file
+    os.replace(temporary, compiled)
+    return compiled
+
+
+def load_file(location: str, backend: str = parser.ANTLR_BACKEND, write: bool = False) -> RawModlObject:
+    """
+    Load the RawModlObject for a MODL file, from its compiled form if that's up to date, otherwise by parsing it.
+    :param write: compile the file if it had to be parsed, ignoring any error writing the compiled form
+    """
+    stat = os.stat(location)
+    compiled = compiled_location(location)
+    try:
+        with open(compiled, 'rb') as f:
+            data = f.read()
+        if read_header(data) == (stat.st_size, stat.st_mtime_ns):
+            return loads(data)
+    except (OSError, ValueError):
+        pass
+
+    raw_modl = build_raw_modl(parser.read_file(location), backend)
+    if write:
+        try:
+            _write(location, raw_modl, stat)
+        except (OSError, ValueError):
+            pass
+    return raw_modl
+
+
+if __name__ == '__main__':
+    for source in sys.argv[1:]:
+        print(compile_file(source))
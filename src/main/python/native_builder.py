@@ -0,0 +1,380 @@
+"""
+Build modl_creator objects straight from the native parser's tokens.
+
+parser.parse() followed by modl_creator.process_modl_parsed() creates a parser.ModlParsed node for every
+rule, only for most of them to be thrown away once they have been turned into modl_creator objects.
+NativeBuilder makes the same grammar decisions as NativeParser but creates the RawModlObject values
+directly, so large documents need roughly half the objects and never hold both trees in memory at once.
+
+The result is exactly what modl_creator would have made, including its quirks: zero and "" values become
+None and conditionals are dropped. The parts of the document that modl_creator ignores (conditionals and
+import statements) are parsed by a plain NativeParser over the same tokens, so they fail, or don't, in the
+same way as before.
+
+In lazy mode maps and arrays only record where they start. Their items are built from the tokens the first
+time they're used, through get_modl_values(), get_by_name() and so on, so parts of a document that are never
+looked at, such as the returns of value conditionals that modl_creator drops, are never built. Brackets are
+still counted up front, but any other error inside a lazy map or array, syntax or otherwise, is only raised
+when its items are built. Each map or array builds its items from its own position in the tokens, so a lazy
+tree can be shared between threads, and the tokens are let go once every map and array in it has been built.
+"""
+import time
+from functools import partial
+from typing import Iterator, List
+
+import native_parser
+import parser
+import tracing
+from modl_creator import Array, FALSE_VAL, IMPORT_KEYS, Map, ModlValue, NULL_VAL, Number, Pair, RawModlObject, \
+    String, Structure, TRUE_VAL, process_import_statement
+from native_parser import ACCEPTS_ANY, ACCEPTS_NONE, ACCEPTS_SINGLE, ARRAY_ITEM_START, COLON, EQUALS, FALSE, \
+    LBRAC, LCBRAC, LSBRAC, MAP_ITEM_START, NEWLINE, NULL, NUMBER, QUOTED, RBRAC, RSBRAC, SC, STRING, TRUE, \
+    NativeParser, _number
+
+
+class NativeBuilder(NativeParser):
+    """NativeParser whose rule methods return modl_creator objects instead of parser nodes.
+    A rule returns None wherever modl_creator would have processed its node into None."""
+
+    def __init__(self, text: str, lazy: bool = False, max_depth: int = parser.DEFAULT_MAX_DEPTH):
+        super().__init__(text, max_depth)
+        self._lazy = lazy
+        self._plain = self._plain_parser()
+
+    def _plain_parser(self) -> NativeParser:
+        """A plain NativeParser that shares the tokens, for the rules that still need parser nodes"""
+        plain = object.__new__(NativeParser)
+        plain._text = self._text
+        plain._types = self._types
+        plain._texts = self._texts
+        plain._offsets = self._offsets
+        plain._memo = {}  # Separate from the builder's, whose value conditionals hold modl_creator objects
+        return plain
+
+    def _cursor(self, pos: int) -> 'NativeBuilder':
+        """A builder that shares the tokens, but has a position of its own, starting at pos"""
+        cursor = object.__new__(NativeBuilder)
+        cursor._text = self._text
+        cursor._types = self._types
+        cursor._texts = self._texts
+        cursor._offsets = self._offsets
+        cursor._pos = pos
+        cursor._memo = {}
+        cursor._lazy = self._lazy
+        cursor._plain = cursor._plain_parser()
+        return cursor
+
+    def _forget(self):
+        self._memo.clear()
+        self._plain._memo.clear()
+
+    def _parse_plain(self, rule, *args):
+        """Parse one rule from the current position with the plain NativeParser, returning its parser node."""
+        plain = self._plain
+        plain._pos = self._pos
+        node = rule(plain, *args)
+        self._pos = plain._pos
+        return node
+
+    # Rules
+
+    def modl(self) -> RawModlObject:
+        raw_modl_object = RawModlObject()
+        raw_modl_object.add_structures(self.structures())
+        return raw_modl_object
+
+    def structures(self) -> Iterator[Structure]:
+        for structure in super().structures():
+            if type(structure) is list:
+                # The import pairs for an import statement
+                yield from structure
+            else:
+                yield structure
+
+    def _structure(self) -> Structure:
+        start = self._pos
+        try:
+            token_type = self._types[self._pos]
+            if token_type == LBRAC:
+                return self._map()
+            if token_type == LSBRAC:
+                return self._array()
+            if token_type == LCBRAC:
+                self._parse_plain(NativeParser._top_level_conditional)
+                return None
+            text = self._texts[self._pos]
+            if token_type == STRING and text in IMPORT_KEYS or token_type == QUOTED and text[1:-1] in IMPORT_KEYS:
+                return process_import_statement(None, self._parse_plain(NativeParser._pair, 0, ACCEPTS_NONE))
+            return self._pair(0, ACCEPTS_NONE)
+        except ValueError:
+            raise
+        except Exception:
+            # modl_creator only sees a structure once it has parsed, so a syntax error in it comes first
+            self._pos = start
+            self._parse_plain(NativeParser._structure)
+            raise
+
+    def _map(self) -> Map:
+        if self._lazy:
+            end = self._skip_balanced(self._pos)
+            if end is not None:
+                modl_map = Map.lazy(partial(self._build_items_at, self._pos, NativeBuilder._build_map))
+                self._pos = end
+                return modl_map
+        return self._build_map()
+
+    def _build_map(self) -> Map:
+        types = self._types
+        modl_map = Map()
+        self._expect(LBRAC, "'('")
+        self._skip_newlines()
+        if types[self._pos] in MAP_ITEM_START:
+            pair = self._map_item()
+            if pair is not None:
+                modl_map.add(pair)
+            while True:
+                restart = self._pos
+                if types[self._pos] == SC:
+                    self._pos += 1
+                self._skip_newlines()
+                if types[self._pos] not in MAP_ITEM_START:
+                    self._pos = restart
+                    break
+                pair = self._map_item()
+                if pair is not None:
+                    modl_map.add(pair)
+            self._skip_newlines()
+        self._expect(RBRAC, "')'")
+        return modl_map
+
+    def _map_item(self) -> Pair:
+        if self._types[self._pos] == LCBRAC:
+            self._parse_plain(NativeParser._map_conditional)
+            return None
+        return self._pair(0, ACCEPTS_NONE)
+
+    def _array(self) -> Array:
+        if self._lazy:
+            end = self._skip_balanced(self._pos)
+            if end is not None:
+                array = Array.lazy(partial(self._build_items_at, self._pos, NativeBuilder._build_array))
+                self._pos = end
+                return array
+        return self._build_array()
+
+    def _build_array(self) -> Array:
+        types = self._types
+        array = Array()
+        items = array.array_items
+        self._expect(LSBRAC, "'['")
+        self._skip_newlines()
+        if types[self._pos] in ARRAY_ITEM_START:
+            self._add_array_element(items)
+            while True:
+                restart = self._pos
+                empty_items = 0
+                if types[self._pos] == SC:
+                    self._pos += 1
+                    while types[self._pos] == SC:
+                        empty_items += 1
+                        self._pos += 1
+                elif types[self._pos] == NEWLINE:
+                    self._skip_newlines()
+                else:
+                    break
+                if types[self._pos] not in ARRAY_ITEM_START:
+                    self._pos = restart
+                    break
+                for _ in range(empty_items):
+                    items.append(NULL_VAL)
+                self._add_array_element(items)
+            self._skip_newlines()
+        self._expect(RSBRAC, "']'")
+        return array
+
+    def _build_items_at(self, pos: int, build) -> List[ModlValue]:
+        """
+        Build the items of a lazy map or array starting at pos. They're built by a cursor of their own, so this
+        builder can be part way through iter_build(), or building other items in another thread, at the same time.
+        """
+        return build(self._cursor(pos)).get_modl_values()
+
+    def _add_array_element(self, items: List[ModlValue]):
+        """An array_item, or an nb_array if it's followed by a colon - whose items join the enclosing array."""
+        value = self._array_item(0, ACCEPTS_NONE)
+        if self._separator_follows():
+            items.extend(self._nb_array(value, 0).array_items)
+        elif value is not None:
+            items.append(value)
+
+    def _nb_array(self, first_value: ModlValue, need: int) -> Array:
+        types = self._types
+        array = Array()
+        items = array.array_items
+        if first_value is not None:
+            items.append(first_value)
+        while self._count_separators(self._pos, need + 1) > need:
+            self._skip_newlines()
+            self._pos += 1
+            while types[self._pos] == COLON:
+                items.append(NULL_VAL)
+                self._pos += 1
+            self._skip_newlines()
+            value = self._array_item(need, ACCEPTS_ANY)
+            if value is not None:
+                items.append(value)
+        return array
+
+    def _array_item(self, need: int, accepts: int) -> ModlValue:
+        if self._types[self._pos] == LCBRAC:
+            self._parse_plain(NativeParser._array_conditional)
+            return None
+        return self._array_value_item(need, accepts)
+
+    def _array_value_item(self, need: int, accepts: int) -> ModlValue:
+        token_type = self._types[self._pos]
+        if token_type == LBRAC:
+            return self._map()
+        if token_type == LSBRAC:
+            return self._array()
+        if (token_type == STRING or token_type == QUOTED) and self._is_pair(self._pos):
+            return self._pair(need, accepts)
+        return self._terminal()
+
+    def _pair(self, need: int, accepts: int) -> Pair:
+        types = self._types
+        token_type = types[self._pos]
+        if token_type == STRING:
+            key = self._texts[self._pos]
+        elif token_type == QUOTED:
+            key = self._texts[self._pos][1:-1]
+        else:
+            raise self._error('a key')
+
+        if key in IMPORT_KEYS:
+            # Only top-level import statements are kept, but process_import_statement can still fail on the parsed pair
+            process_import_statement(None, self._parse_plain(NativeParser._pair, need, accepts))
+            return None
+
+        pair = Pair(key=String(key))
+        self._pos += 1
+        if token_type == STRING and types[self._pos] == LBRAC:
+            pair.value = self._map()
+        elif token_type == STRING and types[self._pos] == LSBRAC:
+            pair.value = self._array()
+        else:
+            self._skip_newlines()
+            self._expect(EQUALS, "'='")
+            self._skip_newlines()
+            pair.value = self._value_item(need, accepts)
+        return pair
+
+    def _value_item(self, need: int, accepts: int) -> ModlValue:
+        if self._value_conditional_follows(need):
+            # The returns are still built, as modl_creator processes them, but the conditional becomes None
+            self._value_conditional()
+            return None
+        return self._value(need, accepts)
+
+    def _value(self, need: int, accepts: int) -> ModlValue:
+        start = self._pos
+        token_type = self._types[start]
+
+        if token_type == LBRAC or token_type == LSBRAC:
+            value = self._map() if token_type == LBRAC else self._array()
+            if need or not self._separator_follows() or accepts == ACCEPTS_ANY or \
+                    (accepts == ACCEPTS_SINGLE and self._single_colon_follows()):
+                return value
+            return self._nb_array(value, need)
+
+        if self._chain_separators(start, need + 1) > need:
+            return self._nb_array(self._array_item(need + 1, ACCEPTS_ANY), need)
+
+        if (token_type == STRING or token_type == QUOTED) and self._is_pair(start):
+            return self._pair(need, accepts)
+        return self._terminal()
+
+    def _terminal(self) -> ModlValue:
+        token_type = self._types[self._pos]
+        text = self._texts[self._pos]
+        # modl_creator skips falsy values, so zero and "" become None
+        if token_type == STRING:
+            value = String(text)
+        elif token_type == NUMBER:
+            number = _number(text)
+            value = Number(number) if number else None
+        elif token_type == QUOTED:
+            value = String(text[1:-1]) if len(text) > 2 else None
+        elif token_type == TRUE:
+            value = TRUE_VAL
+        elif token_type == FALSE:
+            value = FALSE_VAL
+        elif token_type == NULL:
+            value = NULL_VAL
+        else:
+            raise self._error('a value')
+        self._pos += 1
+        return value
+
+    # Conditionals, which modl_creator ignores
+
+    def _condition_test(self):
+        return self._parse_plain(NativeParser._condition_test)
+
+    def _top_level_conditional(self):
+        return self._parse_plain(NativeParser._top_level_conditional)
+
+    def _map_conditional(self):
+        return self._parse_plain(NativeParser._map_conditional)
+
+    def _array_conditional(self):
+        return self._parse_plain(NativeParser._array_conditional)
+
+
+def build(input_stream, lazy: bool = False, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> RawModlObject:
+    """Parse MODL text (or an ANTLR InputStream) straight into the RawModlObject that
+    modl_creator.process_modl_parsed(native_parser.parse(input_stream)) would return.
+    :param lazy: only build the items of each map and array when they're first used
+    :param max_depth: the deepest nesting to accept, see parser.DEFAULT_MAX_DEPTH"""
+    if not isinstance(input_stream, str):
+        input_stream = str(input_stream)
+    start = time.perf_counter() if tracing.subscribers else None
+    try:
+        raw_modl_object = NativeBuilder(input_stream, lazy, max_depth).modl()
+    except ValueError:
+        raise
+    except Exception:
+        # modl_creator only runs once the whole text has parsed, so a syntax error anywhere comes first
+        native_parser.parse(input_stream, max_depth)
+        raise
+    if start is not None:
+        tracing.emit('parse', {'backend': parser.NATIVE_BACKEND, 'structures': len(raw_modl_object.structures),
+                               'seconds': time.perf_counter() - start})
+    return raw_modl_object
+
+
+def iter_build(input_stream, lazy: bool = False, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> Iterator[Structure]:
+    """Parse MODL text (or an ANTLR InputStream), yielding each raw top-level structure as soon as it's complete,
+    the same as modl_creator.iter_process_modl_parsed(native_parser.iter_parse(input_stream))."""
+    if not isinstance(input_stream, str):
+        input_stream = str(input_stream)
+    start = time.perf_counter() if tracing.subscribers else None
+    structures = NativeBuilder(input_stream, lazy, max_depth).structures()
+    if start is not None:
+        return _traced(structures, time.perf_counter() - start)
+    return structures
+
+
+def _traced(structures: Iterator[Structure], seconds: float) -> Iterator[Structure]:
+    """As parser._traced(), but raw structures can be None."""
+    count = 0
+    done = object()
+    while True:
+        start = time.perf_counter()
+        structure = next(structures, done)
+        seconds += time.perf_counter() - start
+        if structure is done:
+            break
+        count += 1
+        yield structure
+    tracing.emit('parse', {'backend': parser.NATIVE_BACKEND, 'structures': count, 'seconds': seconds})
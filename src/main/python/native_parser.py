@@ -0,0 +1,734 @@
+"""
+A hand-written recursive-descent parser for MODL.
+
+This is an alternative to the ANTLR generated MODLParser used by parser.parse(). It takes its tokens from
+lexer.tokenize(), follows grammar/MODLParser.g4 and builds exactly the same parser.ModlParsed tree,
+so modl_creator and the interpreter don't need to know which backend was used.
+
+Where the grammar is ambiguous (mostly around non-bracketed arrays) ANTLR picks the lowest numbered
+alternative that still lets the rest of the input parse, so e.g. 'x=b=1:2:3' is the nb-array [b=[1,2], 3].
+The same choices are made here by counting the colon separators that are left in the current chain.
+"""
+from typing import Iterator, List
+
+import parser
+from generated.MODLLexer import MODLLexer
+from lexer import location, tokenize
+
+EOF = -1
+NULL = MODLLexer.NULL
+TRUE = MODLLexer.TRUE
+FALSE = MODLLexer.FALSE
+NEWLINE = MODLLexer.NEWLINE
+COLON = MODLLexer.COLON
+EQUALS = MODLLexer.EQUALS
+SC = MODLLexer.SC
+LBRAC = MODLLexer.LBRAC
+RBRAC = MODLLexer.RBRAC
+LSBRAC = MODLLexer.LSBRAC
+RSBRAC = MODLLexer.RSBRAC
+NUMBER = MODLLexer.NUMBER
+STRING = MODLLexer.STRING
+QUOTED = MODLLexer.QUOTED
+LCBRAC = MODLLexer.LCBRAC
+RCBRAC = MODLLexer.RCBRAC
+QMARK = MODLLexer.QMARK
+FSLASH = MODLLexer.FSLASH
+GTHAN = MODLLexer.GTHAN
+LTHAN = MODLLexer.LTHAN
+AMP = MODLLexer.AMP
+PIPE = MODLLexer.PIPE
+EXCLAM = MODLLexer.EXCLAM
+
+VALUE_START = {LBRAC, LSBRAC, STRING, QUOTED, NUMBER, TRUE, FALSE, NULL}
+ARRAY_ITEM_START = VALUE_START | {LCBRAC}
+STRUCTURE_START = {LBRAC, LSBRAC, LCBRAC, STRING, QUOTED}
+MAP_ITEM_START = {STRING, QUOTED, LCBRAC}
+COMPARISON_START = {GTHAN, LTHAN, EXCLAM}
+OPEN_BRACKETS = {LBRAC, LSBRAC, LCBRAC}
+CLOSE_BRACKETS = {RBRAC, RSBRAC, RCBRAC}
+
+# Colon separators that can follow a value without starting an nb-array of its own
+ACCEPTS_NONE = 0
+ACCEPTS_ANY = 1  # Items of an nb-array, which can take any run of colons
+ACCEPTS_SINGLE = 2  # Value conditional returns, which are separated by single colons
+
+
+def _number(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _pair_conditionals(tests: List, returns: List) -> dict:
+    """Match up condition tests with their returns the same way as the ANTLR listeners do - a final
+    return without a test of its own is the 'else' and gets an empty ConditionTest."""
+    conditionals = {}
+    for condition_test, conditional_return in zip(tests, returns):
+        conditionals[condition_test] = conditional_return
+    if len(returns) > len(tests):
+        conditionals[parser.ConditionTest()] = returns[-1]
+    return conditionals
+
+
+class NativeParser:
+    """Recursive-descent parser with one method per rule in MODLParser.g4.
+
+    Methods for values take two extra arguments used to resolve nb-array ambiguities:
+      need    - how many enclosing nb-arrays still need their first colon separator
+      accepts - which colon separators the enclosing rule could also take after this value
+    """
+
+    def __init__(self, text: str, max_depth: int = parser.DEFAULT_MAX_DEPTH):
+        self._text = text
+        self._types, self._texts, self._offsets = tokenize(text)
+        parser.check_depth(text, self._types, self._offsets, max_depth)
+        self._types.append(EOF)
+        self._texts.append('<EOF>')
+        self._offsets.append(len(text))
+        self._pos = 0
+        self._memo = {}  # (rule name, position) -> (node, end position), or the ValueError it raised
+
+    # Helpers
+
+    def _error(self, expecting: str):
+        text = self._texts[self._pos]
+        where = location(self._text, self._offsets[self._pos])
+        return ValueError(f"{where} mismatched input '{text}' expecting {expecting}")
+
+    def _expect(self, token_type: int, expecting: str):
+        if self._types[self._pos] != token_type:
+            raise self._error(expecting)
+        self._pos += 1
+
+    def _skip_newlines(self):
+        types = self._types
+        while types[self._pos] == NEWLINE:
+            self._pos += 1
+
+    def _skip_newlines_from(self, pos: int) -> int:
+        types = self._types
+        while types[pos] == NEWLINE:
+            pos += 1
+        return pos
+
+    def _separator_follows(self) -> bool:
+        return self._types[self._skip_newlines_from(self._pos)] == COLON
+
+    def _single_colon_follows(self) -> bool:
+        pos = self._skip_newlines_from(self._pos)
+        return self._types[pos] == COLON and self._types[pos + 1] != COLON and self._types[pos + 1] != NEWLINE
+
+    def _is_pair(self, pos: int) -> bool:
+        types = self._types
+        if types[pos] == STRING and (types[pos + 1] == LBRAC or types[pos + 1] == LSBRAC):
+            return True
+        return types[self._skip_newlines_from(pos + 1)] == EQUALS
+
+    def _skip_balanced(self, pos: int):
+        """Skip from the bracket at pos to just after the bracket that closes it. The end of every bracket
+        passed on the way is remembered too, so the same brackets aren't scanned again for each enclosing one."""
+        types = self._types
+        memo = self._memo
+        opened = []
+        while True:
+            token_type = types[pos]
+            if token_type in OPEN_BRACKETS:
+                end = memo.get(('balanced', pos))
+                if end is None:
+                    opened.append(pos)
+                    pos += 1
+                    continue
+                pos = end
+            elif token_type in CLOSE_BRACKETS:
+                pos += 1
+                memo[('balanced', opened.pop())] = pos
+            elif token_type == EOF:
+                return None
+            else:
+                pos += 1
+                continue
+            if not opened:
+                return pos
+
+    def _skip_element(self, pos: int):
+        """Skip over one item of a colon separated chain, including any 'key=' prefixes."""
+        types = self._types
+        while True:
+            token_type = types[pos]
+            if token_type == STRING or token_type == QUOTED:
+                after_key = self._skip_newlines_from(pos + 1)
+                if types[after_key] == EQUALS:
+                    pos = self._skip_newlines_from(after_key + 1)
+                    if types[pos] == LCBRAC and not self._is_value_conditional(pos):
+                        # The pair's value can only be an nb_array starting with an array conditional, which
+                        # takes at least the next separator and item
+                        return self._skip_nb_array_start(pos)
+                    continue
+                if token_type == STRING and (types[pos + 1] == LBRAC or types[pos + 1] == LSBRAC):
+                    return self._skip_balanced(pos + 1)
+                return pos + 1
+            if token_type in OPEN_BRACKETS:
+                return self._skip_balanced(pos)
+            if token_type == NUMBER or token_type == TRUE or token_type == FALSE or token_type == NULL:
+                return pos + 1
+            return None
+
+    def _skip_nb_array_start(self, pos: int):
+        """Skip over the first two items of an nb_array, and the separator between them."""
+        types = self._types
+        pos = self._skip_balanced(pos)
+        if pos is None:
+            return None
+        pos = self._skip_newlines_from(pos)
+        if types[pos] != COLON:
+            return None
+        while types[pos] == COLON:
+            pos += 1
+        return self._skip_element(self._skip_newlines_from(pos))
+
+    def _count_separators(self, pos: int, limit: int) -> int:
+        """Count the colon separators, up to limit, in the chain continuing at pos."""
+        types = self._types
+        count = 0
+        while count < limit:
+            pos = self._skip_newlines_from(pos)
+            if types[pos] != COLON:
+                break
+            while types[pos] == COLON:
+                pos += 1
+            pos = self._skip_newlines_from(pos)
+            if types[pos] == LCBRAC and not self._is_array_conditional(pos):
+                break
+            pos = self._skip_element(pos)
+            if pos is None:
+                break
+            count += 1
+        return count
+
+    def _chain_separators(self, pos: int, limit: int) -> int:
+        """Count the colon separators, up to limit, following the chain item starting at pos."""
+        end = self._skip_element(pos)
+        if end is None:
+            return 0
+        return self._count_separators(end, limit)
+
+    # Rules
+
+    def modl(self) -> parser.ModlParsed:
+        modl = parser.ModlParsed()
+        for structure in self.structures():
+            modl.append(structure)
+        return modl
+
+    def structures(self) -> Iterator[parser.Structure]:
+        """Parse the modl rule, yielding each structure as soon as it's complete. A syntax error is only
+        raised once the parser reaches it, so earlier structures will already have been yielded."""
+        types = self._types
+        self._skip_newlines()
+        if types[self._pos] in STRUCTURE_START:
+            yield self._structure()
+            while True:
+                restart = self._pos
+                self._skip_newlines()
+                if types[self._pos] == SC:
+                    self._pos += 1
+                self._skip_newlines()
+                if types[self._pos] not in STRUCTURE_START:
+                    self._pos = restart
+                    break
+                # Nothing before the next structure is parsed again
+                self._forget()
+                yield self._structure()
+        self._skip_newlines()
+        if types[self._pos] == SC:
+            self._pos += 1
+        self._skip_newlines()
+        self._expect(EOF, '<EOF>')
+
+    def _structure(self) -> parser.Structure:
+        structure = parser.Structure()
+        token_type = self._types[self._pos]
+        if token_type == LBRAC:
+            structure.map = self._map()
+        elif token_type == LSBRAC:
+            structure.array = self._array()
+        elif token_type == LCBRAC:
+            structure.top_level_conditional = self._top_level_conditional()
+        else:
+            structure.pair = self._pair(0, ACCEPTS_NONE)
+        return structure
+
+    def _map(self) -> parser.Map:
+        types = self._types
+        modl_map = parser.Map()
+        self._expect(LBRAC, "'('")
+        self._skip_newlines()
+        if types[self._pos] in MAP_ITEM_START:
+            modl_map.map_items = [self._map_item()]
+            while True:
+                restart = self._pos
+                if types[self._pos] == SC:
+                    self._pos += 1
+                self._skip_newlines()
+                if types[self._pos] not in MAP_ITEM_START:
+                    self._pos = restart
+                    break
+                modl_map.map_items.append(self._map_item())
+            self._skip_newlines()
+        self._expect(RBRAC, "')'")
+        return modl_map
+
+    def _map_item(self) -> parser.MapItem:
+        map_item = parser.MapItem()
+        if self._types[self._pos] == LCBRAC:
+            map_item.map_conditional = self._map_conditional()
+        else:
+            map_item.pair = self._pair(0, ACCEPTS_NONE)
+        return map_item
+
+    def _array(self) -> parser.Array:
+        types = self._types
+        array = parser.Array()
+        array.array_items = []
+        self._expect(LSBRAC, "'['")
+        self._skip_newlines()
+        if types[self._pos] in ARRAY_ITEM_START:
+            array.array_items.append(self._array_element())
+            while True:
+                restart = self._pos
+                empty_items = 0
+                if types[self._pos] == SC:
+                    self._pos += 1
+                    while types[self._pos] == SC:
+                        empty_items += 1
+                        self._pos += 1
+                elif types[self._pos] == NEWLINE:
+                    self._skip_newlines()
+                else:
+                    break
+                if types[self._pos] not in ARRAY_ITEM_START:
+                    self._pos = restart
+                    break
+                for _ in range(empty_items):
+                    array.array_items.append(parser.handle_empty_array_item())
+                array.array_items.append(self._array_element())
+            self._skip_newlines()
+        self._expect(RSBRAC, "']'")
+        return array
+
+    def _array_element(self):
+        """An array_item, or an nb_array if the item turns out to be followed by a colon."""
+        array_item = self._array_item(0, ACCEPTS_NONE)
+        if self._separator_follows():
+            return self._nb_array(array_item, 0)
+        return array_item
+
+    def _nb_array(self, first_item: parser.ArrayItem, need: int) -> parser.NbArray:
+        types = self._types
+        nb_array = parser.NbArray()
+        nb_array.array_items = [first_item]
+        while self._count_separators(self._pos, need + 1) > need:
+            self._skip_newlines()
+            self._pos += 1
+            while types[self._pos] == COLON:
+                nb_array.array_items.append(parser.handle_empty_array_item())
+                self._pos += 1
+            self._skip_newlines()
+            nb_array.array_items.append(self._array_item(need, ACCEPTS_ANY))
+        return nb_array
+
+    def _array_item(self, need: int, accepts: int) -> parser.ArrayItem:
+        array_item = parser.ArrayItem()
+        if self._types[self._pos] == LCBRAC:
+            array_item.array_conditional = self._array_conditional()
+        else:
+            array_item.array_value_item = self._array_value_item(need, accepts)
+        return array_item
+
+    def _array_value_item(self, need: int, accepts: int) -> parser.ArrayValueItem:
+        item = parser.ArrayValueItem()
+        token_type = self._types[self._pos]
+        text = self._texts[self._pos]
+        if token_type == LBRAC:
+            item.map = self._map()
+            return item
+        if token_type == LSBRAC:
+            item.array = self._array()
+            return item
+        if (token_type == STRING or token_type == QUOTED) and self._is_pair(self._pos):
+            item.pair = self._pair(need, accepts)
+            return item
+
+        if token_type == STRING:
+            item.string = text
+        elif token_type == NUMBER:
+            item.number = _number(text)
+        elif token_type == QUOTED:
+            item.quoted = text[1:-1]
+        elif token_type == TRUE:
+            item.is_true = True
+        elif token_type == FALSE:
+            item.is_false = True
+        elif token_type == NULL:
+            item.is_null = True
+        else:
+            raise self._error('a value')
+        self._pos += 1
+        return item
+
+    def _pair(self, need: int, accepts: int) -> parser.Pair:
+        types = self._types
+        pair = parser.Pair()
+        token_type = types[self._pos]
+        if token_type == STRING:
+            pair.key = self._texts[self._pos]
+        elif token_type == QUOTED:
+            pair.key = self._texts[self._pos][1:-1]
+        else:
+            raise self._error('a key')
+        self._pos += 1
+
+        if token_type == STRING and types[self._pos] == LBRAC:
+            pair.map = self._map()
+        elif token_type == STRING and types[self._pos] == LSBRAC:
+            pair.array = self._array()
+        else:
+            self._skip_newlines()
+            self._expect(EQUALS, "'='")
+            self._skip_newlines()
+            pair.value_item = self._value_item(need, accepts)
+        return pair
+
+    def _value_item(self, need: int, accepts: int) -> parser.ValueItem:
+        value_item = parser.ValueItem()
+        if self._value_conditional_follows(need):
+            value_item.value_conditional = self._value_conditional()
+        else:
+            value_item.value = self._value(need, accepts)
+        return value_item
+
+    def _value_conditional_follows(self, need: int) -> bool:
+        if self._types[self._pos] != LCBRAC:
+            return False
+        # A modl_value can only start with '{' if it's an nb_array starting with an array conditional
+        end = self._skip_balanced(self._pos)
+        return not (end is not None and self._count_separators(end, need + 1) > need
+                    and self._is_array_conditional(self._pos))
+
+    def _is_array_conditional(self, pos: int) -> bool:
+        """Check whether the conditional starting at pos is valid as an array conditional."""
+        return self._parses_at(pos, self._array_conditional)
+
+    def _is_value_conditional(self, pos: int) -> bool:
+        """Check whether the conditional starting at pos is valid as a value conditional."""
+        return self._parses_at(pos, self._value_conditional)
+
+    def _parses_at(self, pos: int, rule) -> bool:
+        start = self._pos
+        self._pos = pos
+        try:
+            rule()
+            return True
+        except ValueError:
+            return False
+        finally:
+            self._pos = start
+
+    def _forget(self):
+        self._memo.clear()
+
+    def _memoised(self, name: str, rule):
+        """
+        Parse rule from the current position, or reuse the result from the last time it was parsed there.
+        Conditionals are trial parsed to choose between alternatives, and without this the conditionals nested
+        inside them would be parsed again for every enclosing trial, which is exponential in the nesting.
+        """
+        key = (name, self._pos)
+        result = self._memo.get(key)
+        if result is None:
+            try:
+                node = rule()
+            except ValueError as error:
+                self._memo[key] = error
+                raise
+            self._memo[key] = node, self._pos
+            return node
+        if isinstance(result, ValueError):
+            raise result.with_traceback(None)
+        node, self._pos = result
+        return node
+
+    def _value(self, need: int, accepts: int) -> parser.Value:
+        value = parser.Value()
+        start = self._pos
+        token_type = self._types[start]
+
+        if token_type == LBRAC or token_type == LSBRAC:
+            node = self._map() if token_type == LBRAC else self._array()
+            if need or not self._separator_follows() or accepts == ACCEPTS_ANY or \
+                    (accepts == ACCEPTS_SINGLE and self._single_colon_follows()):
+                if token_type == LBRAC:
+                    value.map = node
+                else:
+                    value.array = node
+                return value
+            first_item = parser.ArrayItem()
+            first_item.array_value_item = parser.ArrayValueItem()
+            if token_type == LBRAC:
+                first_item.array_value_item.map = node
+            else:
+                first_item.array_value_item.array = node
+            value.nb_array = self._nb_array(first_item, need)
+            return value
+
+        if self._chain_separators(start, need + 1) > need:
+            value.nb_array = self._nb_array(self._array_item(need + 1, ACCEPTS_ANY), need)
+            return value
+
+        text = self._texts[start]
+        if (token_type == STRING or token_type == QUOTED) and self._is_pair(start):
+            value.pair = self._pair(need, accepts)
+            return value
+
+        if token_type == STRING:
+            value.string = text
+        elif token_type == NUMBER:
+            value.number = _number(text)
+        elif token_type == QUOTED:
+            value.quoted = text[1:-1]
+        elif token_type == TRUE:
+            value.is_true = True
+        elif token_type == FALSE:
+            value.is_false = True
+        elif token_type == NULL:
+            value.is_null = True
+        else:
+            raise self._error('a value')
+        self._pos += 1
+        return value
+
+    # Conditionals
+
+    def _condition_test(self) -> parser.ConditionTest:
+        types = self._types
+        condition_test = parser.ConditionTest()
+        last_operator = None
+        while True:
+            should_negate = False
+            if types[self._pos] == EXCLAM:
+                should_negate = True
+                self._pos += 1
+            if types[self._pos] == LCBRAC:
+                subcondition = self._condition_group()
+            else:
+                subcondition = self._condition()
+            condition_test.subconditions.append((subcondition, last_operator, should_negate))
+            if types[self._pos] != AMP and types[self._pos] != PIPE:
+                return condition_test
+            last_operator = self._texts[self._pos]
+            self._pos += 1
+
+    def _condition_group(self) -> parser.ConditionGroup:
+        types = self._types
+        condition_group = parser.ConditionGroup()
+        self._expect(LCBRAC, "'{'")
+        # The ANTLR listener records the opening bracket as the operator of the first test
+        last_operator = '{'
+        while True:
+            condition_group.condition_tests.append((self._condition_test(), last_operator))
+            if types[self._pos] != AMP and types[self._pos] != PIPE:
+                break
+            last_operator = self._texts[self._pos]
+            self._pos += 1
+        self._expect(RCBRAC, "'}'")
+        return condition_group
+
+    def _condition(self) -> parser.Condition:
+        types = self._types
+        condition = parser.Condition()
+        self._skip_newlines()
+
+        if types[self._pos] == STRING:
+            following = types[self._pos + 1]
+            if following in VALUE_START or following == EQUALS or following == GTHAN or following == LTHAN or \
+                    (following == EXCLAM and types[self._pos + 2] == EQUALS):
+                condition.key = self._texts[self._pos]
+                self._pos += 1
+
+        token_type = types[self._pos]
+        if token_type == EQUALS:
+            condition.operator = '='
+            self._pos += 1
+        elif token_type == GTHAN or token_type == LTHAN:
+            condition.operator = self._texts[self._pos]
+            self._pos += 1
+            if types[self._pos] == EQUALS:
+                condition.operator += '='
+                self._pos += 1
+        elif token_type == EXCLAM and types[self._pos + 1] == EQUALS:
+            condition.operator = '!='
+            self._pos += 2
+
+        condition.values.append(self._value(0, ACCEPTS_NONE))
+        while types[self._pos] == PIPE and types[self._pos + 1] in VALUE_START:
+            if types[self._pos + 1] == STRING and types[self._pos + 2] in COMPARISON_START:
+                # 'a=1|b>2' - the '|' joins another condition rather than adding a value
+                break
+            self._pos += 1
+            condition.values.append(self._value(0, ACCEPTS_NONE))
+        self._skip_newlines()
+        return condition
+
+    def _conditional_branches(self, parse_return, value_rule: bool = False):
+        """Parse the 'test? return / test? return ...' part of a conditional, up to and including the '}'.
+
+        Value conditionals have stricter rules: they can be just '{test?}', otherwise they must end with
+        exactly one '/?' else branch.
+        """
+        types = self._types
+        tests = [self._condition_test()]
+        self._expect(QMARK, "'?'")
+        if value_rule and types[self._pos] == RCBRAC:
+            self._pos += 1
+            return _pair_conditionals(tests, [])
+        self._skip_newlines()
+        returns = [parse_return()]
+        self._skip_newlines()
+        has_else = False
+        while types[self._pos] == FSLASH:
+            if value_rule and has_else:
+                raise self._error("'}'")
+            self._pos += 1
+            self._skip_newlines()
+            if types[self._pos] == QMARK:
+                has_else = True
+            else:
+                tests.append(self._condition_test())
+            self._expect(QMARK, "'?'")
+            self._skip_newlines()
+            returns.append(parse_return())
+            self._skip_newlines()
+        if value_rule and not has_else:
+            raise self._error("'/'")
+        self._expect(RCBRAC, "'}'")
+        return _pair_conditionals(tests, returns)
+
+    def _top_level_conditional(self) -> parser.TopLevelConditional:
+        top_level_conditional = parser.TopLevelConditional()
+        self._expect(LCBRAC, "'{'")
+        self._skip_newlines()
+        top_level_conditional.conditions = self._conditional_branches(self._top_level_conditional_return)
+        return top_level_conditional
+
+    def _top_level_conditional_return(self) -> parser.TopLevelConditionalReturn:
+        types = self._types
+        conditional_return = parser.TopLevelConditionalReturn()
+        conditional_return.structures.append(self._structure())
+        while True:
+            restart = self._pos
+            if types[self._pos] == SC:
+                self._pos += 1
+                if types[self._pos] == NEWLINE:
+                    self._pos += 1
+            elif types[self._pos] == NEWLINE:
+                self._pos += 1
+            else:
+                break
+            if types[self._pos] not in STRUCTURE_START:
+                self._pos = restart
+                break
+            conditional_return.structures.append(self._structure())
+        if types[self._pos] == SC:
+            self._pos += 1
+        self._skip_newlines()
+        return conditional_return
+
+    def _map_conditional(self) -> parser.MapConditional:
+        map_conditional = parser.MapConditional()
+        self._expect(LCBRAC, "'{'")
+        self._skip_newlines()
+        map_conditional.map_conditionals = self._conditional_branches(self._map_conditional_return)
+        return map_conditional
+
+    def _map_conditional_return(self) -> parser.MapConditionalReturn:
+        types = self._types
+        conditional_return = parser.MapConditionalReturn()
+        conditional_return.map_items.append(self._map_item())
+        while True:
+            restart = self._pos
+            if types[self._pos] == SC:
+                self._pos += 1
+            self._skip_newlines()
+            if types[self._pos] not in MAP_ITEM_START:
+                self._pos = restart
+                break
+            conditional_return.map_items.append(self._map_item())
+        if types[self._pos] == SC:
+            self._pos += 1
+        self._skip_newlines()
+        return conditional_return
+
+    def _array_conditional(self) -> parser.ArrayConditional:
+        return self._memoised('array_conditional', self._parse_array_conditional)
+
+    def _parse_array_conditional(self) -> parser.ArrayConditional:
+        array_conditional = parser.ArrayConditional()
+        self._expect(LCBRAC, "'{'")
+        self._skip_newlines()
+        array_conditional.conditions = self._conditional_branches(self._array_conditional_return)
+        return array_conditional
+
+    def _array_conditional_return(self) -> parser.ArrayConditionalReturn:
+        types = self._types
+        conditional_return = parser.ArrayConditionalReturn()
+        conditional_return.array_items.append(self._array_item(0, ACCEPTS_NONE))
+        while True:
+            restart = self._pos
+            if types[self._pos] == SC:
+                self._pos += 1
+            self._skip_newlines()
+            if self._pos == restart or types[self._pos] not in ARRAY_ITEM_START:
+                self._pos = restart
+                break
+            conditional_return.array_items.append(self._array_item(0, ACCEPTS_NONE))
+        self._skip_newlines()
+        return conditional_return
+
+    def _value_conditional(self) -> parser.ValueConditional:
+        return self._memoised('value_conditional', self._parse_value_conditional)
+
+    def _parse_value_conditional(self) -> parser.ValueConditional:
+        value_conditional = parser.ValueConditional()
+        self._expect(LCBRAC, "'{'")
+        self._skip_newlines()
+        value_conditional.value_conditionals = self._conditional_branches(self._value_conditional_return, True)
+        return value_conditional
+
+    def _value_conditional_return(self) -> parser.ValueConditionalReturn:
+        types = self._types
+        conditional_return = parser.ValueConditionalReturn()
+        conditional_return.value_items.append(self._value_item(0, ACCEPTS_SINGLE))
+        while True:
+            separator = self._skip_newlines_from(self._pos)
+            if types[separator] != COLON:
+                break
+            self._pos = separator + 1
+            conditional_return.value_items.append(self._value_item(0, ACCEPTS_SINGLE))
+        return conditional_return
+
+
+def parse(input_stream, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> parser.ModlParsed:
+    """Parse MODL text (or an ANTLR InputStream) into a ModlParsed tree without using ANTLR."""
+    if not isinstance(input_stream, str):
+        input_stream = str(input_stream)
+    return NativeParser(input_stream, max_depth).modl()
+
+
+def iter_parse(input_stream, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> Iterator[parser.Structure]:
+    """Parse MODL text (or an ANTLR InputStream), yielding each top-level parser.Structure in turn. The whole
+    text is tokenised and depth-checked before the first structure is parsed."""
+    if not isinstance(input_stream, str):
+        input_stream = str(input_stream)
+    return NativeParser(input_stream, max_depth).structures()
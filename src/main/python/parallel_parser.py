@@ -0,0 +1,139 @@
+"""
+Parse large MODL documents on several cores.
+
+A document is a sequence of structures, and a structure can only end at a ';' or newline which isn't inside
+any brackets. The text is split at those boundaries into chunks, the chunks are parsed in a
+ProcessPoolExecutor, and their structures are joined back together in order to give the same ModlParsed as
+parser.parse().
+
+This pays off for the ANTLR backend. The native backend parses about as fast as its tree can be pickled
+back from a worker, so it gains little. Inputs that don't split into more than one chunk, and inputs with
+syntax errors, are parsed in this process with parser.parse(), so errors are reported the same way.
+"""
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Union
+
+from antlr4 import CommonTokenStream, InputStream, ParseTreeWalker
+
+import parser
+import tracing
+from generated.MODLLexer import MODLLexer
+from generated.MODLParser import MODLParser
+from lexer import ModlLexer, scan
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+SEPARATORS = {MODLLexer.SC, MODLLexer.NEWLINE}
+OPEN_BRACKETS = {MODLLexer.LBRAC, MODLLexer.LSBRAC, MODLLexer.LCBRAC}
+CLOSE_BRACKETS = {MODLLexer.RBRAC, MODLLexer.RSBRAC, MODLLexer.RCBRAC}
+STRUCTURE_START = {MODLLexer.LBRAC, MODLLexer.LSBRAC, MODLLexer.LCBRAC, MODLLexer.STRING, MODLLexer.QUOTED}
+
+
+class _LexerError(Exception):
+    pass
+
+
+def _raise_lexer_error(start, stop):
+    raise _LexerError()
+
+
+def split_points(text: str) -> Union[List[int], None]:
+    """
+    Find the offsets that the text can be split at without changing how it parses: just after a top-level
+    ';' or newline, where the next token (ignoring newlines) starts a new structure.
+    :return: the offsets in increasing order, or None if the text doesn't lex cleanly
+    """
+    points = []
+    depth = 0
+    candidate = None  # The end of the last top-level separator
+    try:
+        for token_type, start, stop in scan(text, _raise_lexer_error):
+            if token_type in SEPARATORS:
+                if not depth:
+                    candidate = stop
+                continue
+            if candidate is not None and token_type in STRUCTURE_START:
+                points.append(candidate)
+            candidate = None
+            if token_type in OPEN_BRACKETS:
+                depth += 1
+            elif token_type in CLOSE_BRACKETS and depth:
+                depth -= 1
+    except _LexerError:
+        return None
+    return points
+
+
+def split(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Union[List[str], None]:
+    """
+    Split the text into chunks of at least chunk_size characters (apart from the last one) at split_points().
+    :return: the chunks, or None if the text doesn't lex cleanly
+    """
+    points = split_points(text)
+    if points is None:
+        return None
+    chunks = []
+    start = 0
+    for point in points:
+        if point - start >= chunk_size:
+            chunks.append(text[start:point])
+            start = point
+    chunks.append(text[start:])
+    return chunks
+
+
+def _parse_chunk(text: str, backend: str, max_depth: int) -> Union[List[parser.Structure], None]:
+    """Parse one chunk in a worker process, returning None if it has any syntax errors"""
+    try:
+        if backend == parser.NATIVE_BACKEND:
+            return parser.parse(text, backend, max_depth=max_depth).structures
+        stream = CommonTokenStream(ModlLexer(InputStream(text)))
+        stream.fill()
+        parser.check_depth(text, [token.type for token in stream.tokens], [token.start for token in stream.tokens],
+                           max_depth)
+        modl_parser = MODLParser(stream)
+        modl_parser.removeErrorListeners()
+        tree = parser.two_stage_parse(modl_parser)
+        if modl_parser.getNumberOfSyntaxErrors():
+            return None
+        listener = parser.ModlObjectListener()
+        ParseTreeWalker().walk(listener, tree)
+        return listener.modl_object().structures
+    except Exception:
+        # Parsed again by the caller so that the error is reported against the whole text
+        return None
+
+
+def parse(input_stream, backend: str = parser.ANTLR_BACKEND, executor: Executor = None, max_workers: int = None,
+          chunk_size: int = DEFAULT_CHUNK_SIZE, max_depth: int = parser.DEFAULT_MAX_DEPTH) -> parser.ModlParsed:
+    """
+    Parse MODL text (or an ANTLR InputStream) into a ModlParsed tree, parsing chunks of it in parallel.
+    :param executor: the executor to parse chunks with. By default a ProcessPoolExecutor with max_workers
+    processes is created for this call, so pass one in to avoid starting new processes each time.
+    :param chunk_size: the smallest number of characters to send to a worker
+    :param max_depth: the deepest nesting to accept, see parser.DEFAULT_MAX_DEPTH
+    """
+    if backend not in (parser.ANTLR_BACKEND, parser.NATIVE_BACKEND):
+        raise ValueError(f'Unknown parser backend: {backend}')
+    text = input_stream if isinstance(input_stream, str) else str(input_stream)
+    chunks = split(text, chunk_size)
+    if chunks is None or len(chunks) < 2:
+        return parser.parse(text, backend, max_depth=max_depth)
+
+    start = time.perf_counter() if tracing.subscribers else None
+    if executor is None:
+        with ProcessPoolExecutor(max_workers) as pool:
+            results = list(pool.map(_parse_chunk, chunks, [backend] * len(chunks), [max_depth] * len(chunks)))
+    else:
+        results = list(executor.map(_parse_chunk, chunks, [backend] * len(chunks), [max_depth] * len(chunks)))
+    if any(structures is None for structures in results):
+        return parser.parse(text, backend, max_depth=max_depth)
+
+    modl_parsed = parser.ModlParsed()
+    for structures in results:
+        modl_parsed.structures.extend(structures)
+    if start is not None:
+        tracing.emit('parse', {'backend': backend, 'structures': len(modl_parsed.structures),
+                               'seconds': time.perf_counter() - start, 'chunks': len(chunks)})
+    return modl_parsed
@@ -0,0 +1,133 @@
+"""
+An opt-in LRU cache of processed MODL, for callers that see the same payloads over and over again.
+
+Entries are keyed by a hash of the input text (and the parser backend), and hold the RawModlObject that
+modl_creator.build_raw_modl() returns. The interpreter never modifies a RawModlObject, so a cached one
+can be interpreted any number of times:
+
+    cache = ParseCache(max_bytes=64 * 1024 * 1024)
+    modl.to_json(text, cache=cache)
+"""
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import parser
+from modl_creator import RawModlObject, build_raw_modl
+
+
+_UNSET = object()
+_slot_names_by_class = {}
+
+
+def _slot_names(cls) -> tuple:
+    """The names of the __slots__ attributes declared by a class and its base classes"""
+    names = _slot_names_by_class.get(cls)
+    if names is None:
+        names = []
+        for klass in cls.__mro__:
+            slots = klass.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            names.extend(name for name in slots if name not in ('__dict__', '__weakref__'))
+        names = _slot_names_by_class[cls] = tuple(names)
+    return names
+
+
+def _deep_sizeof(obj) -> int:
+    """Approximate the memory used by an object tree, counting shared objects once."""
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, (str, bytes, int, float, bool)) or current is None:
+            continue
+        if isinstance(current, dict):
+            pending.extend(current.keys())
+            pending.extend(current.values())
+        elif isinstance(current, (list, tuple, set)):
+            pending.extend(current)
+        else:
+            if hasattr(current, '__dict__'):
+                # Attribute names are shared between instances, and the size of the instance dict itself depends
+                # on whether it has been materialized yet, so only the attribute values are counted
+                pending.extend(vars(current).values())
+            for name in _slot_names(type(current)):
+                value = getattr(current, name, _UNSET)
+                if value is not _UNSET:
+                    pending.append(value)
+    return size
+
+
+class ParseCache:
+    """A size-bounded LRU cache of RawModlObjects, keyed by a hash of the MODL text."""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None):
+        """
+        :param max_entries: the most entries to keep
+        :param max_bytes: an approximate memory budget for the cached trees, or None for no limit
+        """
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (RawModlObject, size in bytes)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(text: str, backend: str, max_depth: int):
+        # The depth limit is part of the key, so a document can't get past a lower limit by already being cached
+        return backend, max_depth, hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=32).digest()
+
+    def get_raw_modl(self, input_stream, backend: str = parser.ANTLR_BACKEND,
+                     max_depth: int = parser.DEFAULT_MAX_DEPTH) -> RawModlObject:
+        """Return the RawModlObject for the MODL text (or an ANTLR InputStream), parsing it if it isn't cached.
+        The result is shared with other callers, so it must be treated as read-only."""
+        text = input_stream if isinstance(input_stream, str) else str(input_stream)
+        key = self._key(text, backend, max_depth)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        raw_modl_object = build_raw_modl(text, backend, max_depth=max_depth)
+        size = _deep_sizeof(raw_modl_object)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Too big to cache at all
+            return raw_modl_object
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (raw_modl_object, size)
+                self.current_bytes += size
+                self._evict()
+        return raw_modl_object
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or \
+                (self.max_bytes is not None and self.current_bytes > self.max_bytes):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.current_bytes -= size
+
+    def clear(self):
+        """Remove every entry and reset the hit and miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = 0
+            self.misses = 0
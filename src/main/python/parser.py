@@ -1,12 +1,21 @@
-import logging
-from typing import List, Dict
-
+import mmap
+import os
+import time
+from collections import Counter
+from typing import Iterator, List, Dict, Tuple
+
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
 from antlr4.tree.Tree import TerminalNodeImpl
 
 from generated.MODLParserListener import MODLParserListener
 from generated.MODLLexer import MODLLexer, CommonTokenStream, ParseTreeWalker
 from generated.MODLParser import MODLParser
 from antlr4 import InputStream
+import tracing
+from lexer import ModlLexer, location
 
 
 class ModlObjectListener(MODLParserListener):
@@ -14,22 +23,31 @@ class ModlObjectListener(MODLParserListener):
         self.modl = ModlParsed()
 
     def enterModl(self, ctx:MODLParser.ModlContext):
-        text = ctx.getText()
-        logging.debug(f"Entered MODL: {text}")
-
         for struct in ctx.modl_structure():
-            structure = Structure()
-            struct.enterRule(structure)
-            self.modl.append(structure)
-
-    def exitModl(self, ctx:MODLParser.ModlContext):
-        logging.debug("Exit MODL")
+            self.modl.append(_structure(struct))
 
     def modl_object(self):
         return self.modl
 
 
+def _structure(ctx: MODLParser.Modl_structureContext):
+    structure = Structure()
+    ctx.enterRule(structure)
+    return structure
+
+
+class ParsedNode:
+    """
+    Base class of the parse tree nodes. The ANTLR contexts only call the enter methods that a node has, so
+    nodes don't need to inherit MODLParserListener, and they use __slots__ instead of an instance dict since
+    a large document has hundreds of thousands of them.
+    """
+    __slots__ = ()
+
+
 class ModlParsed:
+    __slots__ = ('_structures',)
+
     def __init__(self):
         self._structures: List[Structure] = []
 
@@ -45,7 +63,9 @@ class ModlParsed:
         self.structures.append(structure)
 
 
-class Structure(MODLParserListener):
+class Structure(ParsedNode):
+    __slots__ = ('pair', 'array', 'top_level_conditional', 'map')
+
     def __init__(self):
         self.pair: Pair = None
         self.array: Array = None
@@ -53,7 +73,6 @@ class Structure(MODLParserListener):
         self.map: Map = None
 
     def enterModl_structure(self, ctx:MODLParser.Modl_structureContext):
-        logging.debug("Enter MODL Structure %s", ctx.getText())
         if ctx.modl_pair():
             self.pair = Pair()
             ctx.modl_pair().enterRule(self.pair)
@@ -68,7 +87,9 @@ class Structure(MODLParserListener):
             ctx.modl_map().enterRule(self.map)
 
 
-class Map(MODLParserListener):
+class Map(ParsedNode):
+    __slots__ = ('map_items',)
+
     def __init__(self):
         self.map_items: List[MapItem] = None
 
@@ -86,7 +107,9 @@ class Map(MODLParserListener):
                 self.map_items.append(map_item)
 
 
-class MapItem(MODLParserListener):
+class MapItem(ParsedNode):
+    __slots__ = ('pair', 'map_conditional')
+
     def __init__(self):
         self.pair = None
         self.map_conditional = None
@@ -112,7 +135,9 @@ class MapItem(MODLParserListener):
             ctx.modl_map_conditional().enterRule(self.map_conditional)
 
 
-class MapConditional(MODLParserListener):
+class MapConditional(ParsedNode):
+    __slots__ = ('map_conditionals',)
+
     def __init__(self):
         self.map_conditionals = {}
 
@@ -132,7 +157,9 @@ class MapConditional(MODLParserListener):
             self.map_conditionals[condition_test] = conditional_return
 
 
-class MapConditionalReturn(MODLParserListener):
+class MapConditionalReturn(ParsedNode):
+    __slots__ = ('map_items',)
+
     def __init__(self):
         self.map_items = []
 
@@ -144,12 +171,14 @@ class MapConditionalReturn(MODLParserListener):
                 self.map_items.append(map_item)
 
 
-class SubCondition(MODLParserListener):
+class SubCondition(ParsedNode):
     """Base class"""
-    pass
+    __slots__ = ()
 
 
 class ConditionGroup(SubCondition):
+    __slots__ = ('condition_tests',)
+
     def __init__(self):
         self.condition_tests = []
 
@@ -171,6 +200,8 @@ class ConditionGroup(SubCondition):
 
 
 class Condition(SubCondition):
+    __slots__ = ('key', 'operator', 'values')
+
     def __init__(self):
         self.key = None
         self.operator = None
@@ -190,7 +221,9 @@ class Condition(SubCondition):
             self.values.append(value)
 
 
-class ConditionTest(MODLParserListener):
+class ConditionTest(ParsedNode):
+    __slots__ = ('subconditions',)
+
     def __init__(self):
         self.subconditions = []
 
@@ -221,7 +254,9 @@ class ConditionTest(MODLParserListener):
                         last_operator = child.getText()
 
 
-class TopLevelConditionalReturn(MODLParserListener):
+class TopLevelConditionalReturn(ParsedNode):
+    __slots__ = ('structures',)
+
     def __init__(self):
         self.structures = []
 
@@ -233,7 +268,9 @@ class TopLevelConditionalReturn(MODLParserListener):
                 self.structures.append(structure)
 
 
-class TopLevelConditional(MODLParserListener):
+class TopLevelConditional(ParsedNode):
+    __slots__ = ('conditions',)
+
     def __init__(self):
         self.conditions: Dict[ConditionTest,TopLevelConditionalReturn] = None
 
@@ -256,7 +293,9 @@ class TopLevelConditional(MODLParserListener):
             self.conditions[condition_test] = conditional_return
 
 
-class ArrayItem(MODLParserListener):
+class ArrayItem(ParsedNode):
+    __slots__ = ('array_value_item', 'array_conditional')
+
     def __init__(self):
         self.array_value_item: ArrayValueItem = None
         self.array_conditional: ArrayConditional = None
@@ -277,7 +316,9 @@ class ArrayItem(MODLParserListener):
 
 
 # TODO: can we factor out this stuff? common with Value (minus the NbArray)?
-class ArrayValueItem(MODLParserListener):
+class ArrayValueItem(ParsedNode):
+    __slots__ = ('map', 'array', 'pair', 'quoted', 'number', 'is_true', 'is_false', 'is_null', 'string')
+
     def __init__(self):
         self.map = None
         self.array = None
@@ -337,7 +378,9 @@ class ArrayValueItem(MODLParserListener):
         # Ignoring comments
 
 
-class ArrayConditionalReturn(MODLParserListener):
+class ArrayConditionalReturn(ParsedNode):
+    __slots__ = ('array_items',)
+
     def __init__(self):
         self.array_items = []
 
@@ -349,7 +392,9 @@ class ArrayConditionalReturn(MODLParserListener):
                 self.array_items.append(array_item)
 
 
-class ArrayConditional(MODLParserListener):
+class ArrayConditional(ParsedNode):
+    __slots__ = ('conditions',)
+
     def __init__(self):
         self.conditions: Dict[ConditionTest, ArrayConditionalReturn] = {}
 
@@ -385,7 +430,9 @@ def handle_empty_array_item() -> ArrayItem:
     return array_item
 
 
-class NbArray(MODLParserListener):
+class NbArray(ParsedNode):
+    __slots__ = ('array_items',)
+
     def __init__(self):
         self.array_items: List = None
 
@@ -425,7 +472,9 @@ class NbArray(MODLParserListener):
             prev = pt
 
 
-class Array(MODLParserListener):
+class Array(ParsedNode):
+    __slots__ = ('array_items',)
+
     def __init__(self):
         self.array_items: List = None
 
@@ -465,7 +514,9 @@ class Array(MODLParserListener):
             prev = pt
 
 
-class Pair(MODLParserListener):
+class Pair(ParsedNode):
+    __slots__ = ('key', 'map', 'array', 'value_item')
+
     def __init__(self):
         self.key: str = None
         self.map: Map = None
@@ -500,7 +551,9 @@ class Pair(MODLParserListener):
             ctx.modl_value_item().enterRule(self.value_item)
 
 
-class ValueItem(MODLParserListener):
+class ValueItem(ParsedNode):
+    __slots__ = ('value', 'value_conditional')
+
     def __init__(self):
         self.value = None
         self.value_conditional = None
@@ -523,7 +576,9 @@ class ValueItem(MODLParserListener):
             ctx.modl_value_conditional().enterRule(self.value_conditional)
 
 
-class ValueConditionalReturn(MODLParserListener):
+class ValueConditionalReturn(ParsedNode):
+    __slots__ = ('value_items',)
+
     def __init__(self):
         self.value_items = []
 
@@ -538,7 +593,9 @@ class ValueConditionalReturn(MODLParserListener):
                 self.value_items.append(value_item)
 
 
-class ValueConditional(MODLParserListener):
+class ValueConditional(ParsedNode):
+    __slots__ = ('value_conditionals',)
+
     def __init__(self):
         self.value_conditionals = {}
 
@@ -561,7 +618,9 @@ class ValueConditional(MODLParserListener):
             self.value_conditionals[condition_test] = conditional_return
 
 
-class Value(MODLParserListener):
+class Value(ParsedNode):
+    __slots__ = ('map', 'array', 'nb_array', 'pair', 'string', 'number', 'quoted', 'is_true', 'is_false', 'is_null')
+
     def __init__(self):
         super().__init__()
         self.map = None
@@ -632,15 +691,232 @@ class Value(MODLParserListener):
             self.is_null = True
 
 
-def parse(input_stream) -> ModlParsed:
+ANTLR_BACKEND = 'antlr'
+NATIVE_BACKEND = 'native'
+
+# The deepest nesting that parse() accepts by default. Each bracket is a level, and so is each '=' in a chain of
+# pairs such as 'a=b=c'. Both parsers and the interpreter are recursive, so deeper documents are turned away
+# before they're parsed rather than failing part way through with a RecursionError. The costliest shape, a chain
+# of pairs through the ANTLR parser, takes about ten frames a level, so at this depth every shape and backend
+# stays well inside Python's default recursion limit of 1000, leaving room for the caller's own frames.
+# Processing and the JSON printer aren't recursive, so they have no limit of their own.
+DEFAULT_MAX_DEPTH = 64
+
+_OPENING = {MODLLexer.LBRAC, MODLLexer.LSBRAC, MODLLexer.LCBRAC}
+_CLOSING = {MODLLexer.RBRAC, MODLLexer.RSBRAC, MODLLexer.RCBRAC}
+_SEPARATORS = {MODLLexer.SC, MODLLexer.COLON, MODLLexer.NEWLINE, MODLLexer.QMARK, MODLLexer.FSLASH}
+
+
+def check_depth(text: str, types: List[int], offsets: List[int], max_depth: int = DEFAULT_MAX_DEPTH):
+    """
+    Raise a ValueError if the tokens nest more than max_depth levels deep.
+    :param types: the type of each token in text
+    :param offsets: the start offset of each token, for the error message
+    """
+    depth = 0
+    bracket_depths = []  # The depth just inside each open bracket
+    follows_equals = False
+    for index, token_type in enumerate(types):
+        if token_type == MODLLexer.EQUALS:
+            depth += 1
+        elif token_type in _OPENING:
+            depth += 1
+            bracket_depths.append(depth)
+        elif token_type in _CLOSING:
+            if bracket_depths:
+                bracket_depths.pop()
+            depth = bracket_depths[-1] if bracket_depths else 0
+            continue
+        elif token_type in _SEPARATORS:
+            # A pair's value can start on the next line
+            if token_type != MODLLexer.NEWLINE or not follows_equals:
+                depth = bracket_depths[-1] if bracket_depths else 0
+            continue
+        else:
+            follows_equals = False
+            continue
+        follows_equals = token_type == MODLLexer.EQUALS
+        if depth > max_depth:
+            raise ValueError(f'{location(text, offsets[index])} nesting is deeper than the maximum depth of '
+                             f'{max_depth}')
+
+
+def parse(input_stream, backend: str = ANTLR_BACKEND, stats: 'PredictionStats' = None,
+          max_depth: int = DEFAULT_MAX_DEPTH) -> ModlParsed:
+    """
+    Parse MODL text into a ModlParsed tree.
+    :param backend: ANTLR_BACKEND to use the generated ANTLR parser, or NATIVE_BACKEND to use the hand-written
+    recursive-descent parser in native_parser, which builds the same tree
+    :param stats: a PredictionStats to collect ANTLR prediction statistics in
+    :param max_depth: the deepest nesting to accept, see DEFAULT_MAX_DEPTH
+    """
+    start = time.perf_counter() if tracing.subscribers else None
+    if backend == NATIVE_BACKEND:
+        if stats is not None:
+            raise ValueError('Prediction statistics are only collected by the ANTLR backend')
+        import native_parser
+        modl_parsed = native_parser.parse(input_stream, max_depth)
+    else:
+        tree = _antlr_parse(input_stream, backend, stats, max_depth)
+        walker = ParseTreeWalker()
+        listener = ModlObjectListener()
+        walker.walk(listener, tree)
+        modl_parsed = listener.modl_object()
+    if start is not None:
+        tracing.emit('parse', {'backend': backend, 'structures': len(modl_parsed.structures),
+                               'seconds': time.perf_counter() - start})
+    return modl_parsed
+
+
+def iter_parse(input_stream, backend: str = ANTLR_BACKEND, max_depth: int = DEFAULT_MAX_DEPTH) -> Iterator[Structure]:
+    """
+    Parse MODL text, yielding each top-level Structure in turn instead of collecting them into a ModlParsed.
+    The native backend parses incrementally, so a syntax error is only raised when it's reached, but it still
+    tokenises the whole text first, so its token lists grow with the document. The ANTLR backend has to build
+    its whole parse tree first, but still converts it one structure at a time.
+    """
+    start = time.perf_counter() if tracing.subscribers else None
+    if backend == NATIVE_BACKEND:
+        import native_parser
+        structures = native_parser.iter_parse(input_stream, max_depth)
+    else:
+        tree = _antlr_parse(input_stream, backend, max_depth=max_depth)
+        structures = (_structure(struct) for struct in tree.modl_structure())
+    if start is not None:
+        return _traced(structures, backend, time.perf_counter() - start)
+    return structures
+
+
+def _traced(structures: Iterator[Structure], backend: str, seconds: float) -> Iterator[Structure]:
+    """Emit the parse event for iter_parse once all the structures have been parsed, only counting the time
+    spent parsing rather than the time spent by the caller between structures."""
+    count = 0
+    while True:
+        start = time.perf_counter()
+        structure = next(structures, None)
+        seconds += time.perf_counter() - start
+        if structure is None:
+            break
+        count += 1
+        yield structure
+    tracing.emit('parse', {'backend': backend, 'structures': count, 'seconds': seconds})
+
+
+def read_file(location: str) -> str:
+    """
+    Read a UTF-8 MODL file, dropping any byte order mark. The file is memory-mapped and decoded straight from
+    the mapping, so the only copy of its contents is the str handed to the lexer.
+    """
+    with open(location, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''  # An empty file can't be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return str(mapped, 'utf-8-sig')
+
+
+def parse_file(location: str, backend: str = ANTLR_BACKEND, max_depth: int = DEFAULT_MAX_DEPTH) -> ModlParsed:
+    """Parse a MODL file into a ModlParsed tree, see read_file() and parse()."""
+    return parse(read_file(location), backend, max_depth=max_depth)
+
+
+def _antlr_parse(input_stream, backend: str, stats: 'PredictionStats' = None,
+                 max_depth: int = DEFAULT_MAX_DEPTH) -> MODLParser.ModlContext:
+    if backend != ANTLR_BACKEND:
+        raise ValueError(f'Unknown parser backend: {backend}')
+
     # Wrap the input in an InputStream if it's just a string
     if type(input_stream) == str:
         input_stream = InputStream(input_stream)
-    lexer = MODLLexer(input_stream)
+    lexer = ModlLexer(input_stream)
     stream = CommonTokenStream(lexer)
+    stream.fill()
+    tokens = stream.tokens
+    check_depth(str(input_stream), [token.type for token in tokens], [token.start for token in tokens], max_depth)
     parser = MODLParser(stream)
-    tree = parser.modl()
-    walker = ParseTreeWalker()
-    listener = ModlObjectListener()
-    walker.walk(listener, tree)
-    return listener.modl_object()
+    if stats is not None:
+        stats.attach(parser)
+    return two_stage_parse(parser, stats)
+
+
+class _SllErrorStrategy(BailErrorStrategy):
+    """Give up on the first syntax error without reporting it, since it will be reported by the LL pass"""
+
+    def reportError(self, recognizer, e):
+        pass
+
+
+def two_stage_parse(parser: MODLParser, stats: 'PredictionStats' = None) -> MODLParser.ModlContext:
+    """
+    Run the modl rule with SLL prediction, and only if that fails start again with full LL prediction and the
+    default error recovery. SLL prediction is much cheaper, and either produces the same tree as LL prediction
+    or fails with a syntax error - which might be a real one, or might need full context to get past.
+    """
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = _SllErrorStrategy()
+    try:
+        return parser.modl()
+    except ParseCancellationException:
+        if stats is not None:
+            stats.ll_fallbacks += 1
+        parser._interp.predictionMode = PredictionMode.LL
+        parser._errHandler = DefaultErrorStrategy()
+        parser.reset()
+        return parser.modl()
+
+
+class PredictionStats(ErrorListener):
+    """
+    Counts the adaptive predictions made by the ANTLR parser for each grammar rule, and the time spent on them,
+    along with the ambiguities and full-context predictions that ANTLR reports. Pass one to parse() to collect
+    statistics for a document, or reuse it to add up a whole corpus.
+    """
+
+    def __init__(self):
+        self.decisions = Counter()  # rule name -> number of adaptive predictions
+        self.seconds = Counter()  # rule name -> time spent in adaptive prediction
+        self.full_context = Counter()  # rule name -> SLL conflicts that needed full-context prediction
+        self.context_sensitivities = Counter()  # rule name -> full-context predictions that differed from SLL
+        self.ambiguities = Counter()  # rule name -> ambiguities resolved by picking the lowest alternative
+        self.ll_fallbacks = 0  # documents that had to be parsed again with full LL prediction
+        self.syntax_errors = 0
+
+    def attach(self, parser: MODLParser):
+        """Start counting the predictions made by the parser."""
+        parser.addErrorListener(self)
+        rule_names = [parser.ruleNames[state.ruleIndex] for state in parser.atn.decisionToState]
+        predict = parser._interp.adaptivePredict
+
+        def adaptive_predict(input, decision, outer_context):
+            start = time.perf_counter()
+            try:
+                return predict(input, decision, outer_context)
+            finally:
+                rule = rule_names[decision]
+                self.seconds[rule] += time.perf_counter() - start
+                self.decisions[rule] += 1
+
+        parser._interp.adaptivePredict = adaptive_predict
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        self.syntax_errors += 1
+
+    @staticmethod
+    def _rule(recognizer, dfa) -> str:
+        return recognizer.ruleNames[dfa.atnStartState.ruleIndex]
+
+    def reportAmbiguity(self, recognizer, dfa, startIndex, stopIndex, exact, ambigAlts, configs):
+        self.ambiguities[self._rule(recognizer, dfa)] += 1
+
+    def reportAttemptingFullContext(self, recognizer, dfa, startIndex, stopIndex, conflictingAlts, configs):
+        self.full_context[self._rule(recognizer, dfa)] += 1
+
+    def reportContextSensitivity(self, recognizer, dfa, startIndex, stopIndex, prediction, configs):
+        self.context_sensitivities[self._rule(recognizer, dfa)] += 1
+
+    def summary(self) -> List[Tuple[str, int, float, int, int, int]]:
+        """:return: (rule, decisions, seconds, full_context, context_sensitivities, ambiguities) for each rule,
+        slowest first"""
+        rules = set(self.decisions) | set(self.full_context) | set(self.ambiguities)
+        rows = [(rule, self.decisions[rule], self.seconds[rule], self.full_context[rule],
+                 self.context_sensitivities[rule], self.ambiguities[rule]) for rule in rules]
+        return sorted(rows, key=lambda row: (-row[2], row[0]))
@@ -1,5 +1,9 @@
 import json
-from modl_creator import Structure, Map, ModlValue, Pair, Array, ModlObject
+from json.encoder import encode_basestring_ascii
+from typing import Callable, Iterable, Iterator
+
+from modl_creator import Structure, Map, ModlValue, Pair, Array, ModlObject, String, Number, TrueVal, FalseVal, \
+    NullVal
 
 
 class MODLJSONEncoder(json.JSONEncoder):
@@ -37,4 +41,152 @@ def to_json(modl: ModlObject) -> str:
         data = structures[0]
     else:
         data = structures
-    return json.dumps(data, cls=MODLJSONEncoder)
+    return encode(data, MODLJSONEncoder().default)
+
+
+_END = object()
+
+_INFINITY = float('inf')
+
+
+def _float(number: float) -> str:
+    if number != number:
+        return 'NaN'
+    if number == _INFINITY:
+        return 'Infinity'
+    if number == -_INFINITY:
+        return '-Infinity'
+    return float.__repr__(number)
+
+
+def _key(key) -> str:
+    """A dict key as a JSON string, the same as json.dumps()"""
+    if isinstance(key, str):
+        return encode_basestring_ascii(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, int):
+        return '"' + int.__repr__(key) + '"'
+    if isinstance(key, float):
+        return '"' + _float(key) + '"'
+    raise TypeError(f'keys must be str, int, float, bool or None, not {type(key).__name__}')
+
+
+def encode(o, default: Callable) -> str:
+    """
+    The same as json.dumps(o, default=default), but the containers being written out are kept on an explicit
+    stack rather than by recursion, so there's no limit on how deeply nested o can be. MODL terminals are written
+    out straight away, without calling default.
+    """
+    chunks = []
+    append = chunks.append
+    stack = []  # [items iterator, whether it's a dict, whether no items have been written yet, markers]
+    markers = {}  # The id of each object being written out, to catch circular references like json.dumps() does
+    value = o
+    while True:
+        encoded = None  # The objects passed to default() to get to value
+        while True:
+            value_type = type(value)
+            if value_type is String:
+                value = value.string
+                continue
+            if value_type is Number:
+                value = value.number
+                continue
+            if value is None or value_type is NullVal:
+                append('null')
+            elif value is True or value_type is TrueVal:
+                append('true')
+            elif value is False or value_type is FalseVal:
+                append('false')
+            elif isinstance(value, str):
+                append(encode_basestring_ascii(value))
+            elif isinstance(value, int):
+                append(int.__repr__(value))
+            elif isinstance(value, float):
+                append(_float(value))
+            elif isinstance(value, (list, tuple, dict)):
+                marker = id(value)
+                if marker in markers:
+                    raise ValueError('Circular reference detected')
+                markers[marker] = value
+                if encoded is None:
+                    encoded = [marker]
+                else:
+                    encoded.append(marker)
+                if isinstance(value, dict):
+                    append('{')
+                    stack.append([iter(value.items()), True, True, encoded])
+                else:
+                    append('[')
+                    stack.append([iter(value), False, True, encoded])
+                encoded = None
+            else:
+                marker = id(value)
+                if marker in markers:
+                    raise ValueError('Circular reference detected')
+                markers[marker] = value
+                if encoded is None:
+                    encoded = [marker]
+                else:
+                    encoded.append(marker)
+                value = default(value)
+                continue
+            break
+        if encoded is not None:
+            for marker in encoded:
+                del markers[marker]
+
+        # Move on to the next item of the innermost container that still has some
+        while stack:
+            frame = stack[-1]
+            item = next(frame[0], _END)
+            if item is _END:
+                append('}' if frame[1] else ']')
+                for marker in frame[3]:
+                    del markers[marker]
+                stack.pop()
+                continue
+            if frame[2]:
+                frame[2] = False
+            else:
+                append(', ')
+            if frame[1]:
+                key, value = item
+                append(_key(key))
+                append(': ')
+            else:
+                value = item
+            break
+        else:
+            return ''.join(chunks)
+
+
+def iter_to_json(structures: Iterable[Structure]) -> Iterator[str]:
+    """
+    Incremental version of to_json for a stream of interpreted structures, yielding JSON text in chunks
+    which join up to the same output. Only one structure is held at a time.
+    """
+    default = MODLJSONEncoder().default
+    iterator = iter(structures)
+    first = next(iterator, _END)
+    if first is _END:
+        yield '[]'
+        return
+    structure = next(iterator, _END)
+    if structure is _END:
+        yield encode(first, default)
+        return
+    # More than one structure, so they're written out as a list
+    yield '['
+    yield encode(first, default)
+    del first
+    while structure is not _END:
+        yield ', '
+        yield encode(structure, default)
+        structure = next(iterator, _END)
+    yield ']'
@@ -1,7 +1,9 @@
-from typing import Union, List, Dict
+import re
+from functools import lru_cache
+from typing import Union, List, Dict, Tuple
 
-from modl_creator import TrueVal, ModlObject, ModlValue, FalseVal, String, Number, Pair
-from string_utils import EscapeStrings
+from modl_creator import TRUE_VAL, ModlObject, ModlValue, FALSE_VAL, String, Number, Pair
+from string_utils import unescape
 from variable_methods import is_variable_method, transform
 
 
@@ -56,33 +58,297 @@ def get_end_of_number(str_to_transform, start_index):
                     return curr_index - 1  # cope with "."
 
 
+# The characters that scan_references() stops at, and the ones that end a reference to a named object
+_SPECIAL_CHARACTERS = re.compile('[`%]')
+_NAME_END = re.compile('[ :]')
+
+
+class References:
+    """
+    Where the parts of a string enclosed in graves, the object references and the escaped graves are, as found by
+    scan_references(). Each part is a (start, end) slice of the string, including its graves or its %.
+    """
+    __slots__ = ('graved', 'percent', 'escapes')
+
+    def __init__(self, graved: List[tuple], percent: List[tuple], escapes: List[int]):
+        self.graved = graved
+        self.percent = percent  # (start, end, where the method chain of a numbered reference starts, or None)
+        self.escapes = escapes  # Where each ~ or \ that stops a grave from opening or closing a part is
+
+
+def scan_references(text: str) -> References:
+    """
+    Find the graved parts and the object references in a string in one pass, without backtracking.
+
+    A grave opens or closes a part unless it's prefixed with ~ or \\. An object reference starts at a %, and runs
+    to the next space or colon, or if it starts with a digit, to the end of the number and any variable methods
+    after it. A % inside a reference, or straight after one, doesn't start another. Nor does a % followed by a
+    space or a colon, or at the end of the string.
+    """
+    graved = []
+    percent = []
+    escapes = []
+    length = len(text)
+    grave_start = None
+    percent_start = 0  # A % before here is part of the previous reference
+    for match in _SPECIAL_CHARACTERS.finditer(text):
+        index = match.start()
+        if text[index] == '`':
+            if index > 0 and text[index - 1] in '~\\':
+                escapes.append(index - 1)
+            elif grave_start is None:
+                grave_start = index
+            else:
+                graved.append((grave_start, index + 1))
+                grave_start = None
+        elif percent_start <= index < length - 1:
+            method_start = None
+            if is_digit(text[index + 1]):
+                end = get_end_of_number(text, index + 1)
+                dot = text.find('.', index + 2, end)
+                if dot != -1:
+                    method_start = dot
+            else:
+                name_end = _NAME_END.search(text, index + 1)
+                end = length if name_end is None else name_end.start()
+            if end > index + 1:
+                percent.append((index, end, method_start))
+                percent_start = end + 1  # The character that ended the reference is skipped too
+    return References(graved, percent, escapes)
+
+
+_MISSING = object()
+
+# What compile_template() gives for strings that would be returned unchanged, and for strings that only the
+# general transform() can handle
+PLAIN = 'plain'
+GENERAL = 'general'
+
+
+class Template:
+    """
+    A string with object references in it, split into the literal text and the references between it, so that
+    it can be rendered with a single join rather than by finding and replacing each reference in turn.
+    """
+    __slots__ = ('text', 'literals', 'references')
+
+    def __init__(self, text: str, literals: Tuple[str, ...], references: Tuple[tuple, ...]):
+        self.text = text
+        self.literals = literals  # One more than there are references
+        self.references = references  # (the whole reference, its subject, its method chain or None)
+
+
+class SymbolTable:
+    """
+    Everything that an object reference can refer to: the numbered variables, the named variables and the value
+    pairs. Each of them is indexed, along with the _ prefixed names of the value pairs, so that a reference is found
+    in constant time however many variables there are.
+
+    A table can be an overlay on a parent table, such as the one in an InterpreterContext. Anything set in the
+    overlay hides the parent's, which is never modified.
+    """
+    __slots__ = ('_parent', '_numbered_variables', '_variables', '_value_pairs', '_names', '_read_only')
+
+    def __init__(self, parent: 'SymbolTable' = None):
+        self._parent = parent
+        self._numbered_variables: List[ModlValue] = []
+        self._variables: Dict[str, ModlValue] = {}
+        self._value_pairs: Dict[str, ModlValue] = {}
+        # Each name a value pair can be referred to by, with or without a _ prefix, and the key of the first value
+        # pair that it refers to
+        self._names: Dict[str, str] = {}
+        self._read_only = False
+
+    @classmethod
+    def of(cls,
+           value_pairs: Dict[String, ModlValue],
+           variables: Dict[String, ModlValue],
+           numbered_variables: Dict[int, ModlValue]) -> 'SymbolTable':
+        """A table holding the contents of the dicts"""
+        table = cls()
+        for index in range(len(numbered_variables)):
+            table.add_numbered_variable(numbered_variables[index])
+        for key, value in variables.items():
+            table.set_variable(key, value)
+        for key, value in value_pairs.items():
+            table.set_value_pair(key, value)
+        return table
+
+    def read_only_copy(self) -> 'SymbolTable':
+        """A copy of everything in the table, and its parent, that can't be modified"""
+        table = SymbolTable()
+        parent = self._parent
+        if parent is not None:
+            table._numbered_variables = parent._numbered_variables + self._numbered_variables
+            table._variables = {**parent._variables, **self._variables}
+            table._value_pairs = {**parent._value_pairs, **self._value_pairs}
+            table._names = {**self._names, **parent._names}
+        else:
+            table._numbered_variables = list(self._numbered_variables)
+            table._variables = dict(self._variables)
+            table._value_pairs = dict(self._value_pairs)
+            table._names = dict(self._names)
+        table._read_only = True
+        return table
+
+    def _check_writable(self):
+        if self._read_only:
+            raise TypeError('SymbolTable is read-only')
+
+    def add_numbered_variable(self, value: ModlValue) -> int:
+        """Add the next numbered variable, returning its number"""
+        self._check_writable()
+        self._numbered_variables.append(value)
+        return self.numbered_variable_count() - 1
+
+    def numbered_variable_count(self) -> int:
+        if self._parent is None:
+            return len(self._numbered_variables)
+        return len(self._parent._numbered_variables) + len(self._numbered_variables)
+
+    def set_variable(self, key: str, value: ModlValue):
+        self._check_writable()
+        self._variables[key] = value
+
+    def set_value_pair(self, key: str, value: ModlValue):
+        self._check_writable()
+        key = str(key)
+        if key not in self._value_pairs and (self._parent is None or key not in self._parent._value_pairs):
+            self._names.setdefault(key, key)
+            self._names.setdefault('_' + key, key)
+        self._value_pairs[key] = value
+
+    def value_pair(self, key: str) -> Union[ModlValue, None]:
+        """The value of the value pair with exactly this key"""
+        value = self._value_pairs.get(key, _MISSING)
+        if value is _MISSING:
+            value = None if self._parent is None else self._parent._value_pairs.get(key)
+        return value
+
+    def clear_value_pairs(self):
+        """Forget the value pairs set in this table, but not those in its parent"""
+        self._check_writable()
+        self._value_pairs = {}
+        self._names = {}
+
+    def lookup(self, subject: str) -> Union[ModlValue, None]:
+        """
+        The value that the subject of an object reference refers to: the numbered variable with that number, or
+        else the named variable with that name, or else the first value pair with that key, with or without a _
+        prefix. None if there isn't one.
+        """
+        parent = self._parent
+        # Only the canonical form of a number, such as '1' but not '01', refers to a numbered variable
+        if subject.isdigit() and subject.isascii() and (subject[0] != '0' or subject == '0'):
+            index = int(subject)
+            if parent is not None:
+                if index < len(parent._numbered_variables):
+                    return parent._numbered_variables[index]
+                index -= len(parent._numbered_variables)
+            if index < len(self._numbered_variables):
+                return self._numbered_variables[index]
+
+        value = self._variables.get(subject, _MISSING)
+        if value is _MISSING and parent is not None:
+            value = parent._variables.get(subject, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        # The parent's value pairs came first
+        key = None if parent is None else parent._names.get(subject)
+        if key is None:
+            key = self._names.get(subject)
+            if key is None:
+                return None
+        return self.value_pair(key)
+
+
+def compile_template(text: str):
+    """
+    Work out once how transform() would transform a string that has already been unescaped: TRUE_VAL or
+    FALSE_VAL, PLAIN if it would be left alone, a Template, or GENERAL if it's one of the strings that only
+    transform() itself can handle.
+
+    transform() replaces every occurrence of each reference in turn, so a Template is only used where that
+    can't replace anything but the references themselves: there are no graves, every % starts a reference,
+    and no reference is the start of a different one.
+
+    Strings with references are analysed once for each text, and the result kept in a table rather than on the
+    String, so Strings stay immutable and can be shared between cached trees and threads.
+    """
+    lower = text.lower()
+    if lower == 'true':
+        return TRUE_VAL
+    if lower == 'false':
+        return FALSE_VAL
+    if '`' in text:
+        return GENERAL
+    if '%' not in text:
+        return PLAIN
+    return _compile_references(text)
+
+
+@lru_cache(maxsize=4096)
+def _compile_references(text: str):
+    found = scan_references(text).percent
+    if len(found) != text.count('%'):
+        return GENERAL
+    distinct = sorted(set(text[start:end] for start, end, _ in found))
+    for part, next_part in zip(distinct, distinct[1:]):
+        if next_part.startswith(part):
+            return GENERAL
+
+    literals = []
+    references = []
+    end = 0
+    for start, part_end, _ in found:
+        literals.append(text[end:start])
+        part = text[start:part_end]
+        end = part_end
+        index_of_dot = part.find('.')
+        if index_of_dot > 0:
+            references.append((part, part[1:index_of_dot], part[index_of_dot + 1:] or None))
+        else:
+            references.append((part, part[1:], None))
+    literals.append(text[end:])
+    return Template(text, tuple(literals), tuple(references))
+
+
 class StringTransformer:
     def __init__(self,
-                 value_pairs: Dict[String, ModlValue],
-                 variables: Dict[String, ModlValue],
-                 numbered_variables: Dict[int, ModlValue]):
-        self.value_pairs = value_pairs
-        self.variables: dict = variables
-        self.numbered_variables = numbered_variables
-
-    def transform(self, input: str) -> Union[None,ModlValue]:
+                 value_pairs: Dict[String, ModlValue] = None,
+                 variables: Dict[String, ModlValue] = None,
+                 numbered_variables: Dict[int, ModlValue] = None,
+                 symbols: SymbolTable = None):
+        """
+        :param symbols: the table that object references are looked up in. If it isn't given, one is made from the
+        value pairs, variables and numbered variables. A transformer can be used any number of times, and sees
+        any changes to its table.
+        """
+        if symbols is None:
+            symbols = SymbolTable.of(value_pairs or {}, variables or {}, numbered_variables or {})
+        self.symbols = symbols
+
+    def transform(self, input: str, unescaped: bool = False) -> Union[None,ModlValue]:
+        """
+        :param unescaped: input has already been unescaped, e.g. because it's from a String, so mustn't be again
+        """
         if input is None:
             return None
 
         if input.lower() == 'true':
-            return TrueVal()
+            return TRUE_VAL
         if input.lower() == 'false':
-            return FalseVal()
+            return FALSE_VAL
 
-        # 5: Replace the strings as per the txt document attached "string-replacement.txt"
-        input = EscapeStrings().unescape(input)
-
-        # Replace any unicode encodings
-        # TODO
+        # 5: Replace the strings as per the txt document attached "string-replacement.txt", and any unicode encodings
+        if not unescaped:
+            input = unescape(input)
 
         # Implement Elliott's algorithm for string transformation :
         # 1 : Find all parts of the sting that are enclosed in graves, e.g `test` where neither of the graves is prefixed with an escape character ~ (tilde) or \ (backslash).
-        grave_parts: List[str] = self.grave_parts_from_string(input)
+        references = scan_references(input)
+        grave_parts: List[str] = [input[start:end] for start, end in references.graved]
 
         # [ 2: If no parts are found, run “Object Referencing detection” ] - basically go to 4:
         # 3 : If parts are found loop through them in turn:
@@ -109,7 +375,9 @@ class StringTransformer:
                 input = input.replace(grave_part, new_grave_part)
 
         # 4: Find all non-space parts of the string that are prefixed with % (percent sign). These are object references – run “Object Referencing”
-        percent_parts = self.get_percent_parts_from_string(input)
+        if grave_parts:
+            references = scan_references(input)
+        percent_parts = [input[start:end] for start, end, _ in references.percent]
 
         for pct_part in percent_parts:
             ret = self.run_object_referencing(pct_part, input, False)
@@ -123,7 +391,45 @@ class StringTransformer:
             else:
                 return ret
 
-        return String(input)
+        return String.unescaped(input)
+
+    def transform_string(self, string: String) -> Union[None, ModlValue]:
+        """
+        The same as transform(str(string), unescaped=True), but the string is analysed by compile_template(),
+        which only does it once for each text. Strings without any object references come back as they are.
+        """
+        template = compile_template(string.string)
+
+        if template is PLAIN:
+            return string
+        if template is GENERAL:
+            return self.transform(string.string, unescaped=True)
+        if not isinstance(template, Template):
+            return template  # TRUE_VAL or FALSE_VAL
+
+        literals = template.literals
+        pieces = [literals[0]]
+        index = 1
+        for part, subject, method_chain in template.references:
+            value = self.get_value_for_reference(subject)
+            if value is None:
+                piece = part  # Left as it is
+            else:
+                if isinstance(value, String):
+                    piece = self.apply_method_chain(str(value), method_chain) if method_chain else str(value)
+                elif isinstance(value, Number):
+                    if part == template.text:
+                        return value
+                    piece = str(value.get_value())
+                else:
+                    return value
+                if '%' in piece:
+                    # The references after this one might be found in it, as they would be by transform()
+                    return self.transform(string.string, unescaped=True)
+            pieces.append(piece)
+            pieces.append(literals[index])
+            index += 1
+        return String.unescaped(''.join(pieces))
 
     def run_object_referencing(self, percent_part: str, string_to_transform: str, is_graved: bool):
         """
@@ -154,55 +460,52 @@ class StringTransformer:
         subject = percent_part[start_offset:len(percent_part)-end_offset]
 
         method_chain:str = None
-        try:
-            index_of_dot = percent_part.index('.')
-        except ValueError:
-            index_of_dot = None  # not found
-
-        if index_of_dot:
+        index_of_dot = percent_part.find('.')
+        if index_of_dot > 0:
             subject = percent_part[start_offset:index_of_dot]
             method_chain = percent_part[index_of_dot + 1:len(percent_part) - end_offset]
 
         value: ModlValue = self.get_value_for_reference(subject)
 
         if value is None:
-            return String(string_to_transform)
+            return String.unescaped(string_to_transform)
         elif isinstance(value, String):
             subject = str(value)
         else:
             return value
 
         if method_chain:
-            methods = method_chain.split(".")
-            if not methods:
-                methods = [method_chain]
-            for method in methods:
-                if '(' in method:
-                    # HANDLE TRIM AND REPLACE HERE!!
-                    # We need to strip the "(<params>)" and apply the method to the subject AND the params!
-                    # TODO (we might need to check for escaped "."s one day...
-                    start_params_index = method.index('(')
-                    params_str = method[start_params_index + 1 : len(method) - 1]
-                    method_str = method[:start_params_index]
-                    subject = transform(method_str, f"{subject},{params_str}")
-                else:
-                    if not is_variable_method(method):
-                        # Nothing to do - leave it alone!
-                        subject = f"{subject}.{method}"
-                    else:
-                        subject = transform(method, subject)
+            subject = self.apply_method_chain(subject, method_chain)
 
         string_to_transform = string_to_transform.replace(percent_part, subject)
-        return String(string_to_transform)
+        return String.unescaped(string_to_transform)
+
+    def apply_method_chain(self, subject: str, method_chain: str) -> str:
+        """Pass the subject through each of the methods in a chain such as t(ing).u in turn"""
+        methods = method_chain.split(".")
+        if not methods:
+            methods = [method_chain]
+        for method in methods:
+            if '(' in method:
+                # HANDLE TRIM AND REPLACE HERE!!
+                # We need to strip the "(<params>)" and apply the method to the subject AND the params!
+                # TODO (we might need to check for escaped "."s one day...
+                start_params_index = method.index('(')
+                params_str = method[start_params_index + 1 : len(method) - 1]
+                method_str = method[:start_params_index]
+                subject = transform(method_str, f"{subject},{params_str}")
+            else:
+                if not is_variable_method(method):
+                    # Nothing to do - leave it alone!
+                    subject = f"{subject}.{method}"
+                else:
+                    subject = transform(method, subject)
+        return subject
 
     def get_value_for_reference(self, subject) -> ModlValue:
         # Subject might be a nested object reference, so handle it here
-        try:
-            gt_index = subject.index('>')
-        except ValueError:
-            gt_index = None
-
-        is_nested = gt_index is not None
+        gt_index = subject.find('>')
+        is_nested = gt_index != -1
 
         if is_nested:
             remainder = subject[gt_index+1:]
@@ -211,35 +514,7 @@ class StringTransformer:
             remainder = None
 
         # Find the first level object reference, whether nested or not
-
-        value: ModlValue = None
-        found = False
-
-        # Make any variable replacements, etc.
-
-        for i in range(0, len(self.numbered_variables)):
-            if subject == str(i):
-                if isinstance(self.numbered_variables[i], String):
-                    value = self.numbered_variables[i]
-                else:
-                    # Why the dupe?
-                    value = self.numbered_variables[i]
-                found = True
-                break
-
-        if not found:
-            for var_key, var_value in self.variables.items():
-                if subject == var_key:
-                    value = var_value
-                    found = True
-                    break
-
-        if not found:
-            for var_key, var_value in self.value_pairs.items():
-                if subject == var_key or subject == '_'+str(var_key):
-                    value = var_value
-                    found = True
-                    break
+        value: ModlValue = self.symbols.lookup(subject)
 
         # If we have a nested reference follow it recursively until we find the value we need.
         if value and is_nested:
@@ -247,96 +522,18 @@ class StringTransformer:
 
         return value
 
-    def grave_parts_from_string(self, input):
+    def grave_parts_from_string(self, input) -> List[str]:
         """
         Find all parts of the sting that are enclosed in graves, e.g `test` where neither of the graves is
         prefixed with an escape character ~ (tilde) or \ (backslash).
         :param input:
         :return:
         """
-        grave_parts = []
-
-        curr_index = 0
-        finished = False
-        while not finished:
-            finished = True
-            start_index = self.get_next_non_prefixed_grave(input, curr_index)
-            if start_index is not None:
-                end_index = self.get_next_non_prefixed_grave(input, start_index+1)
-                if end_index is not None:
-                    grave_part = input[start_index:end_index+1]
-                    grave_parts.append(grave_part)
-                    curr_index = end_index + 1
-                    finished = False
-        return grave_parts
-
-    def get_next_non_prefixed_grave(self, input, start_index):
-        # From start_index, find the next grave. If it is prefixed by either ~ or \ then ignore it and find the next one
-        try:
-            index = input.index('`', start_index)
-        except ValueError:
-            index = None
-
-        if index is None:
-            return None
-
-        if index > start_index:
-            prefix = input[index-1]
-            if prefix == '~' or prefix == '\\':
-                return self.get_next_non_prefixed_grave(input, index+1)
-            else:
-                return index
-        else:
-            return start_index
+        return [input[start:end] for start, end in scan_references(input).graved]
 
-    def get_percent_parts_from_string(self, input) -> List:
+    def get_percent_parts_from_string(self, input) -> List[str]:
         # Find all non-space parts of the string that are prefixed with % (percent sign).
-        percent_parts = []
-        curr_index = 0
-        finished = False
-        while not finished:
-            finished = True
-            start_index = self.get_next_percent(input, curr_index)
-            if start_index is not None:
-                end_index = None
-                # If the first character after the % is a number, then keep reading until we get to a non-number (taking account of method chains)
-                # If the first character after the % is a letter, then keep reading until we get to a space
-                if start_index < len(input)-1 and (not is_digit(input[start_index + 1:start_index + 2])):
-                    # Just read to the next space
-                    try:
-                        space_end_index = input.index(" ", start_index)
-                    except ValueError:
-                        space_end_index = 99999
-
-                    try:
-                        colon_end_index = input.index(":", start_index)
-                    except ValueError:
-                        colon_end_index = 99999
-
-                    end_index = min(space_end_index, colon_end_index)
-
-                    if end_index > len(input):
-                        end_index = len(input)
-                elif start_index == len(input) - 1:
-                    return percent_parts
-                else:
-                    end_index = get_end_of_number(input, start_index+1)
-
-                if end_index is not None:
-                    if end_index > start_index + 1:
-                        grave_part = input[start_index:end_index]
-                        percent_parts.append(grave_part)
-                        curr_index = end_index + 1
-                    finished = False
-        return percent_parts
-
-
-    def get_next_percent(self, input, start_index):
-        # From startIndex, find the next grave. If it is prefixed by either ~ or \ then ignore it and find the next one
-        try:
-            return input.index('%', start_index)
-        except ValueError:
-            return None
+        return [input[start:end] for start, end, _ in scan_references(input).percent]
 
     def get_value_for_reference_recursive(self, ctx: ModlValue, key: str) -> ModlValue:
         """
@@ -350,12 +547,8 @@ class StringTransformer:
         """
 
         # Check for nested keys
-        try:
-            gt_index = key.index('>')
-        except ValueError:
-            gt_index = None
-
-        is_nested = gt_index is not None
+        gt_index = key.find('>')
+        is_nested = gt_index != -1
 
         remainder: str = None
         curr_key: str = None
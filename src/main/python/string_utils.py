@@ -1,3 +1,6 @@
+import re
+
+
 class EscapeStrings:
     replacements = {
         "~\\": "\\",
@@ -35,7 +38,7 @@ class EscapeStrings:
         "~/": "/",
         "\\/": "/",
 
-        "<": "<",
+        "~<": "<",
         "\\<": "<",
         "~>": ">",
         "\\>": ">",
@@ -43,7 +46,7 @@ class EscapeStrings:
         "~&": "&",
         "\\&": "&",
 
-        "!": "!",
+        "~!": "!",
         "\\!": "!",
         "~|": "|",
         "\\|": "|",
@@ -55,7 +58,30 @@ class EscapeStrings:
         "\\r": "\r"}
 
     def unescape(self, text: str) -> str:
-        for to_find,replace_with in self.replacements.items():
-            text = text.replace(to_find, replace_with)
-        return text
+        return unescape(text)
+
+
+# A surrogate pair is decoded to the one character it encodes, like in JSON
+_ESCAPE = re.compile(r'\\u([dD][89abAB][0-9a-fA-F]{2})\\u([dD][c-fC-F][0-9a-fA-F]{2})|\\u([0-9a-fA-F]{4})|' +
+                     '|'.join(re.escape(escape) for escape in EscapeStrings.replacements))
 
+
+def _replace(match) -> str:
+    replacement = EscapeStrings.replacements.get(match.group())
+    if replacement is not None:
+        return replacement
+    high, low, code = match.groups()
+    if high is not None:
+        return chr(0x10000 + ((int(high, 16) - 0xd800) << 10) + int(low, 16) - 0xdc00)
+    return chr(int(code, 16))
+
+
+def unescape(text: str) -> str:
+    """
+    Replace the escape sequences in text in a single pass from left to right, so that the result of one escape is
+    never read as part of another: `\\\\(` is `\\(`, not `(`. As well as the sequences in EscapeStrings.replacements,
+    `\\uXXXX` is the character with that hex code.
+    """
+    if '\\' not in text and '~' not in text:
+        return text
+    return _ESCAPE.sub(_replace, text)
@@ -0,0 +1,54 @@
+"""
+Tracing hooks for the parse, process and interpret stages.
+
+Subscribers are callables taking an event name and a dict of details. Call sites check
+`if tracing.subscribers:` before building an event, so tracing costs nothing when no one is listening.
+
+Events:
+    parse               {'backend', 'structures', 'seconds'} once a whole input has been parsed
+    process.item        {'type'} for each parsed node that modl_creator processes (the native backend builds
+                        its raw objects directly, so only imports are processed this way)
+    interpret.structure {'structure'} for each raw top-level structure before it is interpreted
+    interpret.load_file {'location'} when an imported file is loaded
+
+For example, to send every event to the 'modl' logger:
+
+    tracing.subscribe(tracing.log_event)
+"""
+import logging
+from contextlib import contextmanager
+from typing import Callable, List
+
+Subscriber = Callable[[str, dict], None]
+
+subscribers: List[Subscriber] = []
+
+logger = logging.getLogger('modl')
+
+
+def subscribe(subscriber: Subscriber):
+    subscribers.append(subscriber)
+
+
+def unsubscribe(subscriber: Subscriber):
+    subscribers.remove(subscriber)
+
+
+@contextmanager
+def subscribed(subscriber: Subscriber):
+    """Subscribe for the duration of a with block."""
+    subscribe(subscriber)
+    try:
+        yield subscriber
+    finally:
+        unsubscribe(subscriber)
+
+
+def emit(event: str, details: dict):
+    for subscriber in list(subscribers):
+        subscriber(event, details)
+
+
+def log_event(event: str, details: dict):
+    """A subscriber which logs each event at DEBUG level."""
+    logger.debug('%s %s', event, details)
@@ -0,0 +1,123 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+
+import parser
+from import_cache import ImportCache
+from interpreter import ModlInterpreter
+from modl_creator import build_raw_modl
+
+
+class SlowImportCache(ImportCache):
+    """Counts its loads, and takes long enough over each one for other threads to ask for the same file"""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.loads = 0
+
+    def _load(self, location, backend):
+        self.loads += 1
+        time.sleep(0.1)
+        return super()._load(location, backend)
+
+
+class ImportCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _write(self, name, content):
+        location = os.path.join(self.directory.name, name + '.modl')
+        with open(location, 'w') as f:
+            f.write(content)
+        return location
+
+    def test_hits_and_misses(self):
+        location = self._write('config', '_colour=red')
+        cache = ImportCache()
+        raw = cache.load(location)
+        self.assertIs(raw, cache.load(location))
+        self.assertIs(raw, cache.load(os.path.join(self.directory.name, '.', 'config.modl')))
+        self.assertIsNot(raw, cache.load(location, parser.NATIVE_BACKEND))
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+        self.assertEqual(2, len(cache))
+
+    def test_revalidation(self):
+        location = self._write('config', '_colour=red')
+        cache = ImportCache(revalidate_seconds=3600)
+        raw = cache.load(location)
+        self._write('config', '_colour=green;_size=10')
+        self.assertIs(raw, cache.load(location))  # Not checked again yet
+
+        cache.revalidate_seconds = 0
+        changed = cache.load(location)
+        self.assertEqual(['_colour', '_size'], changed.get_keys())
+        self.assertIs(changed, cache.load(location))  # Checked, but unchanged
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+
+        os.remove(location)
+        self.assertRaises(FileNotFoundError, cache.load, location)
+
+    def test_lru_eviction(self):
+        locations = [self._write(name, f'{name}=1') for name in 'abc']
+        cache = ImportCache(max_entries=2)
+        cache.load(locations[0])
+        cache.load(locations[1])
+        cache.load(locations[0])
+        cache.load(locations[2])  # Evicts b, the least recently used
+        self.assertEqual((2, 1), (len(cache), cache.evictions))
+        cache.load(locations[0])
+        cache.load(locations[1])
+        self.assertEqual((2, 4, 2), (cache.hits, cache.misses, cache.evictions))
+
+    def test_single_flight(self):
+        location = self._write('config', '_colour=red')
+        cache = SlowImportCache()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.load(location))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, cache.loads)
+        self.assertEqual((7, 1), (cache.hits, cache.misses))
+        self.assertEqual(8, len(results))
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_single_flight_failure(self):
+        cache = SlowImportCache()
+        missing = os.path.join(self.directory.name, 'missing')
+        errors = []
+
+        def load():
+            try:
+                cache.load(missing + '.modl')
+            except FileNotFoundError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(errors))
+        self.assertEqual(0, len(cache))
+
+    def test_interpreter_imports(self):
+        location = self._write('config', '*class(*id=a;*name=age);_colour=red')
+        cache = ImportCache()
+        text = f'*I={location};a=10;b=%colour'
+        first = ModlInterpreter(import_cache=cache).execute(build_raw_modl(text))
+        raw = cache.load(location)
+        snapshot = pickle.dumps(raw)
+        second = ModlInterpreter(import_cache=cache).execute(build_raw_modl(text))
+        self.assertEqual(snapshot, pickle.dumps(raw))
+        self.assertEqual(['age', 'b'], first.get_keys())
+        self.assertEqual(first.get_keys(), second.get_keys())
+        self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
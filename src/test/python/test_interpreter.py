@@ -1,8 +1,13 @@
+import os
+import tempfile
 import unittest
 
-from interpreter import UnrecognisedInstruction
+from interpreter import ClassRegistry, ModlInterpreter, UnrecognisedInstruction
 import modl
-from modl_creator import RawModlObject, Pair, Number, Map
+import modl_creator
+import parser
+import printer
+from modl_creator import RawModlObject, Pair, Number, Map, String
 
 
 class InterpreterTestCase(unittest.TestCase):
@@ -75,6 +80,128 @@ class InterpreterTestCase(unittest.TestCase):
         self.assertEqual('person', str(result_key))
         self.assertEqual(1, len(interpreted.structures))
 
+    def test_iter_interpret_carries_state_forward(self):
+        structures = modl.iter_interpret('*class(*id=a;*name=age);?=red:green;_sky=blue;a=10;fav=%1;b=%sky')
+        pairs = [(str(pair.key), pair.get_value().get_value()) for pair in structures]
+        self.assertEqual([('age', 10), ('fav', 'green'), ('b', 'blue')], pairs)
+
+    def test_iter_interpret_is_lazy(self):
+        # The native parser only reaches the syntax error after yielding the first structure
+        structures = modl.iter_interpret('a=1;b=2;c=(', parser.NATIVE_BACKEND)
+        self.assertEqual('a', str(next(structures).key))
+        self.assertEqual('b', str(next(structures).key))
+        self.assertRaises(ValueError, next, structures)
+
+    def test_strings_are_unescaped_once(self):
+        for backend in [parser.ANTLR_BACKEND, parser.NATIVE_BACKEND]:
+            with self.subTest(backend=backend):
+                self.assertEqual('[{"a": "\\\\n"}, {"b": "Zo\\u00eb"}, {"c": "x~~y"}]',
+                                 modl.to_json('a=\\\\n;b=Zo\\u00eb;c=x~~~~y', backend))
+
+    def test_interpret_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, 'test.modl')
+            with open(location, 'wb') as f:
+                f.write('\ufeff?=[red;green];fav=%1;name=Zoë'.encode('utf-8'))
+            self.assertEqual('[{"fav": "green"}, {"name": "Zo\\u00eb"}]', modl.file_to_json(location))
+            interpreted = modl.interpret_file(location)
+            self.assertEqual(['fav', 'name'], interpreted.get_keys())
+
+    def test_load_import_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, 'config')
+            with open(location + '.modl', 'wb') as f:
+                f.write('\ufeff_colour=red\n_size=10\n'.encode('utf-8'))
+            raw_modl = ModlInterpreter()._load_file(location)
+            self.assertEqual(['_colour', '_size'], raw_modl.get_keys())
+
+    def test_imports_are_interpreted_in_place(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = {'config': '_colour=red\nshared=1', 'outer': f'*I={directory}/config\n_size=10',
+                     'loop': f'*I={directory}/loop'}
+            for name, content in files.items():
+                with open(os.path.join(directory, name + '.modl'), 'w') as f:
+                    f.write(content)
+            for backend in [parser.ANTLR_BACKEND, parser.NATIVE_BACKEND]:
+                with self.subTest(backend=backend):
+                    self.assertEqual('[{"a": 1}, {"shared": 1}, {"b": "red 10"}, {"c": 2}]',
+                                     modl.to_json(f'a=1;*I={directory}/outer;b=%colour %size;c=2', backend))
+                    self.assertEqual('[{"shared": 1}, {"shared": 1}, {"b": "red"}]',
+                                     modl.to_json(f'*I={directory}/config:{directory}/config;b=%colour', backend))
+                    self.assertRaisesRegex(ValueError, 'Circular import', modl.to_json, f'*I={directory}/loop', backend)
+
+    def test_context(self):
+        config = '*class(*id=a;*name=age);*class(*id=p;*name=person;*superclass=map);?=red:green;_sky=blue'
+        record = 'a=10;fav=%1;b=%sky;p(name=John Smith)'
+        for backend in [parser.ANTLR_BACKEND, parser.NATIVE_BACKEND]:
+            with self.subTest(backend=backend):
+                context = modl.build_context(config, backend)
+                expected = modl.to_json(config + ';' + record, backend)
+                self.assertEqual(expected, modl.to_json(record, backend, context=context))
+                # Whatever a record defines stays in its own overlay
+                self.assertEqual('[{"AGE": 10}, {"fav": "blue"}, {"b": "grey"}]',
+                                 modl.to_json('*class(*id=a;*name=AGE);?=blue;_sky=grey;a=10;fav=%2;b=%sky',
+                                              backend, context=context))
+                self.assertEqual(expected, modl.to_json(record, backend, context=context))
+                self.assertEqual(['a', 'o', 'p'], sorted(context.classes))
+                self.assertEqual(2, context.symbols.numbered_variable_count())
+                self.assertEqual('blue', context.symbols.lookup('_sky'))
+                self.assertRaises(TypeError, context.symbols.set_value_pair, 'sky', 'grey')
+
+    def test_class_registry(self):
+        registry = ClassRegistry()
+        a, b = {'*name': 'age'}, {'*name': String('b')}
+        registry['a'] = a
+        registry['b'] = b
+        self.assertIs(a, registry.find('age'))
+        self.assertIs(a, registry.find('a'))
+        self.assertIs(b, registry.find(String('b')))
+        self.assertIsNone(registry.find('c'))
+        # A name is found before an id, and the first class with a name wins
+        c = {'*name': 'a'}
+        registry['c'] = c
+        registry['d'] = {'*name': 'a'}
+        self.assertIs(c, registry.find('a'))
+        self.assertIs(a, registry.get('a'))
+        # Redefining a class keeps its place
+        new_a = {'*name': 'b'}
+        registry['a'] = new_a
+        self.assertIs(new_a, registry.find('b'))
+        self.assertEqual(['a', 'b', 'c', 'd'], list(registry))
+
+        parent = registry.read_only_copy()
+        self.assertRaises(TypeError, parent.__setitem__, 'e', {})
+        overlay = ClassRegistry(parent)
+        self.assertEqual('b', overlay.find('b')['*name'])
+        overlay['e'] = {'*name': 'b'}
+        overlay['c'] = {'*name': 'c'}
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], list(overlay))
+        self.assertEqual('d', list(overlay.items())[3][0])
+        self.assertIs(overlay.get('d'), overlay.find('a'))
+        self.assertEqual('a', parent.find('a')['*name'])
+        self.assertEqual(4, len(parent))
+
+    def test_class_plans(self):
+        registry = ClassRegistry()
+        registry['p'] = {'*name': 'person', '*superclass': 'map', 'country': String('uk'), '*params1': None}
+        plan = registry.plan('p')
+        self.assertIs(plan, registry.plan('p'))
+        self.assertEqual(('person', 'map', True), (plan.name, plan.superclass, plan.contains_pairs))
+        self.assertEqual(['*params1'], list(plan.params))
+        self.assertEqual([('country', String('uk'))], plan.default_pairs)
+        self.assertIsNone(registry.plan('q'))
+        # Plans are shared through a context, and redefining a class replaces its plan
+        overlay = ClassRegistry(registry.read_only_copy())
+        self.assertIs(overlay.plan('person'), overlay.plan('person'))
+        overlay['p'] = {'*name': 'var'}
+        self.assertTrue(overlay.plan('p').loads_numbered_vars)
+        self.assertFalse(registry.plan('p').loads_numbered_vars)
+
+        interpreter = ModlInterpreter()
+        interpreter.classes['p'] = {'*name': 'person', '*superclass': 'map', 'country': String('uk')}
+        interpreted = interpreter.execute(modl_creator.build_raw_modl('p(name=John Smith)'))
+        self.assertEqual('{"person": {"name": "John Smith", "country": "uk"}}', printer.to_json(interpreted))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,8 @@ import unittest
 import modl
 import json
 
+import printer
+
 
 class ParseToJSONTestCase(unittest.TestCase):
     """
@@ -39,6 +41,28 @@ class ParseToJSONTestCase(unittest.TestCase):
     def test_simple_map(self):
         self.assertEqual('{"a": 123, "b": "hello"}', modl.to_json('(a=123;b="hello")'))
 
+    def test_iter_to_json(self):
+        for text in ['a=1', '(a=1;b=2)', 'a=1;b=[x;y]', '*class(*id=a;*name=age)']:
+            with self.subTest(input=text):
+                self.assertEqual(modl.to_json(text), ''.join(modl.iter_to_json(text)))
+
+    def test_encode(self):
+        default = printer.MODLJSONEncoder().default
+        for value in [None, 'caf\xe9 \U0001f600', [1, 2.5, float('nan'), -float('inf')], (True, False),
+                      {1: 'a', 2.5: [], None: {}, True: ()}]:
+            with self.subTest(value=value):
+                self.assertEqual(json.dumps(value), printer.encode(value, default))
+        circular = []
+        circular.append(circular)
+        self.assertRaisesRegex(ValueError, 'Circular reference', printer.encode, circular, default)
+        self.assertRaises(TypeError, printer.encode, object(), default)
+
+    def test_deep_json(self):
+        deep = []
+        for _ in range(10000):
+            deep = [deep]
+        self.assertEqual('[' * 10001 + ']' * 10001, printer.encode(deep, printer.MODLJSONEncoder().default))
+
     def test_base_tests(self):
         with open("../json/base_tests.json") as f:
             test_data = json.load(f)
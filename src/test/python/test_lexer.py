@@ -0,0 +1,105 @@
+import json
+import time
+import unittest
+
+from antlr4 import CommonTokenStream, InputStream, Token
+from antlr4.error.ErrorListener import ErrorListener
+
+from generated.MODLLexer import MODLLexer
+from generated.MODLParser import MODLParser
+from lexer import ModlLexer, tokenize
+
+
+class RecordingErrorListener(ErrorListener):
+    def __init__(self):
+        self.errors = []
+
+    def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
+        self.errors.append((line, column, msg))
+
+
+def all_tokens(lexer):
+    """Read every token from the lexer, returning them along with any errors reported."""
+    listener = RecordingErrorListener()
+    lexer.removeErrorListeners()
+    lexer.addErrorListener(listener)
+    tokens = []
+    while True:
+        token = lexer.nextToken()
+        if token.type == Token.EOF:
+            # The generated lexer reads the EOF text back from the input, so it isn't compared
+            tokens.append((token.type, token.start, token.stop, token.line, token.column))
+            return tokens, listener.errors
+        tokens.append((token.type, token.text, token.start, token.stop, token.line, token.column))
+
+
+class LexerTestCase(unittest.TestCase):
+    def assertSameTokens(self, text: str):
+        self.assertEqual(all_tokens(MODLLexer(InputStream(text))), all_tokens(ModlLexer(InputStream(text))))
+
+    def test_tokenize(self):
+        types, texts, offsets = tokenize('a=true;{b?c}')
+        self.assertEqual(['a', '=', 'true', ';', '{', 'b', '?', 'c', '}'], texts)
+        self.assertEqual([MODLLexer.STRING, MODLLexer.EQUALS, MODLLexer.TRUE, MODLLexer.SC, MODLLexer.LCBRAC,
+                          MODLLexer.STRING, MODLLexer.QMARK, MODLLexer.STRING, MODLLexer.RCBRAC], types)
+        self.assertEqual([0, 1, 2, 6, 7, 8, 9, 10, 11], offsets)
+
+    def test_modes(self):
+        # '?' is only reserved inside conditionals
+        self.assertEqual(['a?', '{', 'a', '?', '}', 'a?'], tokenize('a?{a?}a?')[1])
+
+    def test_numbers_and_keywords(self):
+        self.assertEqual([MODLLexer.NUMBER, MODLLexer.NULL, MODLLexer.FALSE, MODLLexer.STRING],
+                         tokenize('-1.5e3;000;00;001')[0][::2])
+
+    def test_comments(self):
+        self.assertEqual(['a', '\n', 'b'], tokenize('a ## comment\nb')[1])
+        # A STRING of '#' prefixes that carries on past the end of the line is longer than the comment
+        self.assertEqual(['##a~\nb'], tokenize('##a~\nb')[1])
+
+    def test_escapes_and_graves(self):
+        self.assertSameTokens('a=~(x\\) y;b=`%c`.u;c=~` b`;d="x~"y"')
+        self.assertSameTokens('a=\\  #~ #``;{a?`b`?`c`}')
+
+    def test_ambiguous_escapes(self):
+        self.assertSameTokens('a="/\\"\\"";b=~ ("~"\\{#  ~"~# ~ ')
+        self.assertSameTokens('a=' + '~`' * 8 + 'b;c=' + '~#a' * 8 + ';d="' + '~ a' * 8 + '"')
+        # Long runs of ambiguous escapes are matched in linear time, without recursion
+        for text in ['x="' + '~ a' * 2000 + '"', 'x=' + '~#' * 2000, 'x=' + '~`' * 2000 + 'a',
+                     '{x=`' + '#a' * 2000 + '~ `}']:
+            with self.subTest(input=text[:10]):
+                start = time.perf_counter()
+                tokenize(text)
+                self.assertLess(time.perf_counter() - start, 1)
+
+    def test_long_lines(self):
+        text = ';'.join(f'k{i}=v{i}' for i in range(20000)) + '\na=1'
+        tokens = CommonTokenStream(ModlLexer(InputStream(text)))
+        tokens.fill()
+        self.assertEqual((1, text.index('v19999')), (tokens.tokens[-6].line, tokens.tokens[-6].column))
+        self.assertEqual([(2, 0), (2, 1), (2, 2)], [(token.line, token.column) for token in tokens.tokens[-4:-1]])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, tokenize, 'a}')
+        self.assertSameTokens('a}":?0a|=')
+        self.assertSameTokens('a# # a \\')
+        self.assertSameTokens('{#a}\n`b')
+
+    def test_base_tests(self):
+        with open("../json/base_tests.json") as f:
+            test_data = json.load(f)
+
+        for i in range(len(test_data)):
+            input: str = test_data[i]['input']
+            with self.subTest(msg=f"{i}", input=input):
+                self.assertSameTokens(input)
+
+    def test_parser_token_source(self):
+        parser = MODLParser(CommonTokenStream(ModlLexer(InputStream('a=(b=1;c=[2;3])'))))
+        tree = parser.modl()
+        self.assertEqual(0, parser.getNumberOfSyntaxErrors())
+        self.assertEqual('a=(b=1;c=[2;3])<EOF>', tree.getText())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
+import pickle
 import unittest
 
-from modl_creator import process_modl_parsed
+from modl_creator import Array, FalseVal, Map, ModlObject, NullVal, Number, Pair, String, TrueVal, \
+    process_modl_parsed
+import parser
 from parser import parse
 
 
@@ -19,6 +22,90 @@ class TestModlCreatorTestCase(unittest.TestCase):
         self.assertEqual(('a', 1), (str(actual_values[0].get_key()), actual_values[0].get_value().get_value()))
         self.assertEqual(('b', 4), (str(actual_values[1].get_key()), actual_values[1].get_value().get_value()))
 
+    def test_get_by_name(self):
+        modl_map = Map()
+        modl_map.add(Pair('a', String('1')))
+        modl_map.add(Pair('b', String('2')))
+        modl_map.add(Pair('a', String('3')))
+        # The first pair with a key wins, however the key is given
+        self.assertEqual('1', str(modl_map.get_by_name('a')))
+        self.assertEqual('2', str(modl_map.get_by_name(String('b'))))
+        self.assertIsNone(modl_map.get_by_name('c'))
+        self.assertTrue(modl_map.has_key('b'))
+        self.assertFalse(modl_map.has_key('c'))
+        self.assertEqual(['a', 'b', 'a'], modl_map.get_keys())
+
+        # Items added directly to the list are found too, as are items after the list is changed in place
+        modl_map.get_modl_values().append(Pair('c', String('4')))
+        self.assertEqual('4', str(modl_map.get_by_name('c')))
+        del modl_map.get_modl_values()[0]
+        self.assertEqual('3', str(modl_map.get_by_name('a')))
+
+        # The index isn't part of the pickled map
+        looked_up = pickle.loads(pickle.dumps(modl_map))
+        self.assertEqual(pickle.dumps(looked_up), pickle.dumps(modl_map))
+        self.assertEqual('4', str(looked_up.get_by_name('c')))
+
+    def test_array_and_modl_object_get_by_name(self):
+        array = Array()
+        array.add(String('a'))
+        array.add(Pair('a', String('1')))
+        self.assertEqual('1', str(array.get_by_name('a').get_value()))
+        self.assertIsNone(array.get_by_name('b'))
+
+        modl_object = ModlObject()
+        modl_object.add_structures([array, Pair('x', String('2')), Pair('x', String('3'))])
+        self.assertEqual('2', str(modl_object.get_by_name('x').get_value()))
+        self.assertTrue(modl_object.has_key('x'))
+        self.assertIsNone(modl_object.get_by_name('a'))
+
+    def test_terminals(self):
+        raw_modl = process_modl_parsed(parse('a=[true;false;null;true;1;1.0;x]'))
+        values = raw_modl.get_by_index(0).get_value().get_modl_values()
+        self.assertIs(values[0], values[3])
+        self.assertIs(TrueVal(), values[0])
+        self.assertIs(FalseVal(), values[1])
+        self.assertIs(NullVal(), values[2])
+        self.assertEqual(values[4], values[5])
+        self.assertEqual(hash(values[4]), hash(values[5]))
+        self.assertNotEqual(Number(1), Number(2))
+        self.assertNotEqual(TrueVal(), FalseVal())
+        self.assertEqual(1, len({NullVal(), NullVal()}))
+        self.assertEqual(String('x'), values[6])
+
+        for value in values:
+            with self.subTest(value=value):
+                self.assertRaises(AttributeError, setattr, value, 'string', 'y')
+                self.assertFalse(hasattr(value, '__dict__'))
+                copied = pickle.loads(pickle.dumps(value))
+                self.assertEqual(value, copied)
+                self.assertEqual(type(value), type(copied))
+        self.assertIs(NullVal(), pickle.loads(pickle.dumps(values[2])))
+
+    def test_deep_processing(self):
+        # Far deeper than the parsers allow, so the parse tree is put together here
+        parsed = parser.ModlParsed()
+        structure = parser.Structure()
+        structure.array = parser.Array()
+        parsed.append(structure)
+        parsed_array = structure.array
+        for _ in range(10000):
+            item = parser.ArrayItem()
+            item.array_value_item = parser.ArrayValueItem()
+            item.array_value_item.array = parser.Array()
+            parsed_array.array_items = [item]
+            parsed_array = item.array_value_item.array
+        item = parser.ArrayItem()
+        item.array_value_item = parser.ArrayValueItem()
+        item.array_value_item.string = 'x'
+        parsed_array.array_items = [item]
+
+        value = process_modl_parsed(parsed).get_by_index(0)
+        for _ in range(10001):
+            self.assertIsInstance(value, Array)
+            value = value.get_by_index(0)
+        self.assertEqual(String('x'), value)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+
+import modlc
+import parser
+from interpreter import ModlInterpreter
+from modl_creator import build_raw_modl
+from test_native_parser import describe
+
+
+class ModlcTestCase(unittest.TestCase):
+    def assertRoundTrip(self, text: str):
+        raw_modl = build_raw_modl(text, parser.NATIVE_BACKEND)
+        self.assertEqual(describe(raw_modl.structures), describe(modlc.loads(modlc.dumps(raw_modl)).structures))
+
+    def write_source(self, directory: str, text: str) -> str:
+        location = os.path.join(directory, 'config.modl')
+        with open(location, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return location
+
+    def test_round_trip(self):
+        self.assertRoundTrip('a=1;b=-300;c=2.5;d=Zoë;e=[01;true;false;null;x:x:x];f=(g=h;*I=x)')
+        self.assertRoundTrip('a=0;b="";c={x?1/?2};{x?d=1}')
+
+    def test_damaged(self):
+        data = modlc.dumps(build_raw_modl('a=[1;2;3]', parser.NATIVE_BACKEND))
+        self.assertRaises(ValueError, modlc.loads, data[:-1])
+        self.assertRaises(ValueError, modlc.loads, data + b'\0')
+        self.assertRaises(ValueError, modlc.loads, b'MODLX' + data[5:])
+        self.assertRaises(ValueError, modlc.loads, data[:5] + bytes([modlc.FORMAT_VERSION + 1]) + data[6:])
+
+    def test_compiled_location(self):
+        self.assertEqual('config.modlc', modlc.compiled_location('config.modl'))
+        self.assertEqual('config.txt.modlc', modlc.compiled_location('config.txt'))
+
+    def test_compile_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = self.write_source(directory, 'a=1;b=[2;3]')
+            self.assertEqual(location + 'c', modlc.compile_file(location))
+            with open(location + 'c', 'rb') as f:
+                compiled = modlc.loads(f.read())
+            self.assertEqual(describe(build_raw_modl('a=1;b=[2;3]').structures), describe(compiled.structures))
+
+    def test_load_file_uses_up_to_date_compiled_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = self.write_source(directory, 'a=1')
+            stat = os.stat(location)
+            # A compiled file with different contents shows which one was loaded
+            with open(location + 'c', 'wb') as f:
+                f.write(modlc.dumps(build_raw_modl('b=2'), stat.st_size, stat.st_mtime_ns))
+            self.assertEqual(['b'], modlc.load_file(location).get_keys())
+
+            with open(location + 'c', 'wb') as f:
+                f.write(modlc.dumps(build_raw_modl('b=2'), stat.st_size, stat.st_mtime_ns - 1))
+            self.assertEqual(['a'], modlc.load_file(location).get_keys())
+
+            with open(location + 'c', 'wb') as f:
+                f.write(b'MODLC')
+            self.assertEqual(['a'], modlc.load_file(location).get_keys())
+
+    def test_load_file_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = self.write_source(directory, 'a=1')
+            modlc.load_file(location)
+            self.assertFalse(os.path.exists(location + 'c'))
+            modlc.load_file(location, write=True)
+            self.assertTrue(os.path.exists(location + 'c'))
+            self.assertEqual(['a'], modlc.load_file(location).get_keys())
+            self.assertEqual([], [name for name in os.listdir(directory) if name.endswith('.tmp')])
+
+    def test_import_compiled_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = self.write_source(directory, '_colour=red')
+            stat = os.stat(location)
+            with open(location + 'c', 'wb') as f:
+                f.write(modlc.dumps(build_raw_modl('_size=10'), stat.st_size, stat.st_mtime_ns))
+            raw_modl = ModlInterpreter()._load_file(location[:-len('.modl')])
+            self.assertEqual(['_size'], raw_modl.get_keys())
+
+    def test_base_tests(self):
+        with open("../json/base_tests.json") as f:
+            test_data = json.load(f)
+
+        for i in range(len(test_data)):
+            input: str = test_data[i]['input']
+            try:
+                build_raw_modl(input, parser.NATIVE_BACKEND)
+            except Exception:
+                continue
+            with self.subTest(msg=f"{i}", input=input):
+                self.assertRoundTrip(input)
+
+
+if __name__ == '__main__':
+    unittest.main()
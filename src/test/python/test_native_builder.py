@@ -0,0 +1,155 @@
+import json
+import sys
+import threading
+import unittest
+import weakref
+
+import modl_creator
+import native_parser
+import parser
+from native_builder import NativeBuilder, build, iter_build
+from test_native_parser import describe
+
+
+def outcome(build_structures, text: str):
+    """The described raw structures, or the exception they fail with."""
+    try:
+        return describe(list(build_structures(text)))
+    except Exception as e:
+        return type(e), str(e)
+
+
+def build_all(value):
+    """Build the items of every lazy map and array in a raw value."""
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, (modl_creator.Map, modl_creator.Array)):
+            pending.extend(value.get_modl_values())
+        elif isinstance(value, modl_creator.Pair):
+            pending.append(value.get_value())
+
+
+class NativeBuilderTestCase(unittest.TestCase):
+    def assertSameRaw(self, text: str):
+        expected = outcome(lambda t: modl_creator.process_modl_parsed(native_parser.parse(t)).structures, text)
+        self.assertEqual(expected, outcome(lambda t: build(t).structures, text))
+        expected = outcome(lambda t: modl_creator.iter_process_modl_parsed(native_parser.iter_parse(t)), text)
+        self.assertEqual(expected, outcome(iter_build, text))
+
+    def test_pair(self):
+        pair = build('"a b"=~`c`').structures[0]
+        self.assertIsInstance(pair, modl_creator.Pair)
+        self.assertEqual(('a b', '`c`'), (pair.key, pair.get_value().get_value()))
+
+    def test_arrays(self):
+        self.assertSameRaw('a[1;;3]')
+        self.assertSameRaw('a=1:2::4;b=[x:y;z]')
+        self.assertSameRaw('x=b=1:2:3')
+        self.assertSameRaw('x=[(a=1):[2]]')
+        # Pairs are kept in arrays, and maps can be empty
+        raw = build('a=[b=1;c=()]')
+        self.assertEqual(['b', 'c'], [str(pair.key) for pair in raw.structures[0].get_value().get_modl_values()])
+        self.assertEqual([], raw.structures[0].get_value().get_by_index(1).get_value().get_modl_values())
+
+    def test_modl_creator_quirks(self):
+        # Zero and empty strings are dropped, and conditionals become None
+        self.assertSameRaw('a=0;b="";c=0.0;d=1:0:"":2')
+        self.assertSameRaw('a={x?1/?2};{x?b=1};m({x?c=1};d=2);e=[{x?1}:2]')
+        self.assertSameRaw('[a=1]')
+        self.assertSameRaw('a=()')
+        self.assertSameRaw('{x?[a=1]};a={y=[b=1]?1/?2}')
+        self.assertSameRaw('a={x?[b=1]/?2}')
+        self.assertSameRaw('a=b={c?x}:1;d=x:e={c?x}:1:2')
+        self.assertSameRaw('a=' + '{x?k=' * 25 + '1' + '}:2' * 25 + ';b=' + '{x?k=' * 25 + '1' + '/?2}' * 25)
+
+    def test_imports(self):
+        self.assertSameRaw('*I=x;a=1')
+        self.assertSameRaw('*I=[a=1]')
+        self.assertSameRaw('*I(a=[b=1])')
+        self.assertSameRaw('*IMPORT={a?b/?c}')
+
+    def test_syntax_error(self):
+        # A syntax error is reported ahead of a processing error, as if the whole text was parsed first
+        self.assertRaises(ValueError, build, 'a=[b=1];c=(')
+        self.assertSameRaw('a=[b=1];c=(')
+        self.assertSameRaw('a=1;b=[c=2;d=(]')
+
+    def test_build_raw_modl(self):
+        for backend in [parser.ANTLR_BACKEND, parser.NATIVE_BACKEND]:
+            with self.subTest(backend=backend):
+                raw = modl_creator.build_raw_modl('a=1;b=[2;3]', backend)
+                self.assertEqual(2, len(raw.structures))
+                structures = list(modl_creator.iter_build_raw_modl('a=1;b=[2;3]', backend))
+                self.assertEqual(describe(raw.structures), describe(structures))
+
+    def test_lazy(self):
+        raw = build('country=gb;payload=(a=[1;2];b=(c=3))', lazy=True)
+        payload = raw.structures[1].get_value()
+        self.assertNotIn('map_items', vars(payload))
+        self.assertEqual('gb', raw.structures[0].get_value().get_value())
+
+        self.assertEqual(['a', 'b'], payload.get_keys())
+        self.assertNotIn('array_items', vars(payload.get_by_name('a')))
+        self.assertEqual(2, payload.get_by_name('a').get_by_index(1).get_value())
+        self.assertEqual(3, payload.get_by_name('b').get_by_name('c').get_value())
+        self.assertEqual(describe(build('country=gb;payload=(a=[1;2];b=(c=3))').structures), describe(raw.structures))
+
+    def test_lazy_iter_build(self):
+        # Lazy items can be built while iter_build() is part way through the document
+        structures = iter_build('a=[1;(b=2)];c=[3]', lazy=True)
+        a = next(structures)
+        self.assertEqual(2, a.get_value().get_by_index(1).get_by_name('b').get_value())
+        self.assertEqual(3, next(structures).get_value().get_by_index(0).get_value())
+        self.assertEqual([], list(structures))
+
+    def test_lazy_threads(self):
+        # Each map is built by a cursor of its own, so threads can build the items of one tree at the same time
+        text = ';'.join(f'm{i}=(' + ';'.join(f'k{j}=[{i}:{j};x]' for j in range(300)) + ')' for i in range(8))
+        raw = build(text, lazy=True)
+        expected = [describe([structure]) for structure in build(text).structures]
+        results = [None] * 8
+
+        def describe_structure(i):
+            build_all(raw.structures[i])
+            results[i] = describe([raw.structures[i]])
+
+        threads = [threading.Thread(target=describe_structure, args=(i,)) for i in range(8)]
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)  # Switch threads often, part way through building items
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(expected, results)
+
+    def test_lazy_builder_is_released(self):
+        builder = NativeBuilder('a=(b=[1;(c=2)]);d=[3]', lazy=True)
+        raw = builder.modl()
+        released = weakref.ref(builder)
+        del builder
+        self.assertIsNotNone(released())
+        for structure in raw.structures:
+            build_all(structure)
+        self.assertIsNone(released())
+
+    def test_lazy_errors(self):
+        # Errors inside a lazy map or array are raised when its items are built
+        raw = build('a=(b=[1;2)];c=()', lazy=True)
+        self.assertRaisesRegex(ValueError, 'line 1:10 ', raw.structures[0].get_value().get_modl_values)
+        self.assertEqual([], raw.structures[1].get_value().get_modl_values())
+        self.assertRaises(ValueError, build, 'a=(b=1', lazy=True)
+        self.assertRaises(ValueError, modl_creator.build_raw_modl, 'a=1', parser.ANTLR_BACKEND, True)
+
+    def test_base_tests(self):
+        with open("../json/base_tests.json") as f:
+            test_data = json.load(f)
+
+        for i in range(len(test_data)):
+            input: str = test_data[i]['input']
+            with self.subTest(msg=f"{i}", input=input):
+                self.assertSameRaw(input)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import time
+import unittest
+
+import modl
+import parser
+from native_parser import parse
+
+
+def describe(node):
+    """Turn a parse tree into nested tuples so that trees from the two backends can be compared."""
+    if node is None or isinstance(node, (str, int, float, bool)):
+        return node
+    if isinstance(node, (list, tuple)):
+        return [describe(item) for item in node]
+    if isinstance(node, dict):
+        return [(describe(key), describe(value)) for key, value in node.items()]
+    if hasattr(node, '__dict__'):
+        attributes = vars(node)
+    else:
+        names = [name for cls in type(node).__mro__ for name in getattr(cls, '__slots__', ())]
+        attributes = {name: getattr(node, name) for name in names if hasattr(node, name)}
+    # Skips the key index that modl_creator containers build up as they're used
+    return type(node).__name__, {k: describe(v) for k, v in sorted(attributes.items()) if k != '_key_index'}
+
+
+class NativeParserTestCase(unittest.TestCase):
+    def assertSameTree(self, text: str):
+        expected = describe(parser.parse(text, parser.ANTLR_BACKEND))
+        self.assertEqual(expected, describe(parse(text)))
+
+    def test_name_number_pair(self):
+        modl_parsed = parse("a=-1.5e3")
+        pair = modl_parsed.structures[0].pair
+        self.assertEqual(('a', -1.5e3), (pair.key, pair.value_item.value.number))
+
+    def test_quoted_key(self):
+        modl_parsed = parse('"a b"="c"')
+        pair = modl_parsed.structures[0].pair
+        self.assertEqual(('a b', 'c'), (pair.key, pair.value_item.value.quoted))
+
+    def test_nb_array(self):
+        modl_parsed = parse('a=1:2::4')
+        items = modl_parsed.structures[0].pair.value_item.value.nb_array.array_items
+        self.assertEqual([1, 2, None, 4], [item.array_value_item.number for item in items])
+        self.assertTrue(items[2].array_value_item.is_null)
+
+    def test_nested_nb_array(self):
+        # The first item takes as few colons as it can, like the ANTLR parser
+        modl_parsed = parse('x=b=1:2:3')
+        items = modl_parsed.structures[0].pair.value_item.value.nb_array.array_items
+        inner = items[0].array_value_item.pair.value_item.value.nb_array.array_items
+        self.assertEqual([1, 2], [item.array_value_item.number for item in inner])
+        self.assertEqual(3, items[1].array_value_item.number)
+
+    def test_empty_array_items(self):
+        modl_parsed = parse('a[1;;3]')
+        items = modl_parsed.structures[0].pair.array.array_items
+        self.assertEqual([1, None, 3], [item.array_value_item.number for item in items])
+
+    def test_conditionals(self):
+        self.assertSameTree('{a=1|2&!b>3?x=1;y=2/c!=d?x=3/?x=4}')
+        self.assertSameTree('m(a={c?(x=1):2/?3};{c?d=1/?d=2})')
+        self.assertSameTree('x=[{a>=1?b;c/?d}:e]')
+        self.assertSameTree('x={!{a=b|c=d}?1/?2}')
+        # A conditional that can't be a value conditional starts an nb_array in the pair's value
+        self.assertSameTree('a=b={c?x}:1')
+        self.assertSameTree('a=x:b={c?x}:1:2')
+        self.assertSameTree('a=[b={c?x}:1]')
+        self.assertSameTree('a=b={c?x/?y}:1')
+
+    def test_nested_conditionals(self):
+        # Conditionals are trial parsed, which used to take exponential time in how deeply they were nested
+        documents = [
+            'a=' + '{x?k=' * 25 + '1' + '}:2' * 25,
+            'a=' + '{x?k=' * 25 + '1' + '/?2}' * 25,
+        ]
+        for text in documents:
+            with self.subTest(input=text[:20]):
+                start = time.perf_counter()
+                self.assertSameTree(text)
+                self.assertLess(time.perf_counter() - start, 1)
+        start = time.perf_counter()
+        self.assertRaises(ValueError, parse, '{x?k={y?1/?2}:' * 25)
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_comments_and_newlines(self):
+        self.assertSameTree('## comment\r\na=1\n\n;b=2\n## another\n')
+
+    def test_escapes_and_graves(self):
+        self.assertSameTree('a=~(x\\) y;b=`%c`.u;c=~` b`')
+
+    def test_syntax_error(self):
+        self.assertRaises(ValueError, parse, 'a=(b=1')
+        self.assertRaises(ValueError, parse, 'a=b}')
+        self.assertRaises(ValueError, parse, 'a=b={c?x/y}:1')  # ANTLR reports and recovers from this one
+
+    def test_base_tests(self):
+        with open("../json/base_tests.json") as f:
+            test_data = json.load(f)
+
+        for i in range(len(test_data)):
+            input: str = test_data[i]['input']
+            with self.subTest(msg=f"{i}", input=input):
+                try:
+                    expected = describe(parser.parse(input, parser.ANTLR_BACKEND))
+                except AttributeError:
+                    # A few inputs crash the ANTLR listener, so there's nothing to compare with
+                    continue
+                self.assertEqual(expected, describe(parse(input)))
+
+    def test_to_json_with_native_backend(self):
+        self.assertEqual('{"a": [1, 2], "b": "c"}', modl.to_json('(a=1:2;b=c)', parser.NATIVE_BACKEND))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import parallel_parser
+import parser
+from test_native_parser import describe
+
+
+class ParallelParserTestCase(unittest.TestCase):
+    def setUp(self):
+        # Threads are enough to check that the chunks are stitched back together correctly
+        self.executor = ThreadPoolExecutor(2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def assertSameTree(self, text: str, backend: str):
+        expected = describe(parser.parse(text, backend))
+        actual = describe(parallel_parser.parse(text, backend, executor=self.executor, chunk_size=1))
+        self.assertEqual(expected, actual)
+
+    def test_split_points(self):
+        text = 'a=1;b=(c=2\nd=3)\n\n[x;y]\n:z\n;{e?f=4};"g"=`;\n`'
+        self.assertEqual([4, 17, 27, 35], parallel_parser.split_points(text))
+        self.assertEqual(['a=1;', 'b=(c=2\nd=3)\n\n', '[x;y]\n:z\n;', '{e?f=4};', '"g"=`;\n`'],
+                         parallel_parser.split(text, 1))
+        self.assertEqual(['a=1;b=(c=2\nd=3)\n\n', '[x;y]\n:z\n;', '{e?f=4};"g"=`;\n`'], parallel_parser.split(text, 10))
+        self.assertIsNone(parallel_parser.split_points('a=1;b=}'))
+
+    def test_base_tests(self):
+        with open("../json/base_tests.json") as f:
+            test_data = json.load(f)
+
+        for backend in [parser.NATIVE_BACKEND, parser.ANTLR_BACKEND]:
+            for i in range(len(test_data)):
+                input: str = test_data[i]['input']
+                with self.subTest(msg=f"{i}", input=input, backend=backend):
+                    try:
+                        self.assertSameTree(input, backend)
+                    except (AttributeError, ValueError):
+                        # Inputs that fail to parse should fail the same way in parallel
+                        self.assertRaises(Exception, parallel_parser.parse, input, backend,
+                                          executor=self.executor, chunk_size=1)
+
+    def test_syntax_error(self):
+        # The error is reported against the whole text, not the chunk it's in
+        self.assertRaisesRegex(ValueError, 'line 3:6 ', parallel_parser.parse, 'a=1\nb=2\nc=(d=3',
+                               parser.NATIVE_BACKEND, executor=self.executor, chunk_size=1)
+
+    def test_max_depth(self):
+        text = 'a=1\nb=(' + 'x=(' * 15 + 'c=1' + ')' * 15 + ')\nd=2\n'
+        for backend in [parser.NATIVE_BACKEND, parser.ANTLR_BACKEND]:
+            with self.subTest(backend=backend):
+                self.assertRaisesRegex(ValueError, 'line 2:.* maximum depth of 20', parallel_parser.parse, text,
+                                       backend, executor=self.executor, chunk_size=1, max_depth=20)
+                self.assertSameTree(text, backend)
+
+    def test_process_pool(self):
+        text = ';'.join(f'k{i}=[{i};(a=b)]' for i in range(50))
+        expected = describe(parser.parse(text))
+        self.assertEqual(expected, describe(parallel_parser.parse(text, max_workers=2, chunk_size=100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
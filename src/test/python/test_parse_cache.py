@@ -0,0 +1,74 @@
+import pickle
+import unittest
+
+import modl
+import parser
+from parse_cache import ParseCache
+
+
+class ParseCacheTestCase(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = ParseCache()
+        raw = cache.get_raw_modl('a=1')
+        self.assertIs(raw, cache.get_raw_modl('a=1'))
+        self.assertIsNot(raw, cache.get_raw_modl('a=1', parser.NATIVE_BACKEND))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        self.assertEqual(2, len(cache))
+
+    def test_max_depth(self):
+        cache = ParseCache()
+        cache.get_raw_modl('a=[[1]]')
+        self.assertRaises(ValueError, cache.get_raw_modl, 'a=[[1]]', max_depth=2)
+
+    def test_lru_eviction(self):
+        cache = ParseCache(max_entries=2)
+        cache.get_raw_modl('a=1')
+        cache.get_raw_modl('b=2')
+        cache.get_raw_modl('a=1')
+        cache.get_raw_modl('c=3')  # Evicts b=2, the least recently used
+        self.assertEqual(2, len(cache))
+        cache.get_raw_modl('a=1')
+        self.assertEqual((2, 3), (cache.hits, cache.misses))
+        cache.get_raw_modl('b=2')
+        self.assertEqual(4, cache.misses)
+
+    def test_memory_budget(self):
+        small = ParseCache()
+        small.get_raw_modl('a=1')
+        entry_size = small.current_bytes
+
+        cache = ParseCache(max_bytes=entry_size * 2)
+        for text in ['a=1', 'b=2', 'c=3']:
+            cache.get_raw_modl(text)
+        self.assertEqual(2, len(cache))
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+        cache = ParseCache(max_bytes=entry_size - 1)
+        cache.get_raw_modl('a=1')
+        self.assertEqual(0, len(cache))
+
+    def test_large_strings_count(self):
+        # Strings and numbers are slotted, so their values are found through __slots__ rather than vars()
+        small = ParseCache()
+        small.get_raw_modl('a=x')
+        large = ParseCache()
+        large.get_raw_modl('a=' + 'x' * 100000)
+        self.assertGreater(large.current_bytes - small.current_bytes, 90000)
+
+        cache = ParseCache(max_bytes=50000)
+        cache.get_raw_modl('a=' + 'x' * 100000)
+        self.assertEqual(0, len(cache))
+
+    def test_cached_tree_is_not_modified(self):
+        cache = ParseCache()
+        text = '_colours=(r=red;g=green);*class(*id=a;*name=age);a=10;fav=%colours'
+        raw = cache.get_raw_modl(text)
+        snapshot = pickle.dumps(raw)
+        first = modl.to_json(text, cache=cache)
+        self.assertEqual(snapshot, pickle.dumps(raw))
+        self.assertEqual(first, modl.to_json(text, cache=cache))
+        self.assertEqual(modl.to_json(text), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
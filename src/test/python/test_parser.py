@@ -1,5 +1,11 @@
+import os
+import sys
+import tempfile
 import unittest
-from parser import parse
+
+import modl
+import parser
+from parser import parse, parse_file, read_file, NATIVE_BACKEND, ANTLR_BACKEND, PredictionStats
 
 
 class ParserTestCase(unittest.TestCase):
@@ -95,6 +101,82 @@ class ParserTestCase(unittest.TestCase):
         pair = modl.structures[1].pair
         self.assertEqual(('a', 10), (pair.key, pair.value_item.value.number))
 
+    def test_read_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, 'test.modl')
+            files = [(b'', ''), (b'a=caf\xc3\xa9', 'a=café'), (b'\xef\xbb\xbfa=1\r\nb=2', 'a=1\r\nb=2')]
+            for content, expected in files:
+                with open(location, 'wb') as f:
+                    f.write(content)
+                self.assertEqual(expected, read_file(location))
+
+    def test_parse_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, 'test.modl')
+            with open(location, 'wb') as f:
+                f.write('\ufeffa=café;b=2'.encode('utf-8'))
+            for modl in [parse_file(location), parse_file(location, NATIVE_BACKEND)]:
+                pair = modl.structures[0].pair
+                self.assertEqual(('a', 'café'), (pair.key, pair.value_item.value.string))
+
+    def test_prediction_stats(self):
+        stats = PredictionStats()
+        parse('a=1:2:3;b(c=[1;2];d={x=1?y/?z})', stats=stats)
+        self.assertEqual((0, 0), (stats.ll_fallbacks, stats.syntax_errors))
+        rules = {row[0]: row for row in stats.summary()}
+        self.assertIn('modl_pair', rules)
+        self.assertEqual(sum(stats.decisions.values()), sum(row[1] for row in rules.values()))
+
+        # A syntax error makes the SLL pass give up, and is then only reported by the LL pass
+        parse('a=(b=1;c=2', stats=stats)
+        self.assertEqual((1, 2), (stats.ll_fallbacks, stats.syntax_errors))
+
+        self.assertRaises(ValueError, parse, 'a=1', NATIVE_BACKEND, stats)
+
+    def test_max_depth(self):
+        depth = 64
+        documents = [
+            ('a=' + '[' * (depth - 1) + '1' + ']' * (depth - 1), 'a=' + '[' * depth + '1' + ']' * depth),
+            ('='.join(f'k{i}' for i in range(depth + 1)), '='.join(f'k{i}' for i in range(depth + 2))),
+            ('a=' + '(b=' * (depth // 2 - 1) + '1' + ')' * (depth // 2 - 1), 'a=' + '(b=' * (depth // 2) + '1' + ')' * (depth // 2)),
+        ]
+        for backend in [ANTLR_BACKEND, NATIVE_BACKEND]:
+            for deepest, too_deep in documents:
+                with self.subTest(backend=backend, input=too_deep[:20]):
+                    parse(deepest, backend, max_depth=depth)
+                    with self.assertRaisesRegex(ValueError, f'nesting is deeper than the maximum depth of {depth}'):
+                        parse(too_deep, backend, max_depth=depth)
+
+        # Separators and newlines end a chain of pairs, unless the value is on the next line
+        parse('\n'.join(f'k{i}=v' for i in range(depth + 1)), NATIVE_BACKEND, max_depth=depth)
+        self.assertRaises(ValueError, parse, 'a=\n' * (depth + 1) + 'b', NATIVE_BACKEND, max_depth=depth)
+
+        parse('a=[1]', NATIVE_BACKEND, max_depth=2)
+        self.assertRaisesRegex(ValueError, 'line 1:3 nesting', parse, 'a=[[1]]', NATIVE_BACKEND, max_depth=2)
+
+    def test_default_max_depth(self):
+        # Documents at the default depth can be parsed and interpreted by either backend with Python's default
+        # recursion limit, even when the caller is already a few hundred frames deep
+        depth = parser.DEFAULT_MAX_DEPTH
+        documents = [
+            'a=' + '[' * (depth - 1) + '1' + ']' * (depth - 1),
+            'a=' + '(b=' * (depth // 2 - 1) + '[1]' + ')' * (depth // 2 - 1),
+            '='.join(f'k{i}' for i in range(depth + 1)),
+            'a=' + '{x?k=' * (depth // 2 - 1) + '[1]' + '/?2}' * (depth // 2 - 1),
+            'a=' + '[1:' * (depth - 1) + '1' + ']' * (depth - 1),
+        ]
+
+        def nested(frames, function, *args):
+            return nested(frames - 1, function, *args) if frames else function(*args)
+
+        self.assertEqual(1000, sys.getrecursionlimit())
+        for text in documents:
+            self.assertRaises(ValueError, parse, text, NATIVE_BACKEND, max_depth=depth - 1)
+            for backend in [ANTLR_BACKEND, NATIVE_BACKEND]:
+                with self.subTest(backend=backend, input=text[:20]):
+                    nested(300, modl.to_json, text, backend)
+                    nested(300, lambda: ''.join(modl.iter_to_json(text, backend)))
+
     @unittest.skip('Not yet implemented properly in both test and prod code')
     def test_conditional(self):
         modl = parse('country=gb;support_contact={country=gb?John Smith/country=us?John Doe/?None}')
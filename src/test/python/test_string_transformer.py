@@ -1,7 +1,45 @@
+import random
 import unittest
 
-from modl_creator import String, TrueVal, FalseVal
-from string_transformer import StringTransformer
+from modl_creator import String, TrueVal, FalseVal, Number, Map
+from string_transformer import GENERAL, PLAIN, StringTransformer, SymbolTable, Template, compile_template, \
+    get_end_of_number, is_digit, scan_references
+
+
+# How the parts of a string were found before scan_references(), one search at a time, to check it against
+def find_grave_parts(text):
+    def next_grave(start):
+        while True:
+            index = text.find('`', start)
+            if index == -1 or index == start or text[index - 1] not in '~\\':
+                return None if index == -1 else index
+            start = index + 1
+
+    parts = []
+    start = next_grave(0)
+    while start is not None:
+        end = next_grave(start + 1)
+        if end is None:
+            break
+        parts.append(text[start:end + 1])
+        start = next_grave(end + 1)
+    return parts
+
+
+def find_percent_parts(text):
+    parts = []
+    start = text.find('%')
+    while start != -1 and start < len(text) - 1:
+        if is_digit(text[start + 1]):
+            end = get_end_of_number(text, start + 1)
+        else:
+            ends = [index for index in (text.find(' ', start), text.find(':', start)) if index != -1]
+            end = min(ends, default=len(text))
+        if end <= start + 1:
+            raise ValueError('Never finished')  # The old search didn't move on from here
+        parts.append(text[start:end])
+        start = text.find('%', end + 1)
+    return parts
 
 
 class StringTransformerTestCase(unittest.TestCase):
@@ -32,6 +70,89 @@ class StringTransformerTestCase(unittest.TestCase):
         result = transformer.transform("%v.u")
         self.assertEqual(String('TESTING'), result)
 
+    def test_escaped_graves(self):
+        transformer = StringTransformer({}, {}, {})
+        text = 'a~`' * 5000 + '`b`'
+        self.assertEqual([], transformer.grave_parts_from_string('a~`b\\`c'))
+        self.assertEqual(['`b`'], transformer.grave_parts_from_string(text))
+
+    def test_symbol_table(self):
+        symbols = SymbolTable()
+        transformer = StringTransformer(symbols=symbols)
+        self.assertEqual(0, symbols.add_numbered_variable(String('zero')))
+        symbols.set_value_pair('sky', String('blue'))
+        symbols.set_value_pair('_sea', String('green'))
+        self.assertEqual(String('zero blue blue green'), transformer.transform('%0 %sky %_sky %_sea'))
+        # Only the canonical form of a number refers to a numbered variable
+        self.assertIsNone(symbols.lookup('00'))
+        # Named variables come before value pairs, and the first value pair with a name wins
+        symbols.set_variable('sky', String('grey'))
+        symbols.set_value_pair('_sky', String('red'))
+        self.assertEqual((String('grey'), String('blue')), (symbols.lookup('sky'), symbols.lookup('_sky')))
+        self.assertEqual(String('red'), symbols.lookup('__sky'))
+
+        parent = symbols.read_only_copy()
+        overlay = SymbolTable(parent)
+        self.assertEqual(1, overlay.add_numbered_variable(String('one')))
+        overlay.set_value_pair('sea', String('black'))
+        self.assertEqual(String('green'), overlay.lookup('_sea'))
+        self.assertEqual(String('black'), overlay.lookup('sea'))
+        overlay.clear_value_pairs()
+        self.assertIsNone(overlay.lookup('sea'))
+        self.assertEqual(String('one'), overlay.lookup('1'))
+        self.assertIsNone(parent.lookup('1'))
+        self.assertRaises(TypeError, parent.set_variable, 'sky', String('white'))
+
+    def test_templates(self):
+        transformer = StringTransformer({'v': String('testing'), 'w': String('%v'), 'n': Number(5), 'm': Map()}, {},
+                                        {0: String('hello')})
+        self.assertIs(PLAIN, compile_template('plain text'))
+        self.assertIsInstance(compile_template('TRUE'), TrueVal)
+        self.assertIs(GENERAL, compile_template('`%v`'))
+        self.assertIs(GENERAL, compile_template('%v %v.t(ing)'))  # %v is the start of %v.t(ing)
+        template = compile_template('%0, %v.t(ing): %x')
+        self.assertIsInstance(template, Template)
+        self.assertEqual(('', ', ', ': ', ''), template.literals)
+        self.assertEqual((('%0', '0', None), ('%v.t(ing)', 'v', 't(ing)'), ('%x', 'x', None)), template.references)
+        self.assertIs(template, compile_template('%0, %v.t(ing): %x'))
+
+        plain = String('plain text')
+        self.assertIs(plain, transformer.transform_string(plain))
+        for text in ['%0, %v.t(ing): %x', '%n', 'n=%n', '%m and more', 'false', '%w then %v', '`%0` %n']:
+            with self.subTest(text=text):
+                string = String.unescaped(text)
+                expected = transformer.transform(text, unescaped=True)
+                self.assertEqual(expected, transformer.transform_string(string))
+                self.assertEqual(expected, transformer.transform_string(string))
+                self.assertFalse(hasattr(string, 'template'))  # Strings are shared, so nothing is kept on them
+
+    def test_scan_references(self):
+        references = scan_references('`%0` ~`x %1.t.u:%name.t \\`')
+        self.assertEqual([(0, 4)], references.graved)
+        self.assertEqual([(1, 3, None), (9, 13, 11), (16, 23, None)], references.percent)
+        self.assertEqual([5, 24], references.escapes)
+        # A % followed by a space or a colon isn't a reference, but the search carries on after it
+        self.assertEqual([(4, 6, None)], scan_references('% x:%y').percent)
+        self.assertEqual([], scan_references('%:%').percent)
+
+    def test_scan_references_matches_searches(self):
+        fragments = ['%', '`', '~', '\\', ' ', ':', '.', '0', '12', 'a', 't', 'trim', '(', ')', '>', '%1.t', '`%']
+        transformer = StringTransformer({}, {}, {})
+        generator = random.Random(25)
+        for _ in range(20000):
+            text = ''.join(generator.choice(fragments) for _ in range(generator.randint(0, 12)))
+            self.assertEqual(find_grave_parts(text), transformer.grave_parts_from_string(text), text)
+            try:
+                expected = find_percent_parts(text)
+            except ValueError:
+                continue
+            self.assertEqual(expected, transformer.get_percent_parts_from_string(text), text)
+            for start, end, method_start in scan_references(text).percent:
+                if is_digit(text[start + 1]) and '.' in text[start:end]:
+                    self.assertEqual(text.index('.', start), method_start, text)
+                else:
+                    self.assertIsNone(method_start, text)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 
-from string_utils import EscapeStrings
+from string_utils import EscapeStrings, unescape
 
 
 class TestStringUtilsCase(unittest.TestCase):
@@ -14,6 +14,24 @@ class TestStringUtilsCase(unittest.TestCase):
         self.assertEqual(':', escaper.unescape('\\:'))
         self.assertEqual(':', escaper.unescape('~:'))
 
+    def test_single_pass(self):
+        # The result of one escape is never read as part of the next
+        self.assertEqual('\\(', unescape('\\\\('))
+        self.assertEqual('~:', unescape('~~:'))
+        self.assertEqual('\\n', unescape('\\\\n'))
+        self.assertEqual('\\\\', unescape('~\\\\'))
+        self.assertEqual('<!', unescape('~<~!'))
+        self.assertEqual('~a\\', unescape('~a\\'))
+        self.assertEqual('plain text', unescape('plain text'))
+
+    def test_unicode(self):
+        self.assertEqual('Zoë', unescape('Zo\\u00eB'))
+        self.assertEqual('\U0001f600', unescape('\\ud83d\\ude00'))
+        self.assertEqual('\ud83d!', unescape('\\ud83d!'))
+        self.assertEqual('\\u00e', unescape('\\u00e'))
+        self.assertEqual('~u00e9', unescape('~u00e9'))
+        self.assertEqual('\\u00e9', unescape('\\\\u00e9'))
+
 
 if __name__ == '__main__':
     unittest.main()
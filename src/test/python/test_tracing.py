@@ -0,0 +1,55 @@
+import logging
+import unittest
+
+import modl
+import parser
+import tracing
+
+
+class TracingTestCase(unittest.TestCase):
+    def record(self):
+        events = []
+        return events, lambda event, details: events.append((event, details))
+
+    def test_events(self):
+        for backend in [parser.ANTLR_BACKEND, parser.NATIVE_BACKEND]:
+            events, subscriber = self.record()
+            with tracing.subscribed(subscriber):
+                modl.to_json('a=1;b=[2;3]', backend)
+            with self.subTest(backend=backend):
+                names = [event for event, _ in events]
+                self.assertEqual('parse', names[0])
+                details = dict(events[0][1])
+                self.assertGreaterEqual(details.pop('seconds'), 0)
+                self.assertEqual({'backend': backend, 'structures': 2}, details)
+                if backend == parser.ANTLR_BACKEND:
+                    self.assertIn('process.item', names)
+                else:
+                    # The native backend builds the raw objects without processing a parse tree
+                    self.assertNotIn('process.item', names)
+                self.assertEqual(2, names.count('interpret.structure'))
+
+    def test_iter_parse_event(self):
+        events, subscriber = self.record()
+        with tracing.subscribed(subscriber):
+            list(modl.iter_interpret('a=1;b=2;c=3', parser.NATIVE_BACKEND))
+        parse_events = [details for event, details in events if event == 'parse']
+        self.assertEqual(1, len(parse_events))
+        self.assertEqual(3, parse_events[0]['structures'])
+
+    def test_unsubscribe(self):
+        events, subscriber = self.record()
+        with tracing.subscribed(subscriber):
+            pass
+        modl.to_json('a=1')
+        self.assertEqual([], events)
+        self.assertEqual([], tracing.subscribers)
+
+    def test_log_event(self):
+        with tracing.subscribed(tracing.log_event), self.assertLogs('modl', logging.DEBUG) as logs:
+            modl.to_json('a=1')
+        self.assertTrue(logs.output[0].startswith('DEBUG:modl:parse '))
+
+
+if __name__ == '__main__':
+    unittest.main()